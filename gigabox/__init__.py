@@ -0,0 +1,8 @@
+"""
+Generator for the laser-cut layers of a hitbox controller case.
+
+Importing the package is cheap: it only loads the geometry. ezdxf is loaded
+by gigabox.dxf and the matplotlib/PIL rendering stack by gigabox.render and
+gigabox.art, when those are used.
+"""
+from .geometry import DEFAULT_PARAMS, BoxParams, LayerGeometry, button_layout, record_layers
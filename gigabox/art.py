@@ -0,0 +1,395 @@
+"""
+Compositing customer artwork with the rendered box layout.
+"""
+import csv
+import json
+import math
+import os
+import time
+import zlib
+
+from PIL import Image
+
+from .geometry import DEFAULT_PARAMS
+from .pool import BuildResult, run_bounded
+from .render import ART_PADDING, convert_dxf2img
+from .spec import compile_layout
+from .trace import count, span, traced
+
+image_extensions = (".png", ".jpg", ".jpeg", ".webp", ".bmp", ".tif", ".tiff")
+# Artwork over this many pixels is decoded reduced, see load_art()
+large_art_pixels = 16_000_000
+# Print artwork can be far over PIL's decompression bomb limit, this is ours
+max_art_pixels = 2_000_000_000
+strip_pixels = 4_000_000  # pixels converted at a time when reducing artwork
+# The layout spec layer each side is composited with, and the suffix of its output
+ART_SIDES = {
+    "top": ("art", ""),
+    "bottom": ("bottom", "-bottom"),
+}
+
+
+@traced
+def render_overlay(layer, params=DEFAULT_PARAMS, cache=None, backend="native", spec=None):
+    """
+    Render a layer of the layout spec as a transparent overlay.
+
+    Args:
+    - layer: The layer key, "art" or "bottom".
+    - params: The BoxParams of the box.
+    - cache: An optional RenderCache, the overlay is then only rendered once
+      per layout.
+    - backend: The convert_dxf2img backend.
+    - spec: The layout spec, see spec.compile_layout().
+    """
+    geometry = compile_layout(params, spec).layers[layer]
+    size = (params.box_width, params.box_height)
+    if cache is not None:
+        return cache.render(geometry, backend, size=size)
+    return convert_dxf2img(geometry, backend, size=size)
+
+def _raw_strips(image, path):
+    # Rows of "raw" tiles are at fixed offsets in the file, read straight from there
+    layout = []
+    for name, (x0, y0, x1, y1), offset, args in image.tile:
+        args = args if isinstance(args, tuple) else (args,)
+        rawmode, stride, ystep = (args + (0, 1))[:3]
+        if name != "raw" or (x0, x1) != (0, image.width):
+            return None
+        try:
+            stride = stride or len(Image.new(image.mode, (image.width, 1)).tobytes("raw", rawmode))
+        except (ValueError, OSError):
+            return None
+        layout.append((y0, y1, offset, rawmode, stride, ystep))
+
+    def strips(rows):
+        with open(path, "rb") as f:
+            for top in range(0, image.height, rows):
+                bottom = min(top + rows, image.height)
+                pieces = []
+                for y0, y1, offset, rawmode, stride, ystep in layout:
+                    start, end = max(top, y0), min(bottom, y1)
+                    if start >= end:
+                        continue
+                    # Bottom up tiles (ystep -1) store their last row first
+                    f.seek(offset + ((start - y0) if ystep > 0 else (y1 - end)) * stride)
+                    pieces.append((start, Image.frombytes(image.mode, (image.width, end - start),
+                                                          f.read((end - start) * stride), "raw", rawmode, stride,
+                                                          ystep)))
+                if len(pieces) == 1:
+                    strip = pieces[0][1]
+                else:
+                    strip = Image.new(image.mode, (image.width, bottom - top))
+                    for start, piece in pieces:
+                        strip.paste(piece, (0, start - top))
+                if image.palette is not None:
+                    strip.palette = image.palette.copy()
+                yield top, strip
+    return strips
+
+
+def _png_chunks(f, name, size=1 << 16):
+    """The data of the name chunks of a PNG file, in pieces of up to size bytes."""
+    f.seek(8)
+    while True:
+        header = f.read(8)
+        if len(header) < 8 or header[4:] == b"IEND":
+            return
+        length = int.from_bytes(header[:4], "big")
+        if header[4:] != name:
+            f.seek(length + 4, os.SEEK_CUR)
+            continue
+        while length:
+            piece = f.read(min(length, size))
+            if not piece:
+                return
+            length -= len(piece)
+            yield piece
+        f.seek(4, os.SEEK_CUR)
+
+
+def _png_strips(image, path):
+    # The IDAT stream is inflated as it is read. Every strip is handed to
+    # PIL's PNG decoder on its own, as a stored zlib stream led by the last
+    # row of the strip before, unfiltered, for the filters that refer to it.
+    rawmode = image.tile[0][3]
+    channels = {"L": 1, "LA": 2, "RGB": 3, "RGBA": 4, "P": 1}.get(rawmode)
+    if len(image.tile) != 1 or channels is None or image.info.get("interlace"):
+        return None
+    row_bytes = image.width * channels + 1
+
+    def decode(data, rows):
+        decoded = Image.frombytes(image.mode, (image.width, rows + 1), zlib.compress(data, 0), "zip", rawmode)
+        if image.palette is not None:
+            decoded.palette = image.palette.copy()
+        return decoded
+
+    def strips(rows):
+        inflate = zlib.decompressobj()
+        prior = bytes(row_bytes)
+        pending = bytearray(prior)
+        top = 0
+        with open(path, "rb") as f:
+            for chunk in _png_chunks(f, b"IDAT"):
+                while chunk and top < image.height:
+                    size = row_bytes * (min(rows, image.height - top) + 1)
+                    pending += inflate.decompress(chunk, size - len(pending))
+                    chunk = inflate.unconsumed_tail
+                    if len(pending) == size:
+                        decoded = decode(pending, size // row_bytes - 1)
+                        yield top, decoded.crop((0, 1, image.width, decoded.height))
+                        top += decoded.height - 1
+                        prior = b"\0" + decoded.crop((0, decoded.height - 1, image.width, decoded.height)).tobytes(
+                            "raw", rawmode)
+                        pending = bytearray(prior)
+        pending += inflate.flush()
+        if top < image.height:
+            if len(pending) != row_bytes * (image.height - top + 1):
+                raise OSError(f"{path}: truncated PNG image data")
+            decoded = decode(pending, image.height - top)
+            yield top, decoded.crop((0, 1, image.width, decoded.height))
+    return strips
+
+
+def _strips(image, path):
+    """
+    A function of rows that yields (top, strip) for strips of rows rows of
+    image, decoded one at a time, or None if image can only be decoded
+    whole. Works for uncompressed formats (BMP, TGA, PPM, TIFF) and for 8 bit
+    non-interlaced PNGs.
+    """
+    if image.format == "PNG":
+        return _png_strips(image, path)
+    return _raw_strips(image, path)
+
+
+@traced
+def load_art(image_name, size, large=large_art_pixels):
+    """
+    Open artwork for compositing into an overlay of size (width, height).
+    Artwork over large pixels that has at least twice the resolution the
+    composite can show is decoded reduced, so the memory it takes is bounded
+    by the overlay size and the strip size, not the artwork: JPEGs at a
+    smaller DCT scale (Image.draft), PNGs and uncompressed formats strip by
+    strip, see _strips(). Other formats are decoded whole, then reduced.
+    Smaller artwork is opened as it is.
+
+    Args:
+    - image_name: Path of the artwork.
+    - size: Size of the overlay it is composited with.
+    - large: Pixel count from which artwork is reduced.
+    """
+    limit, Image.MAX_IMAGE_PIXELS = Image.MAX_IMAGE_PIXELS, max_art_pixels
+    try:
+        image = Image.open(image_name)
+    finally:
+        Image.MAX_IMAGE_PIXELS = limit
+    # The art fills the overlay less its padding
+    needed = (max(math.ceil(size[0] / (1 + 2 * ART_PADDING[0])), 1),
+              max(math.ceil(size[1] / (1 + 2 * ART_PADDING[1])), 1))
+    if image.width * image.height <= large or min(image.width // needed[0], image.height // needed[1]) < 2:
+        return image
+    count("art.reduced")
+    with span("decode_art"):
+        strips = None if image.draft(image.mode, needed) else _strips(image, image_name)
+        if strips is None:
+            if image.format != "JPEG":
+                count("art.full_decode")
+            image.load()
+    factor = min(image.width // needed[0], image.height // needed[1])
+    mode = image.mode if image.mode in ("RGB", "RGBA", "L") else "RGB"
+    if factor < 2:
+        return image if image.mode == mode else image.convert(mode)
+    if strips is None:
+        def strips(rows):
+            for top in range(0, image.height, rows):
+                yield top, image.crop((0, top, image.width, min(top + rows, image.height)))
+    with span("reduce_art", factor=factor):
+        reduced = Image.new(mode, (image.width // factor, image.height // factor))
+        for top, strip in strips(max(strip_pixels // image.width // factor, 1) * factor):
+            if top >= reduced.height * factor:
+                break
+            strip = strip.crop((0, 0, reduced.width * factor, min(strip.height, reduced.height * factor - top)))
+            if strip.mode != mode:
+                strip = strip.convert(mode)
+            reduced.paste(strip.reduce(factor), (0, top // factor))
+    image.close()
+    return reduced
+
+
+def combine_hitbox_layout_and_image(image_name, cache=None, params=DEFAULT_PARAMS, backend="native", spec=None):
+    hitbox_image = render_overlay("art", params, cache, backend, spec)
+
+    original_image = load_art(image_name, hitbox_image.size)
+    combined_image = composite_art(original_image, hitbox_image)
+    with span("save_image"):
+        combined_image.save("final.png")
+    print("finish top")
+
+
+def combine_hitbox_layout_and_image_bottom(image_name, cache=None, params=DEFAULT_PARAMS, backend="native",
+                                           spec=None):
+    hitbox_image = render_overlay("bottom", params, cache, backend, spec)
+
+    original_image = load_art(image_name, hitbox_image.size)
+    combined_image = composite_art(original_image, hitbox_image)
+    with span("save_image"):
+        combined_image.save("final-bottom.png")
+    print("finish bottom")
+
+
+def art_bounds(image):
+    """The bounding box of the pixels of image that are not black, found strip by strip."""
+    rows = max(strip_pixels // max(image.width, 1), 1)
+    bounds = None
+    for top in range(0, image.height, rows):
+        box = image.crop((0, top, image.width, min(top + rows, image.height))).convert("L").getbbox()
+        if box:
+            box = (box[0], box[1] + top, box[2], box[3] + top)
+            bounds = box if bounds is None else (min(bounds[0], box[0]), min(bounds[1], box[1]),
+                                                 max(bounds[2], box[2]), max(bounds[3], box[3]))
+    return bounds
+
+
+def visible_overlay_bbox(hitbox_image):
+    """The bounding box of the overlay pixels that are not black once pasted on black."""
+    on_black = Image.new("RGB", hitbox_image.size)
+    on_black.paste(hitbox_image, (0, 0), hitbox_image)
+    return on_black.convert("L").getbbox()
+
+
+@traced
+def composite_art(original_image, hitbox_image, overlay_bbox=None):
+    """
+    Pad the artwork with black by ART_PADDING, scale it to the overlay, paste
+    the overlay on top and crop the black margin. The crop box is worked out
+    up front: from the bounding box of the artwork, shifted by the padding
+    and scaled to the overlay, joined with the bounding box of the overlay
+    strokes. No padded copy of the artwork is made, only the part of it in
+    the crop is resized, and its bounding box is found strip by strip.
+
+    Args:
+    - original_image: The customer artwork.
+    - hitbox_image: The rendered RGBA overlay.
+    - overlay_bbox: visible_overlay_bbox(hitbox_image), pass it in when the
+      same overlay is used for many images.
+    """
+    if original_image.mode not in ("RGB", "RGBA", "L"):
+        original_image = original_image.convert("RGB")
+    width, height = hitbox_image.size
+    padding_width = int(original_image.width * ART_PADDING[0])
+    padding_height = int(original_image.height * ART_PADDING[1])
+    scale_x = width / (original_image.width + 2 * padding_width)
+    scale_y = height / (original_image.height + 2 * padding_height)
+
+    boxes = []
+    art_bbox = art_bounds(original_image)
+    if art_bbox:
+        x0, y0, x1, y1 = art_bbox
+        boxes.append((math.floor((x0 + padding_width) * scale_x), math.floor((y0 + padding_height) * scale_y),
+                      math.ceil((x1 + padding_width) * scale_x), math.ceil((y1 + padding_height) * scale_y)))
+    if overlay_bbox is None:
+        overlay_bbox = visible_overlay_bbox(hitbox_image)
+    if overlay_bbox:
+        boxes.append(overlay_bbox)
+    if not boxes:
+        boxes.append((0, 0, width, height))
+    crop = (max(min(b[0] for b in boxes), 0), max(min(b[1] for b in boxes), 0),
+            min(max(b[2] for b in boxes), width), min(max(b[3] for b in boxes), height))
+
+    # The padding is black: only the part of the crop the art covers is resized, onto a black canvas
+    combined_image = Image.new(original_image.mode, (crop[2] - crop[0], crop[3] - crop[1]), "black")
+    left, top = max(math.ceil(padding_width * scale_x), crop[0]), max(math.ceil(padding_height * scale_y), crop[1])
+    right = min(math.floor((padding_width + original_image.width) * scale_x), crop[2])
+    bottom = min(math.floor((padding_height + original_image.height) * scale_y), crop[3])
+    if left < right and top < bottom:
+        source_box = (max(left / scale_x - padding_width, 0), max(top / scale_y - padding_height, 0),
+                      min(right / scale_x - padding_width, original_image.width),
+                      min(bottom / scale_y - padding_height, original_image.height))
+        art = original_image.resize((right - left, bottom - top), box=source_box)
+        combined_image.paste(art, (left - crop[0], top - crop[1]))
+    overlay = hitbox_image.crop(crop)
+    combined_image.paste(overlay, (0, 0), overlay)
+    return combined_image
+
+
+def iter_art_jobs(source):
+    """
+    Yield (image_path, name) for a directory of artworks or a manifest. A
+    manifest is a .csv with "image" and optional "name" columns, a .jsonl
+    with the same keys, or a plain list of image paths. Relative paths are
+    resolved against the manifest's directory.
+    """
+    if os.path.isdir(source):
+        for entry in sorted(os.scandir(source), key=lambda e: e.name):
+            if entry.is_file() and entry.name.lower().endswith(image_extensions):
+                yield entry.path, os.path.splitext(entry.name)[0]
+        return
+
+    base = os.path.dirname(source)
+    with open(source, newline="") as f:
+        if source.endswith(".csv"):
+            rows = csv.DictReader(f)
+        elif source.endswith(".jsonl"):
+            rows = (json.loads(line) for line in f if line.strip())
+        else:
+            rows = ({"image": line.strip()} for line in f if line.strip())
+        for row in rows:
+            path = os.path.join(base, row["image"])
+            yield path, row.get("name") or os.path.splitext(os.path.basename(path))[0]
+
+
+_overlays = {}
+
+
+def _init_art_worker(overlays):
+    _overlays.update(overlays)
+
+
+def composite_art_file(image_path, name, sides, out_dir):
+    """
+    Composite one artwork with the worker's overlays, decoding it only once
+    for all sides. Returns a BuildResult per side.
+    """
+    results = []
+    try:
+        size = max((_overlays[side][0].size for side in sides), key=lambda size: size[0] * size[1])
+        with load_art(image_path, size) as original_image:
+            original_image.load()
+            for side in sides:
+                start = time.perf_counter()
+                out_path = os.path.join(out_dir, f"{name}{ART_SIDES[side][1]}.png")
+                hitbox_image, overlay_bbox = _overlays[side]
+                combined_image = composite_art(original_image, hitbox_image, overlay_bbox)
+                with span("save_image"):
+                    combined_image.save(out_path, compress_level=1)
+                results.append(BuildResult(name, out_path, True, time.perf_counter() - start))
+    except Exception as e:
+        results.append(BuildResult(name, image_path, False, 0, repr(e)))
+    return results
+
+
+def composite_batch(source, out_dir, sides=("top",), params=DEFAULT_PARAMS, jobs=None, cache=None, spec=None):
+    """
+    Composite every artwork of a directory or manifest with the shared
+    layout overlays on a process pool, yielding a BuildResult per output.
+    The overlays are rendered once and handed to each worker when it starts.
+
+    Args:
+    - source: A directory of images or a manifest, see iter_art_jobs().
+    - out_dir: Output directory, files are named <name>.png and <name>-bottom.png.
+    - sides: Which overlays to composite with, "top" and/or "bottom".
+    - params: The BoxParams of the box.
+    - jobs: Number of worker processes, defaults to one per CPU.
+    - cache: An optional RenderCache for the overlays.
+    - spec: The layout spec, see spec.compile_layout().
+    """
+    overlays = {}
+    for side in sides:
+        hitbox_image = render_overlay(ART_SIDES[side][0], params, cache, spec=spec)
+        overlays[side] = hitbox_image, visible_overlay_bbox(hitbox_image)
+    os.makedirs(out_dir, exist_ok=True)
+
+    tasks = ((image_path, name, sides, out_dir) for image_path, name in iter_art_jobs(source))
+    for results in run_bounded(composite_art_file, tasks, jobs, _init_art_worker, (overlays,)):
+        yield from results
@@ -0,0 +1,293 @@
+"""
+Benchmarks for the generator, writer, render and compositing stages, run
+with `python -m gigabox.bench`. Every stage is timed, its peak heap is
+measured with tracemalloc (Python and NumPy allocations; Pillow's image
+buffers are not traced) and the bytes it writes are counted. Results can be
+saved as a baseline and later runs compared against it.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+from PIL import Image
+
+from . import build, dxf
+from .geometry import record_layers
+from .spec import compile_layout
+
+baseline_file = os.path.join("benchmarks", "baseline.json")
+regression_threshold = 0.25  # fraction a metric may grow before it counts as a regression
+noise_floor = {"seconds": 0.005, "peak_bytes": 1024 * 1024, "output_bytes": 1024}
+WORKLOADS = ("plate", "sweep", "large-art")
+sweep_size = 100
+large_art_size = (8000, 4000)
+
+
+def _art_image(path, size):
+    """A deterministic colourful test image with a black border, like real art."""
+    width, height = size
+    x = np.linspace(0, 255, width, dtype=np.float32)[None, :]
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    pixels = np.stack(np.broadcast_arrays(x, y, (x + y) / 2), axis=-1).astype(np.uint8)
+    pixels[:height // 20] = 0
+    Image.fromarray(pixels, "RGB").save(path, quality=90)
+
+
+def _sweep(writer):
+    grid = {"button_spacing": [f"{value:.4f}" for value in np.linspace(2.6, 3.2, sweep_size)]}
+    return lambda: list(build.build_variants(build.iter_variants(grid=grid), "variants", jobs=1, writer=writer))
+
+
+def _nest():
+    from .nest import pack, variant_parts
+    grid = {"button_spacing": [f"{value:.4f}" for value in np.linspace(2.6, 3.2, sweep_size)]}
+    parts = list(variant_parts(build.iter_variants(grid=grid)))
+    return lambda: pack(parts)
+
+
+def _mesh():
+    from .stack import stack_meshes, write_mesh
+    layers = compile_layout().layers
+    return lambda: write_mesh("stack.stl", stack_meshes(layers)[0])
+
+
+def _golden(root):
+    from .golden import diff_golden
+    # The same geometry from both writers, so no file can be skipped as byte for byte the same
+    golden, new = os.path.join(root, "golden"), os.path.join(root, "new")
+    grid = {"button_spacing": [f"{value:.4f}" for value in np.linspace(2.6, 3.2, sweep_size)]}
+    for out_dir, writer in ((golden, "stream"), (new, "ezdxf")):
+        for result in build.build_variants(build.iter_variants(grid=grid), out_dir, writer=writer):
+            if not result.ok:
+                raise RuntimeError(f"{result.name}: {result.error}")
+    return lambda: list(diff_golden(golden, new, jobs=1))
+
+
+def _render(backend):
+    from .render import convert_dxf2img
+    geometry = compile_layout().layers["art"]
+    return lambda: convert_dxf2img(geometry, backend)
+
+
+def _preview(make):
+    from .render import PreviewPyramid
+    geometry = compile_layout().layers["art"]
+    return lambda: make(PreviewPyramid(geometry))
+
+
+def _reduced_preview():
+    # The levels of PreviewPyramid.all() each reduced from the next finer one, as the matplotlib
+    # backend makes them, to weigh against rasterizing every native level
+    from .render import PREVIEW_DPIS, _reduce, canvas_size, rasterize, thumbnail_width
+    geometry = compile_layout().layers["art"]
+    dpis = sorted(PREVIEW_DPIS, reverse=True)
+
+    def run():
+        image = rasterize(geometry, dpi=dpis[0])
+        for dpi in dpis[1:] + [thumbnail_width / canvas_size(1)[0]]:
+            image = _reduce(image, canvas_size(dpi))
+    return run
+
+
+def _composite(image_name):
+    from .art import combine_hitbox_layout_and_image
+    return lambda: combine_hitbox_layout_and_image(image_name)
+
+
+def workloads(root, selected=WORKLOADS):
+    """
+    The stages of the selected workloads, as (stage name, function) pairs.
+    Inputs such as test images are made under root up front, outside the
+    timing.
+    """
+    stages = {}
+    if "plate" in selected:
+        art = os.path.join(root, "art.jpg")
+        _art_image(art, (2000, 1000))
+        stages["plate"] = _plate_stages(art)
+    if "sweep" in selected:
+        stages["sweep"] = [(f"build_variants[{writer}]x{sweep_size}", _sweep(writer)) for writer in build.WRITERS]
+        stages["sweep"].append((f"pack[{sweep_size * 6} parts]", _nest()))
+        stages["sweep"].append((f"diff_golden[{sweep_size * len(build.BUILD_TARGETS)} files]", _golden(root)))
+    if "large-art" in selected:
+        large_art = os.path.join(root, "large-art.jpg")
+        _art_image(large_art, large_art_size)
+        stages["large-art"] = [(f"combine_hitbox_layout_and_image[{large_art_size[0]}x{large_art_size[1]}]",
+                                _composite(large_art))]
+    return stages
+
+
+def _plate_stages(art):
+    plate = [(f"create_dxf_layer{layer}", lambda layer=layer: dxf.create_dxf_layer(layer, f"layer{layer}.dxf"))
+             for layer in range(1, 7)]
+    plate += [
+        ("record_layers", lambda: record_layers()),
+        ("compile_layout", lambda: compile_layout()),
+        ("compile_layout[blocks]", lambda: compile_layout(blocks=True)),
+        ("stack_meshes+write_stl", _mesh()),
+        ("create_dxf_total", lambda: dxf.create_dxf_total("total.dxf")),
+        ("create_dxf_art", lambda: dxf.create_dxf_art()),
+        ("build_all[ezdxf]", lambda: list(build.build_all(jobs=1))),
+        ("build_all[stream]", lambda: list(build.build_all(jobs=1, writer="stream"))),
+        ("build_all[svg]", lambda: list(build.build_all(jobs=1, writer="svg"))),
+        ("build_all[stream+svg+pdf+gcode]",
+         lambda: list(build.build_all(jobs=1, writer=("stream", "svg", "pdf", "gcode")))),
+        ("convert_dxf2img[native]", _render("native")),
+        ("PreviewPyramid.draft", _preview(lambda pyramid: pyramid.draft())),
+        ("PreviewPyramid.all", _preview(lambda pyramid: pyramid.all())),
+        ("PreviewPyramid.all[reduced]", _reduced_preview()),
+        ("convert_dxf2img[matplotlib]", _render("matplotlib")),
+        ("combine_hitbox_layout_and_image", _composite(art)),
+    ]
+    return plate
+
+
+def _written_bytes(directory):
+    return sum(os.path.getsize(os.path.join(path, name)) for path, dirs, files in os.walk(directory) for name in files)
+
+
+def measure(function, root, repeat=3):
+    """
+    Run function once under tracemalloc, which also warms up imports and
+    caches, then repeat times for the timing, each run in a new empty
+    working directory under root.
+
+    Returns a dict of the best and median seconds, the peak traced heap and
+    the bytes written by one run.
+    """
+    times = []
+    cwd = os.getcwd()
+    for run in range(repeat + 1):
+        work_dir = tempfile.mkdtemp(dir=root)
+        os.chdir(work_dir)
+        os.makedirs(dxf.output_dxf_dir, exist_ok=True)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                if run == 0:
+                    tracemalloc.start()
+                    try:
+                        function()
+                        peak = tracemalloc.get_traced_memory()[1]
+                    finally:
+                        tracemalloc.stop()
+                else:
+                    start = time.perf_counter()
+                    function()
+                    times.append(time.perf_counter() - start)
+        finally:
+            os.chdir(cwd)
+        output_bytes = _written_bytes(work_dir)
+    return {"seconds": min(times), "median": statistics.median(times), "peak_bytes": peak,
+            "output_bytes": output_bytes}
+
+
+def run(selected=WORKLOADS, repeat=3, root=None, progress=None):
+    """
+    Run the stages of the selected workloads and return the results keyed by
+    "workload/stage".
+    """
+    with tempfile.TemporaryDirectory(dir=root) as tmp:
+        results = {}
+        for workload, stages in workloads(tmp, selected).items():
+            for stage, function in stages:
+                key = f"{workload}/{stage}"
+                try:
+                    results[key] = measure(function, tmp, repeat)
+                except ImportError as e:
+                    # The matplotlib backend is optional
+                    results[key] = {"skipped": str(e)}
+                if progress:
+                    progress(key, results[key])
+        return results
+
+
+def compare(results, baseline, threshold=regression_threshold):
+    """
+    Regressions of results against baseline, as (key, metric, old, new)
+    tuples: seconds, peak_bytes or output_bytes that grew by more than
+    threshold. Values under the noise floor are compared as the floor.
+    """
+    regressions = []
+    for key, result in results.items():
+        old = baseline.get(key)
+        if not old or "skipped" in result or "skipped" in old:
+            continue
+        for metric, floor in noise_floor.items():
+            if max(result[metric], floor) > max(old[metric], floor) * (1 + threshold):
+                regressions.append((key, metric, old[metric], result[metric]))
+    return regressions
+
+
+def unbaselined(results, baseline):
+    """The keys of results that baseline has no measurement to compare with."""
+    return [key for key, result in results.items() if "skipped" not in result and
+            (key not in baseline or "skipped" in baseline[key])]
+
+
+def format_row(key, result, baseline=None):
+    if "skipped" in result:
+        return f"{key:<56} skipped: {result['skipped']}"
+    row = (f"{key:<56} {result['seconds'] * 1000:9.1f}ms {result['median'] * 1000:9.1f}ms "
+           f"{result['peak_bytes'] / 2 ** 20:8.1f}MB {result['output_bytes']:>10,}B")
+    old = (baseline or {}).get(key)
+    if old and "skipped" not in old and old["seconds"]:
+        row += f"  {(result['seconds'] / old['seconds'] - 1) * 100:+6.1f}%"
+    return row
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the gigabox stages.")
+    parser.add_argument("workloads", nargs="*", metavar="workload",
+                        help="workloads to run: plate, sweep or large-art (default: all)")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per stage, the best counts")
+    parser.add_argument("--baseline", metavar="FILE", default=baseline_file,
+                        help="baseline to compare against, the run fails without one unless --save is given "
+                             "(default: %(default)s)")
+    parser.add_argument("--save", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=regression_threshold,
+                        help="allowed growth before a regression fails the run (default: %(default)s)")
+    args = parser.parse_args(argv)
+    unknown = set(args.workloads) - set(WORKLOADS)
+    if unknown:
+        parser.error(f"unknown workload: {', '.join(sorted(unknown))}")
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1")
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    elif not args.save:
+        print(f"NO BASELINE {args.baseline} does not exist, nothing can be compared; make one with --save",
+              file=sys.stderr)
+
+    print(f"{'stage':<56} {'best':>11} {'median':>11} {'peak':>10} {'written':>11}")
+    results = run(args.workloads or WORKLOADS, args.repeat,
+                  progress=lambda key, result: print(format_row(key, result, baseline), flush=True))
+
+    regressions = compare(results, baseline, args.threshold)
+    for key, metric, old, new in regressions:
+        print(f"REGRESSION {key} {metric}: {old:.4g} -> {new:.4g}")
+    # A stage without a baseline would pass whatever it measures
+    missing = [] if args.save else unbaselined(results, baseline)
+    for key in missing:
+        print(f"NO BASELINE {key}")
+    if args.save:
+        os.makedirs(os.path.dirname(args.baseline) or ".", exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump({**baseline, **results}, f, indent=2, sort_keys=True)
+        print(f"saved {args.baseline}")
+        return 1 if regressions else 0
+    return 1 if regressions or missing else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
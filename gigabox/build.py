@@ -0,0 +1,414 @@
+"""
+Building the DXF targets and batches of parametric variants on a process pool.
+"""
+import csv
+import hashlib
+import itertools
+import json
+import os
+import time
+from dataclasses import asdict, replace
+
+import ezdxf
+
+from .dxf import compose_total, create_dxf_layer, deterministic_version, output_dxf_dir, save_geometry, saveas
+from .geometry import DEFAULT_PARAMS, LAYER_DRAWERS, PARAM_FIELDS, check_param
+from .pool import BuildResult, run_bounded
+from .spec import compile_layout
+from .stream import write_geometries
+from .toolpath import optimize_toolpath
+from .trace import count, span
+
+
+def _write_layer(layer):
+    return lambda geometries, path, deterministic: create_dxf_layer(
+        layer, path, geometry=geometries[layer], deterministic=deterministic)
+
+
+# Build targets, keyed by output file name: the recorded geometries each one
+# is made from, and how it is written. build_all() records every geometry
+# once, so no layer is drawn twice in a run.
+BUILD_TARGETS = {
+    "total.dxf": (tuple(LAYER_DRAWERS), lambda geometries, path, deterministic: saveas(
+        compose_total(geometries), path, deterministic)),
+    "layer1.dxf": ((1,), _write_layer(1)),  # 3mm
+    "layer2.dxf": ((2,), _write_layer(2)),  # 3mm
+    "layer3.dxf": ((3,), _write_layer(3)),  # 1.6mm
+    "layer4.dxf": ((4,), _write_layer(4)),  # 1.6mm
+    "layer5.dxf": ((5,), _write_layer(5)),  # 3mm
+    "layer6.dxf": ((6,), _write_layer(6)),  # 3mm
+    "layer-art.dxf": (("art",), lambda geometries, path, deterministic: save_geometry(
+        geometries["art"], path, deterministic)),
+}
+manifest_name = ".manifest.json"
+# The SHA-256 of every file written, in the format of sha256sum
+checksums_name = "SHA256SUMS"
+# How targets are written: with ezdxf, or streamed as minimal R12 DXF, SVG,
+# PDF or laser G-code. The extension each writer gives its files:
+WRITER_EXTENSIONS = {"ezdxf": ".dxf", "stream": ".dxf", "svg": ".svg", "pdf": ".pdf", "gcode": ".gcode"}
+WRITERS = tuple(WRITER_EXTENSIONS)
+
+
+def record_targets(params=DEFAULT_PARAMS, toolpath=False, blocks=False, spec=None, ir_cache=None):
+    """
+    Compile the six layers and the art layer from a layout spec, keyed like
+    the BUILD_TARGETS sources. With toolpath=True the six layers are merged
+    and ordered for the laser by toolpath.optimize_toolpath(), which leaves
+    them flat; with blocks=True repeated features become block references.
+    spec and ir_cache are passed on to spec.compile_layout().
+    """
+    layers = compile_layout(params, spec, blocks, ir_cache).layers
+    missing = [str(key) for key in (*LAYER_DRAWERS, "art") if key not in layers]
+    if missing:
+        raise ValueError(f"the layout spec has no layers {', '.join(missing)}")
+    geometries = {layer: layers[layer] for layer in LAYER_DRAWERS}
+    if toolpath:
+        geometries = {layer: optimize_toolpath(geometry) for layer, geometry in geometries.items()}
+    # The art layer is always written flat
+    geometries["art"] = layers["art"].explode()
+    return geometries
+
+
+def target_fingerprint(name, geometries, writer="ezdxf", deterministic=False):
+    """
+    Fingerprint everything that goes into a target: the recorded geometry of
+    its sources, which reflects both the parameters and the draw functions,
+    and the writer (and ezdxf version) that writes it.
+    """
+    sources, write = BUILD_TARGETS[name]
+    key = f"{name}:{ezdxf.__version__ if writer == 'ezdxf' else writer}"
+    if deterministic and writer == "ezdxf":
+        key += f":deterministic{deterministic_version}"
+    digest = hashlib.sha256(key.encode())
+    for source in sources:
+        digest.update(geometries[source].fingerprint().encode())
+    return digest.hexdigest()
+
+
+def read_manifest(out_dir):
+    try:
+        with open(os.path.join(out_dir, manifest_name)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def write_manifest(out_dir, manifest):
+    path = os.path.join(out_dir, manifest_name)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def file_digest(path):
+    """The SHA-256 of the bytes of a file, as hex."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_checksums(out_dir):
+    """File name to SHA-256 from the SHA256SUMS of out_dir, empty when there is none."""
+    try:
+        with open(os.path.join(out_dir, checksums_name)) as f:
+            return {name: digest for digest, name in (line.rstrip("\n").split("  ", 1) for line in f if line.strip())}
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def write_checksums(out_dir, checksums):
+    path = os.path.join(out_dir, checksums_name)
+    with open(path + ".tmp", "w") as f:
+        f.writelines(f"{checksums[name]}  {name}\n" for name in sorted(checksums))
+    os.replace(path + ".tmp", path)
+
+
+def target_path(name, out_dir, writer="ezdxf"):
+    """Where a target is written, with the extension of the writer."""
+    return os.path.join(out_dir, os.path.splitext(name)[0] + WRITER_EXTENSIONS[writer])
+
+
+def writer_list(writer):
+    """
+    The writers to run as a tuple, from one writer name or several.
+    Every format is written from the same recorded geometry, so asking for
+    more of them costs only the writing.
+    """
+    writers = (writer,) if isinstance(writer, str) else tuple(dict.fromkeys(writer))
+    unknown = [name for name in writers if name not in WRITER_EXTENSIONS]
+    if unknown:
+        raise ValueError(f"unknown writers: {', '.join(unknown)}")
+    extensions = [WRITER_EXTENSIONS[name] for name in writers]
+    if len(set(extensions)) < len(extensions):
+        raise ValueError(f"writers {', '.join(writers)} would write the same files")
+    return writers
+
+
+def write_target(name, geometries, path, writer="ezdxf", deterministic=False):
+    """
+    Write a target to path and return the SHA-256 of the file. The file is
+    written next to path first and an existing file with the same bytes is
+    left alone, so its modification time only changes with its content.
+
+    Args:
+    - name: The output file name of the target, e.g. "layer1.dxf".
+    - geometries: The recorded geometries, as returned by record_targets().
+    - path: Where to write it.
+    - writer: One of WRITERS.
+    - deterministic: Write the same bytes for the same geometry, see
+      dxf.saveas(). The streaming writers always do.
+    """
+    sources, write = BUILD_TARGETS[name]
+    base, extension = os.path.splitext(path)
+    # Keep the extension, the stream writers pick the format by it
+    written = f"{base}.tmp{extension}"
+    with span("write_target", target=name, writer=writer):
+        if writer == "ezdxf":
+            write(geometries, written, deterministic)
+        else:
+            # Same layer names as compose_total() when a target has several sources
+            write_geometries(written, [(f"layer{source}" if len(sources) > 1 else "0", geometries[source])
+                                       for source in sources])
+        digest = file_digest(written)
+        if os.path.exists(path) and file_digest(path) == digest:
+            os.remove(written)
+            count("write_target.unchanged")
+        else:
+            os.replace(written, path)
+    count(f"{os.path.basename(path)}.bytes", os.path.getsize(path))
+    return digest
+
+
+def build_target(name, geometries, out_dir=output_dxf_dir, writer="ezdxf", deterministic=False):
+    """
+    Build a single target from BUILD_TARGETS and report how it went.
+
+    Args:
+    - name: The output file name of the target, e.g. "layer1.dxf".
+    - geometries: The recorded geometries, as returned by record_targets().
+    - out_dir: Directory the file is written to.
+    - writer: One of WRITERS.
+    - deterministic: Write the same bytes for the same geometry.
+    """
+    start = time.perf_counter()
+    path = target_path(name, out_dir, writer)
+    try:
+        digest = write_target(name, geometries, path, writer, deterministic)
+    except Exception as e:
+        return BuildResult(name, path, False, time.perf_counter() - start, repr(e))
+    return BuildResult(name, path, True, time.perf_counter() - start, digest=digest)
+
+
+def build_all(targets=None, jobs=None, params=DEFAULT_PARAMS, incremental=False, out_dir=output_dxf_dir,
+              toolpath=False, blocks=False, writer="ezdxf", spec=None, ir_cache=None, deterministic=False):
+    """
+    Build the given targets on a process pool, yielding a BuildResult as each
+    one finishes. The fingerprint of every target written is kept in a
+    manifest next to the outputs, and the SHA-256 of every file in
+    SHA256SUMS.
+
+    Args:
+    - targets: Target names to build, defaults to all of BUILD_TARGETS.
+    - jobs: Number of worker processes, defaults to one per CPU. With jobs=1
+      everything runs in the current process.
+    - params: The BoxParams to build.
+    - incremental: Skip targets whose fingerprint matches the manifest and
+      whose file still exists.
+    - out_dir: Output directory.
+    - toolpath: Write the layers as optimized laser toolpaths.
+    - blocks: Write repeated features as blocks and block references.
+    - writer: One of WRITERS, or a list of them to write every target in
+      each format. The geometry is recorded once and all the files are
+      written concurrently on the pool.
+    - spec: Path of the layout spec, defaults to the built-in one.
+    - ir_cache: Directory to keep compiled layouts in between runs.
+    - deterministic: Write the same bytes for the same geometry, so files
+      can be deduplicated by their SHA-256.
+    """
+    writers = writer_list(writer)
+    if targets is None:
+        targets = list(BUILD_TARGETS)
+    unknown = [name for name in targets if name not in BUILD_TARGETS]
+    if unknown:
+        raise ValueError(f"unknown build targets: {', '.join(unknown)}")
+
+    os.makedirs(out_dir, exist_ok=True)
+    # Draw every layer once here; the workers only replay and save them.
+    geometries = record_targets(params, toolpath, blocks, spec, ir_cache)
+    # The manifest is keyed by the file written, so the outputs of different formats do not mix
+    fingerprints = {os.path.basename(target_path(name, out_dir, w)): target_fingerprint(name, geometries, w,
+                                                                                          deterministic)
+                    for name in targets for w in writers}
+    manifest = read_manifest(out_dir)
+    checksums = read_checksums(out_dir)
+
+    stale = []
+    for name in targets:
+        for w in writers:
+            path = target_path(name, out_dir, w)
+            file_name = os.path.basename(path)
+            if incremental and manifest.get(file_name) == fingerprints[file_name] and os.path.exists(path):
+                yield BuildResult(name, path, True, 0, skipped=True, digest=checksums.get(file_name))
+            else:
+                stale.append((name, w))
+
+    tasks = ((name, {source: geometries[source] for source in BUILD_TARGETS[name][0]}, out_dir, w, deterministic)
+             for name, w in stale)
+    try:
+        for result in run_bounded(build_target, tasks, jobs if stale else 1):
+            file_name = os.path.basename(result.path)
+            if result.ok:
+                manifest[file_name] = fingerprints[file_name]
+                checksums[file_name] = result.digest
+            else:
+                manifest.pop(file_name, None)
+                checksums.pop(file_name, None)
+            yield result
+    finally:
+        # A build that wrote nothing leaves the directory as it was
+        if stale:
+            write_manifest(out_dir, manifest)
+            write_checksums(out_dir, checksums)
+
+
+def load_params_file(path):
+    """Read BoxParams from a JSON object of parameter overrides."""
+    with open(path) as f:
+        overrides = parse_params(json.load(f))
+    if any(isinstance(value, list) for value in overrides.values()):
+        raise ValueError(f"{path}: a parameter file takes single values, use --grid for lists")
+    return replace(DEFAULT_PARAMS, **overrides)
+
+
+def parse_params(row):
+    """
+    Turn one parameter row into BoxParams overrides. Values may be strings,
+    as read from a CSV file; empty values keep the default. Raises
+    ValueError naming the field for values that are not finite or out of
+    range, see geometry.check_param().
+
+    Args:
+    - row: A mapping of BoxParams field names to values. A "name" key is ignored.
+    """
+    overrides = {}
+    for key, value in row.items():
+        if key == "name" or value is None or value == "":
+            continue
+        if key not in PARAM_FIELDS:
+            raise ValueError(f"unknown parameter: {key}")
+        overrides[key] = [check_param(key, v) for v in value] if isinstance(value, list) else check_param(key, value)
+    return overrides
+
+
+def read_param_sets(path):
+    """
+    Lazily read parameter rows from a CSV file (one column per parameter) or
+    a JSONL file (one object per line).
+
+    Args:
+    - path: Path of the .csv or .jsonl file.
+    """
+    with open(path, newline="") as f:
+        if path.endswith(".csv"):
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def iter_variants(param_sets=None, grid=None):
+    """
+    Yield (name, BoxParams) for every variant. List values in a row, and the
+    lists in grid, are expanded into all their combinations. A row that
+    parse_params() rejects yields (name, ValueError) instead, which
+    build_variant() reports as a failed variant while the other rows build.
+
+    Args:
+    - param_sets: Iterable of parameter rows, defaults to a single row of defaults.
+    - grid: Mapping of parameter name to a list of values, applied to every row.
+    """
+    grid = grid or {}
+    for index, row in enumerate(param_sets or [{}]):
+        name = row.get("name") or f"variant-{index:05d}"
+        try:
+            overrides = {**parse_params(row), **parse_params(grid)}
+        except ValueError as e:
+            yield name, e
+            continue
+        keys = [key for key, value in overrides.items() if isinstance(value, list)]
+        combinations = list(itertools.product(*(overrides[key] for key in keys)))
+        for number, values in enumerate(combinations):
+            params = replace(DEFAULT_PARAMS, **{**overrides, **dict(zip(keys, values))})
+            yield (name if len(combinations) == 1 else f"{name}-{number:03d}"), params
+
+
+def build_variant(name, params, out_dir, toolpath=False, blocks=False, writer="ezdxf", spec=None, ir_cache=None,
+                  deterministic=False):
+    """
+    Write the complete layer set of one variant to out_dir/name: layer1.dxf
+    ... layer6.dxf, total.dxf, layer-art.dxf and the params.json used, in
+    the format of every writer given, and their SHA256SUMS. The digest of
+    the result is the SHA-256 of SHA256SUMS, which addresses the whole set.
+    """
+    start = time.perf_counter()
+    variant_dir = os.path.join(out_dir, name)
+    if isinstance(params, Exception):
+        # A row iter_variants() could not parse, nothing is written for it
+        return BuildResult(name, variant_dir, False, 0, repr(params))
+    try:
+        writers = writer_list(writer)
+        os.makedirs(variant_dir, exist_ok=True)
+        geometries = record_targets(params, toolpath, blocks, spec, ir_cache)
+        checksums = {}
+        for target in BUILD_TARGETS:
+            for w in writers:
+                path = target_path(target, variant_dir, w)
+                checksums[os.path.basename(path)] = write_target(target, geometries, path, w, deterministic)
+
+        with open(os.path.join(variant_dir, "params.json"), "w") as f:
+            json.dump(asdict(params), f, indent=2)
+        checksums["params.json"] = file_digest(os.path.join(variant_dir, "params.json"))
+        write_checksums(variant_dir, checksums)
+    except Exception as e:
+        return BuildResult(name, variant_dir, False, time.perf_counter() - start, repr(e))
+    return BuildResult(name, variant_dir, True, time.perf_counter() - start,
+                       digest=file_digest(os.path.join(variant_dir, checksums_name)))
+
+
+def build_variants(variants, out_dir, jobs=None, toolpath=False, blocks=False, writer="ezdxf", spec=None,
+                   ir_cache=None, deterministic=False):
+    """
+    Build variants on a process pool and yield a BuildResult for each one as
+    it is written. Variants are pulled from the iterable only as workers free
+    up, so memory stays bounded however many variants there are.
+
+    Args:
+    - variants: Iterable of (name, BoxParams), e.g. from iter_variants().
+    - out_dir: Directory that gets one sub directory per variant.
+    - jobs: Number of worker processes, defaults to one per CPU. With jobs=1
+      everything runs in the current process.
+    - toolpath: Write the layers as optimized laser toolpaths.
+    - blocks: Write repeated features as blocks and block references.
+    - writer: One of WRITERS, or a list of them.
+    - spec: Path of the layout spec, defaults to the built-in one.
+    - ir_cache: Directory to keep compiled layouts in between runs.
+    - deterministic: Write the same bytes for the same geometry.
+    """
+    writer_list(writer)
+    tasks = ((name, params, out_dir, toolpath, blocks, writer, spec, ir_cache, deterministic)
+             for name, params in variants)
+    return run_bounded(build_variant, tasks, jobs)
+
+
+def parse_grid(specs):
+    """Parse --grid options of the form key=v1,v2,... into a grid mapping."""
+    grid = {}
+    for spec in specs:
+        key, sep, values = spec.partition("=")
+        if not sep or not values:
+            raise ValueError(f"expected key=v1,v2,... but got {spec!r}")
+        grid[key.strip()] = values.split(",")
+    return grid
@@ -0,0 +1,118 @@
+"""
+Content-addressed on-disk cache for rendered layout overlays.
+"""
+import hashlib
+import json
+import os
+import tempfile
+
+from PIL import Image
+
+from .geometry import iter_primitives
+from .render import convert_dxf2img, rasterize, render_settings
+
+render_cache_dir = os.path.join("cache", "render")
+render_cache_size = 512 * 1024 * 1024  # bytes
+
+
+def geometry_hash(source):
+    """
+    Hash the drawable primitives of a LayerGeometry or ezdxf document.
+    Coordinates are rounded to 1e-9 cm, so float noise does not change the key.
+    """
+    digest = hashlib.sha256()
+    for kind, *values in iter_primitives(source):
+        digest.update(kind.encode())
+        digest.update(",".join(f"{round(value, 9):.9f}" for value in values).encode())
+        digest.update(b";")
+    return digest.hexdigest()
+
+
+class RenderCache:
+    """
+    Rendered RGBA overlays stored as PNG files named by the hash of the
+    geometry and the effective render settings. Reading an entry refreshes
+    its mtime; when the cache grows over max_bytes the least recently used
+    entries are removed.
+    """
+
+    def __init__(self, directory=render_cache_dir, max_bytes=render_cache_size):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, source, backend="native", **settings):
+        """The cache key of source rendered with backend and settings, see render_settings()."""
+        settings_json = json.dumps(render_settings(backend, **settings), sort_keys=True, default=list)
+        return hashlib.sha256(f"{geometry_hash(source)}:{settings_json}".encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".png")
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            image = Image.open(path)
+            image.load()
+        except (FileNotFoundError, OSError):
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Evicted by another process since it was read, the image is still good
+            pass
+        return image
+
+    def put(self, key, image):
+        # Write to a temporary file first, so other processes never see half a PNG
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            image.save(f, format="png", compress_level=1)
+        os.replace(tmp_path, self.path(key))
+        self.evict()
+
+    def evict(self):
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".png"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def render(self, source, backend="native", **settings):
+        """
+        Return the rendered overlay of source, rendering it only on a miss.
+
+        Args:
+        - source: A LayerGeometry, or an ezdxf document.
+        - backend: The convert_dxf2img backend.
+        - settings: Keyword arguments for rasterize(), e.g. dpi or color, or
+          for convert_dxf2img() with the matplotlib backend.
+        """
+        key = self.key(source, backend, **settings)
+        image = self.get(key)
+        if image is not None:
+            self.hits += 1
+            return image
+
+        self.misses += 1
+        if backend == "native":
+            image = rasterize(source, **settings)
+        else:
+            image = convert_dxf2img(source, backend, **settings)
+        self.put(key, image)
+        return image
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
@@ -0,0 +1,231 @@
+"""
+Clearance checks: the web of material left between the cutouts of a layer
+and between the cutouts and the outline.
+"""
+import math
+from dataclasses import dataclass
+
+import numpy as np
+
+from .geometry import iter_primitives
+from .trace import traced
+
+min_clearance = 0.1  # in cm, the thinnest web we are happy to cut
+chord_tolerance = 1e-3  # in cm, how far flattened arcs may be off the real ones
+
+
+@dataclass
+class Violation:
+    layer: object
+    feature_a: str
+    feature_b: str
+    distance: float
+    location: tuple
+
+
+def _arc_points(cx, cy, radius, start, end, tolerance):
+    sweep = (end - start) % 360 or 360
+    step = 2 * math.acos(1 - tolerance / radius) if radius > tolerance else math.pi / 2
+    count = max(int(math.ceil(math.radians(sweep) / step)), 4)
+    angles = np.radians(start + np.linspace(0, sweep, count + 1))
+    return cx + radius * np.cos(angles), cy + radius * np.sin(angles)
+
+
+def flatten(source, tolerance=chord_tolerance):
+    """
+    Turn the lines, arcs and circles of source into straight segments and
+    group the primitives that share end points into features, so the lines
+    and arcs of one outline count as one cutout. Points are ignored.
+
+    Returns (segments, owners, labels): an (n, 4) array of x0, y0, x1, y1
+    rows, the feature index of every segment and a label per feature.
+    """
+    pieces = []
+    ends = []
+    circles = {}
+    for kind, *values in iter_primitives(source):
+        if kind == "line":
+            pieces.append(np.array([values], dtype=float))
+            ends.append((values[:2], values[2:]))
+        elif kind in ("arc", "circle"):
+            cx, cy, radius = values[:3]
+            start, end = values[3:] if kind == "arc" else (0, 360)
+            xs, ys = _arc_points(cx, cy, radius, start, end, tolerance)
+            pieces.append(np.column_stack((xs[:-1], ys[:-1], xs[1:], ys[1:])))
+            if kind == "circle":
+                circles[len(ends)] = (cx, cy, radius)
+                ends.append(())
+            else:
+                ends.append(((xs[0], ys[0]), (xs[-1], ys[-1])))
+    if not pieces:
+        return np.empty((0, 4)), np.empty(0, dtype=np.intp), []
+
+    # Union-find over primitives that share an end point
+    parent = list(range(len(ends)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    seen = {}
+    for index, points in enumerate(ends):
+        for x, y in points:
+            key = (round(x / tolerance), round(y / tolerance))
+            if key in seen:
+                parent[find(index)] = find(seen[key])
+            else:
+                seen[key] = index
+
+    roots = [find(index) for index in range(len(ends))]
+    feature_of_root = {root: number for number, root in enumerate(dict.fromkeys(roots))}
+    owners = np.repeat([feature_of_root[root] for root in roots], [len(piece) for piece in pieces])
+    segments = np.concatenate(pieces)
+
+    labels = []
+    for root in feature_of_root:
+        if root in circles:
+            cx, cy, radius = circles[root]
+            labels.append(f"circle r={radius:g} at ({cx:.3f}, {cy:.3f})")
+        else:
+            mine = segments[owners == feature_of_root[root]]
+            x0, y0 = mine[:, [0, 2]].min(), mine[:, [1, 3]].min()
+            x1, y1 = mine[:, [0, 2]].max(), mine[:, [1, 3]].max()
+            labels.append(f"contour {x1 - x0:.3f}x{y1 - y0:.3f} at ({(x0 + x1) / 2:.3f}, {(y0 + y1) / 2:.3f})")
+    return segments, owners, labels
+
+
+def candidate_pairs(segments, reach, owners=None):
+    """
+    Pairs (i, j), i < j, of segments whose bounding boxes come within reach
+    of each other, found through a uniform grid instead of testing every pair.
+    With owners given, pairs of segments of the same feature are left out.
+    """
+    if len(segments) < 2:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+    low = np.minimum(segments[:, :2], segments[:, 2:]) - reach / 2
+    high = np.maximum(segments[:, :2], segments[:, 2:]) + reach / 2
+    lengths = np.hypot(*(segments[:, 2:] - segments[:, :2]).T)
+    cell = max(reach, float(np.median(lengths)), 1e-6)
+
+    first = np.floor(low / cell).astype(np.int64)
+    last = np.floor(high / cell).astype(np.int64)
+    spans = last - first + 1
+    counts = spans[:, 0] * spans[:, 1]
+
+    # One (cell, segment) row for every cell a segment's box touches
+    owner = np.repeat(np.arange(len(segments)), counts)
+    local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    cx = first[owner, 0] + local % spans[owner, 0]
+    cy = first[owner, 1] + local // spans[owner, 0]
+    keys = (cx - cx.min()) * (cy.max() - cy.min() + 1) + (cy - cy.min())
+    order = np.argsort(keys, kind="stable")
+    keys, owner = keys[order], owner[order]
+
+    # Rows of one cell are contiguous: pair every row with the next d rows
+    pairs_a, pairs_b = [], []
+    offset = 1
+    while offset < len(keys):
+        same = keys[:-offset] == keys[offset:]
+        if not same.any():
+            break
+        a, b = owner[:-offset][same], owner[offset:][same]
+        if owners is not None:
+            a, b = a[owners[a] != owners[b]], b[owners[a] != owners[b]]
+        pairs_a.append(a)
+        pairs_b.append(b)
+        offset += 1
+    if not pairs_a or not sum(len(a) for a in pairs_a):
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+    a, b = np.concatenate(pairs_a), np.concatenate(pairs_b)
+    a, b = np.minimum(a, b), np.maximum(a, b)
+    unique = np.unique(a * len(segments) + b)
+    a, b = unique // len(segments), unique % len(segments)
+
+    overlap = np.all((low[a] <= high[b]) & (low[b] <= high[a]), axis=1)
+    return a[overlap], b[overlap]
+
+
+def _point_segment(px, py, segments):
+    x0, y0, x1, y1 = segments.T
+    dx, dy = x1 - x0, y1 - y0
+    length2 = np.where(dx * dx + dy * dy > 0, dx * dx + dy * dy, 1)
+    t = np.clip(((px - x0) * dx + (py - y0) * dy) / length2, 0, 1)
+    qx, qy = x0 + t * dx, y0 + t * dy
+    return np.hypot(px - qx, py - qy), qx, qy
+
+
+def segment_distances(first, second):
+    """
+    Distances between the segments of two (n, 4) arrays, row by row, and the
+    midpoint of the closest points of each pair.
+    """
+    candidates = []
+    for points, segments in ((first, second), (second, first)):
+        for column in (0, 2):
+            px, py = points[:, column], points[:, column + 1]
+            distance, qx, qy = _point_segment(px, py, segments)
+            candidates.append((distance, (px + qx) / 2, (py + qy) / 2))
+    distance = np.stack([c[0] for c in candidates])
+    pick = distance.argmin(axis=0)
+    rows = np.arange(len(first))
+    best = distance[pick, rows]
+    mid_x = np.stack([c[1] for c in candidates])[pick, rows]
+    mid_y = np.stack([c[2] for c in candidates])[pick, rows]
+
+    # Crossing segments are at distance 0, at their intersection
+    p, r = first[:, :2], first[:, 2:] - first[:, :2]
+    q, s = second[:, :2], second[:, 2:] - second[:, :2]
+    denominator = r[:, 0] * s[:, 1] - r[:, 1] * s[:, 0]
+    parallel = np.abs(denominator) < 1e-15
+    denominator = np.where(parallel, 1, denominator)
+    qp = q - p
+    t = (qp[:, 0] * s[:, 1] - qp[:, 1] * s[:, 0]) / denominator
+    u = (qp[:, 0] * r[:, 1] - qp[:, 1] * r[:, 0]) / denominator
+    crossing = ~parallel & (t >= 0) & (t <= 1) & (u >= 0) & (u <= 1)
+    best = np.where(crossing, 0, best)
+    mid_x = np.where(crossing, p[:, 0] + t * r[:, 0], mid_x)
+    mid_y = np.where(crossing, p[:, 1] + t * r[:, 1], mid_y)
+    return best, mid_x, mid_y
+
+
+@traced
+def check_clearance(source, clearance=min_clearance, layer=None, tolerance=chord_tolerance):
+    """
+    Report every pair of features of one layer that are closer than clearance,
+    with the closest distance between them.
+
+    Args:
+    - source: A LayerGeometry or an ezdxf document.
+    - clearance: Minimum web thickness in cm.
+    - layer: Name of the layer, copied into the Violations.
+    - tolerance: Chord tolerance used to flatten arcs and circles.
+    """
+    segments, owners, labels = flatten(source, tolerance)
+    a, b = candidate_pairs(segments, clearance, owners)
+    distance, mid_x, mid_y = segment_distances(segments[a], segments[b])
+    close = distance < clearance
+    if not close.any():
+        return []
+
+    feature_a = np.minimum(owners[a], owners[b])[close]
+    feature_b = np.maximum(owners[a], owners[b])[close]
+    distance, mid_x, mid_y = distance[close], mid_x[close], mid_y[close]
+    # Keep the closest spot of every pair of features
+    order = np.lexsort((distance, feature_b, feature_a))
+    pair_keys = feature_a[order] * len(labels) + feature_b[order]
+    first = order[np.concatenate(([True], pair_keys[1:] != pair_keys[:-1]))]
+
+    violations = [
+        Violation(layer, labels[feature_a[i]], labels[feature_b[i]], float(distance[i]),
+                  (round(float(mid_x[i]), 4), round(float(mid_y[i]), 4)))
+        for i in first
+    ]
+    violations.sort(key=lambda violation: violation.distance)
+    return violations
+
+
+def check_layers(geometries, clearance=min_clearance):
+    """Run check_clearance over recorded layers, e.g. from record_layers()."""
+    return {layer: check_clearance(geometry, clearance, layer) for layer, geometry in geometries.items()}
@@ -0,0 +1,443 @@
+"""
+Command line entry point, run it with `python -m gigabox`.
+
+Every mode imports what it needs when it runs, so starting the CLI does not
+load ezdxf or asyncio. The parser defaults of those modules are spelled out
+below and kept in step with them by tests/test_cli.py.
+"""
+import argparse
+import os
+import time
+
+from . import trace
+from .geometry import DEFAULT_PARAMS, LAYER_DRAWERS
+
+
+def load_params(path):
+    """The BoxParams of a --params file, or the defaults without one."""
+    if not path:
+        return DEFAULT_PARAMS
+    from .build import load_params_file
+    return load_params_file(path)
+
+
+def run_batch(param_file, grid, out_dir, jobs, toolpath=False, blocks=False, writer="ezdxf", spec=None,
+              ir_cache=None, deterministic=False):
+    from .build import build_variants, iter_variants, read_param_sets
+    start = time.perf_counter()
+    param_sets = read_param_sets(param_file) if param_file else None
+    built = failed = 0
+    for result in build_variants(iter_variants(param_sets, grid), out_dir, jobs, toolpath, blocks, writer,
+                                 spec, ir_cache, deterministic):
+        built += 1
+        if result.ok:
+            print(f"ok      {result.name:<20} {result.seconds:6.2f}s  {result.digest[:12]}  {result.path}")
+        else:
+            failed += 1
+            print(f"FAILED  {result.name:<20} {result.seconds:6.2f}s  {result.error}")
+    print(f"finish {built} variants ({failed} failed) in {time.perf_counter() - start:.2f}s")
+    return 1 if failed else 0
+
+
+def run_check(variants, clearance, spec=None):
+    """Check the clearance of every layer of every (name, params) variant."""
+    from .check import check_layers
+    from .spec import compile_layout
+    start = time.perf_counter()
+    found = failed = 0
+    for name, params in variants:
+        if isinstance(params, Exception):
+            failed += 1
+            print(f"FAILED  {name:<20} {params!r}")
+            continue
+        layers = compile_layout(params, spec).layers
+        plates = {layer: geometry for layer, geometry in layers.items() if layer in LAYER_DRAWERS}
+        for layer, violations in check_layers(plates, clearance).items():
+            found += len(violations)
+            for violation in violations:
+                x, y = violation.location
+                print(f"{name:<20} layer{layer} {violation.distance:.4f}cm at ({x:.3f}, {y:.3f}): "
+                      f"{violation.feature_a} / {violation.feature_b}")
+    print(f"{found} clearance violations under {clearance}cm ({failed} variants failed) "
+          f"in {time.perf_counter() - start:.2f}s")
+    return 1 if found or failed else 0
+
+
+def run_nest(variants, out_dir, sheets, kerf, writers, toolpath=False, spec=None):
+    """Nest the layers of every (name, params) variant onto sheets and write one file per sheet."""
+    from .build import WRITER_EXTENSIONS
+    from .nest import pack, variant_parts, write_sheets
+    start = time.perf_counter()
+    sheet, sheet_sizes = sheets
+    try:
+        parts = list(variant_parts(variants, toolpath=toolpath, spec=spec))
+        packed = pack(parts, sheet, sheet_sizes, kerf)
+    except ValueError as e:
+        print(f"FAILED  {e}")
+        return 1
+    nested = time.perf_counter()
+    for extension in dict.fromkeys(WRITER_EXTENSIONS[writer] for writer in writers):
+        for path, placed in zip(write_sheets(packed, out_dir, extension), packed):
+            print(f"sheet   {placed.material:<6} {len(placed.placements):4d} parts {placed.utilization:6.1%}  {path}")
+    print(f"nested {len(parts)} parts on {len(packed)} sheets in {(nested - start) * 1000:.0f}ms, "
+          f"finish in {time.perf_counter() - start:.2f}s")
+    return 0
+
+
+def run_golden(golden_dir, new_dir, tolerance, jobs):
+    """Diff the DXF files of a build against a golden set and list what was added, removed or moved."""
+    import math
+    from .golden import diff_golden
+    start = time.perf_counter()
+    checked = differ = 0
+    for result in diff_golden(golden_dir, new_dir, tolerance, jobs):
+        checked += 1
+        if result.same:
+            continue
+        differ += 1
+        if result.error:
+            print(f"FAILED  {result.name}: {result.error}")
+            continue
+        for layer, diff in result.diffs.items():
+            print(f"differs {result.name} layer {layer}: {len(diff.added)} added, {len(diff.removed)} removed, "
+                  f"{len(diff.moved)} moved")
+            for feature in diff.added:
+                print(f"        + {feature}")
+            for feature in diff.removed:
+                print(f"        - {feature}")
+            for golden, new in diff.moved:
+                print(f"        > {golden} by {math.hypot(new.x - golden.x, new.y - golden.y):.4f}cm")
+    print(f"{checked} files checked against {golden_dir}, {differ} differ, in {time.perf_counter() - start:.2f}s")
+    return 1 if differ or not checked else 0
+
+
+def run_mesh(path, params, spec=None):
+    """Write the extruded layer stack of one variant to path and check that the screw holes line up."""
+    from .spec import compile_layout
+    from .stack import hole_alignment, stack_height, stack_meshes, write_mesh
+    start = time.perf_counter()
+    layers = compile_layout(params, spec).layers
+    meshes, skipped = stack_meshes(layers)
+    try:
+        write_mesh(path, meshes)
+    except ValueError as e:
+        print(f"FAILED  {e}")
+        return 1
+    triangles = sum(len(triangles) for layer, triangles in meshes)
+    print(f"mesh    {triangles} triangles, {stack_height():g}mm high, {skipped} open contours left out  {path}")
+    misaligned = 0
+    for layer, missing in hole_alignment(layers).items():
+        misaligned += len(missing)
+        for x, y in missing:
+            print(f"layer{layer} has no screw hole at ({x:.3f}, {y:.3f})")
+    print(f"{misaligned} screw holes out of line, finish in {time.perf_counter() - start:.2f}s")
+    return 1 if misaligned else 0
+
+
+def run_service(host, port, jobs, max_queue, spec=None):
+    import asyncio
+    from .service import default_host, serve
+
+    def ready(address):
+        print(f"serving on http://{address[0]}:{address[1]}, press Ctrl+C to stop", flush=True)
+    try:
+        asyncio.run(serve(host or default_host, port, jobs, max_queue, spec, ready))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def run_build(targets, jobs, params, incremental, toolpath=False, blocks=False, writer="ezdxf", spec=None,
+              ir_cache=None, deterministic=False):
+    from .build import build_all
+    failed = 0
+    for result in build_all(targets, jobs, params, incremental, toolpath=toolpath, blocks=blocks, writer=writer,
+                            spec=spec, ir_cache=ir_cache, deterministic=deterministic):
+        digest = (result.digest or "")[:12]
+        if result.skipped:
+            print(f"skip    {result.name:<14}          {digest:<12}  {result.path}")
+        elif result.ok:
+            print(f"ok      {result.name:<14} {result.seconds:6.2f}s  {digest:<12}  {result.path}")
+        else:
+            failed += 1
+            print(f"FAILED  {result.name:<14} {result.seconds:6.2f}s  {result.error}")
+    return failed
+
+
+def run_preview(out_dir, params, dpis=None, backend="native", spec=None, draft=False):
+    """
+    Write PNG previews of the art layer and the six plates of one variant to
+    out_dir: <layer>-<dpi>dpi.png for every level of dpis (default
+    render.PREVIEW_DPIS) and <layer>-thumbnail.png, or only
+    <layer>-draft.png with draft=True.
+    """
+    from .render import PREVIEW_DPIS, PreviewPyramid
+    from .spec import compile_layout
+    start = time.perf_counter()
+    os.makedirs(out_dir, exist_ok=True)
+    layers = compile_layout(params, spec).layers
+    written = 0
+    for layer in ("art", *LAYER_DRAWERS):
+        pyramid = PreviewPyramid(layers[layer], dpis or PREVIEW_DPIS, backend=backend, size=(params.box_width, params.box_height))
+        images = {"draft": pyramid.draft()} if draft else {
+            (f"{level:g}dpi" if level != "thumbnail" else level): image for level, image in pyramid.all().items()}
+        for level, image in images.items():
+            name = "layer-art" if layer == "art" else f"layer{layer}"
+            image.save(os.path.join(out_dir, f"{name}-{level}.png"), compress_level=1)
+            written += 1
+    print(f"{written} previews written to {out_dir} in {(time.perf_counter() - start) * 1000:.0f}ms")
+    return 0
+
+
+def watch(param_file, targets, jobs, toolpath=False, blocks=False, writer="ezdxf", spec=None, interval=.2,
+          deterministic=False, preview=None):
+    """
+    Poll param_file and incrementally rebuild whenever it changes, until
+    interrupted. With preview, draft previews are written to that directory
+    after every rebuild.
+    """
+    from .build import load_params_file
+    print(f"watching {param_file}, press Ctrl+C to stop")
+    last_mtime = None
+    try:
+        while True:
+            try:
+                mtime = os.stat(param_file).st_mtime_ns
+            except FileNotFoundError:
+                mtime = None
+            if mtime is not None and mtime != last_mtime:
+                last_mtime = mtime
+                start = time.perf_counter()
+                try:
+                    params = load_params_file(param_file)
+                except (OSError, ValueError, TypeError) as e:
+                    print(f"FAILED  {param_file}: {e}")
+                else:
+                    run_build(targets, jobs, params, incremental=True, toolpath=toolpath, blocks=blocks, writer=writer,
+                              spec=spec, deterministic=deterministic)
+                    if preview:
+                        run_preview(preview, params, spec=spec, draft=True)
+                    print(f"rebuilt in {(time.perf_counter() - start) * 1000:.1f}ms")
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        return 0
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(description="Generate the hitbox DXF layers.")
+    parser.add_argument("targets", nargs="*", metavar="target",
+                        help="files to build (default: all of total.dxf, "
+                             f"{', '.join(f'layer{layer}.dxf' for layer in LAYER_DRAWERS)}, layer-art.dxf)")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="number of worker processes (default: one per CPU, 1 builds in-process)")
+    parser.add_argument("--params", metavar="FILE",
+                        help="JSON object of parameter overrides for the build")
+    parser.add_argument("-i", "--incremental", action="store_true",
+                        help="only rewrite files whose geometry changed since the last build")
+    parser.add_argument("--toolpath", action="store_true",
+                        help="merge outlines into polylines and order the cuts inner first for the laser")
+    parser.add_argument("--blocks", action="store_true",
+                        help="write repeated holes and footprints once as blocks, placed with INSERTs")
+    parser.add_argument("--writer", metavar="{ezdxf,stream,svg,pdf,gcode}", action="append",
+                        help="ezdxf documents, or streamed minimal R12 DXF, SVG, PDF or laser G-code; repeat it to "
+                             "write several formats from one geometry build (default: ezdxf)")
+    parser.add_argument("--spec", metavar="FILE",
+                        help="JSON or TOML layout spec to build from (default: the built-in gigabox/layout.json)")
+    parser.add_argument("--ir-cache", metavar="DIR", nargs="?", const="cache/ir",
+                        help="keep compiled layouts in DIR and reuse them between runs (default when given: "
+                             "%(const)s)")
+    parser.add_argument("--deterministic", action="store_true",
+                        help="write the same bytes for the same layout (fixed DXF header times and GUIDs, rounded "
+                             "floats), also with --explode, so files can be deduplicated by the SHA256SUMS "
+                             "written next to them")
+    parser.add_argument("--explode", metavar="DXF", nargs="+",
+                        help="replace the block references of these DXF files with flat geometry and exit")
+    parser.add_argument("--watch", action="store_true",
+                        help="rebuild changed files whenever the --params file changes")
+    parser.add_argument("--batch", metavar="FILE",
+                        help="build one variant per row of a .csv or .jsonl parameter file")
+    parser.add_argument("--grid", metavar="KEY=V1,V2", action="append", default=[],
+                        help="build every combination of these parameter values (repeatable)")
+    parser.add_argument("--out", default="output_variants",
+                        help="output directory for --batch/--grid variants (default: %(default)s)")
+    parser.add_argument("--nest", metavar="DIR", nargs="?", const="output_sheets",
+                        help="pack the six layers of the variants onto stock sheets, one file per sheet, into DIR "
+                             "(default when given: %(const)s) instead of building")
+    parser.add_argument("--sheet", metavar="[MATERIAL=]WxH", action="append", default=[],
+                        help="sheet size in cm for --nest, for every material or one of them like 1.6mm=60x40 "
+                             "(default: 122x61)")
+    parser.add_argument("--kerf", metavar="CM", type=float, default=0.1,
+                        help="space between nested parts and to the sheet edges (default: %(default)s)")
+    parser.add_argument("--golden", metavar="DIR",
+                        help="diff every .dxf under DIR against the same file under --against and list the "
+                             "features added, removed or moved, instead of building")
+    parser.add_argument("--against", metavar="DIR", default="output_dxf",
+                        help="the build --golden checks (default: %(default)s)")
+    parser.add_argument("--golden-tolerance", metavar="CM", type=float, default=1e-4,
+                        help="how far apart features may be and still match (default: %(default)s)")
+    parser.add_argument("--mesh", metavar="FILE",
+                        help="write the layers extruded and stacked to FILE (.stl, .glb or .gltf) and check that "
+                             "the screw holes line up, instead of building")
+    parser.add_argument("--serve", metavar="[HOST:]PORT", nargs="?", const="127.0.0.1:8040",
+                        help="run the HTTP generation service on a pool of --jobs workers (default when given: "
+                             "%(const)s)")
+    parser.add_argument("--max-queue", metavar="N", type=int, default=32,
+                        help="jobs the service queues before answering 503 (default: %(default)s)")
+    parser.add_argument("--check", metavar="CM", type=float, nargs="?", const=0.1,
+                        help="report features closer than CM (default when given: %(const)s) instead of building")
+    parser.add_argument("--art", metavar="IMAGE",
+                        help="also composite IMAGE with the top layout into final.png (stock ratio is 2 x 1)")
+    parser.add_argument("--art-bottom", metavar="IMAGE",
+                        help="also composite IMAGE with the bottom layout into final-bottom.png")
+    parser.add_argument("--art-batch", metavar="DIR_OR_MANIFEST",
+                        help="composite every image of a directory or manifest (.csv/.jsonl/.txt)")
+    parser.add_argument("--art-side", choices=["top", "bottom", "both"], default="top",
+                        help="overlay(s) used by --art-batch (default: %(default)s)")
+    parser.add_argument("--art-out", default="output_image",
+                        help="output directory for --art-batch (default: %(default)s)")
+    parser.add_argument("--preview", metavar="DIR", nargs="?", const="output_preview",
+                        help="write PNG previews of every layer at each --preview-dpi and a thumbnail into DIR "
+                             "(default when given: %(const)s) instead of building; with --watch, a quick draft "
+                             "of every layer after each rebuild")
+    parser.add_argument("--preview-dpi", metavar="DPI", type=float, action="append",
+                        help="a level of the --preview pyramid, repeatable (default: 300, 150 and 72)")
+    parser.add_argument("--render-backend", choices=["native", "matplotlib"], default="native",
+                        help="how overlays are rendered for --art/--art-bottom (default: %(default)s)")
+    parser.add_argument("--render-cache", metavar="DIR", nargs="?", const="cache/render",
+                        help="cache rendered overlays in DIR (default when given: %(const)s)")
+    parser.add_argument("--render-cache-size", metavar="MB", type=int, default=512,
+                        help="size cap of the render cache (default: %(default)s MB)")
+    parser.add_argument("--stats", action="store_true",
+                        help="print time per span and entity/byte counters at the end")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="write a Chrome trace (chrome://tracing, ui.perfetto.dev) of the run to FILE")
+    return parser
+
+
+def main(argv=None):
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    if args.trace:
+        trace.record_events()
+    status = run(parser, args)
+    if args.stats:
+        print(trace.summary())
+    if args.trace:
+        trace.write_chrome_trace(args.trace)
+        print(f"trace written to {args.trace}")
+    return status
+
+
+def run(parser, args):
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if args.writer:
+        from .build import writer_list
+        try:
+            args.writer = writer_list(args.writer)
+        except ValueError as e:
+            parser.error(str(e))
+    else:
+        args.writer = ("ezdxf",)
+    if args.spec:
+        from .spec import load_spec
+        try:
+            load_spec(args.spec)
+        except (OSError, ValueError) as e:
+            parser.error(f"--spec: {e}")
+    if any(dpi <= 0 for dpi in args.preview_dpi or ()):
+        parser.error("--preview-dpi must be positive")
+    if args.kerf < 0:
+        parser.error("--kerf cannot be negative")
+    sheets = None
+    if args.nest:
+        from .nest import parse_sheet_sizes
+        try:
+            sheets = parse_sheet_sizes(args.sheet)
+        except ValueError as e:
+            parser.error(f"--sheet: {e}")
+    if args.serve:
+        host, _, port = args.serve.rpartition(":")
+        if not port.isdigit() or args.max_queue < 1:
+            parser.error("--serve takes [HOST:]PORT and --max-queue at least 1")
+        return run_service(host, int(port), args.jobs, args.max_queue, args.spec)
+    if args.golden:
+        if args.golden_tolerance <= 0:
+            parser.error("--golden-tolerance must be positive")
+        return run_golden(args.golden, args.against, args.golden_tolerance, args.jobs)
+    if args.explode:
+        from .dxf import explode_dxf
+        for file_name in args.explode:
+            explode_dxf(file_name, deterministic=args.deterministic)
+            print(f"exploded {file_name}")
+        return 0
+    if args.batch or args.grid:
+        if args.targets:
+            parser.error("targets cannot be combined with --batch/--grid")
+        from .build import iter_variants, parse_grid, parse_params, read_param_sets
+        try:
+            grid = parse_grid(args.grid)
+            parse_params(grid)
+        except ValueError as e:
+            parser.error(str(e))
+        if args.check is not None:
+            param_sets = read_param_sets(args.batch) if args.batch else None
+            return run_check(iter_variants(param_sets, grid), args.check, args.spec)
+        if args.nest:
+            param_sets = read_param_sets(args.batch) if args.batch else None
+            return run_nest(iter_variants(param_sets, grid), args.nest, sheets, args.kerf, args.writer, args.toolpath,
+                            args.spec)
+        return run_batch(args.batch, grid, args.out, args.jobs, args.toolpath, args.blocks, args.writer, args.spec,
+                         args.ir_cache, args.deterministic)
+    if args.targets:
+        from .build import BUILD_TARGETS
+        unknown = [name for name in args.targets if name not in BUILD_TARGETS]
+        if unknown:
+            parser.error(f"unknown target: {', '.join(unknown)}")
+    if args.check is not None:
+        params = load_params(args.params)
+        return run_check([("default", params)], args.check, args.spec)
+    if args.mesh:
+        params = load_params(args.params)
+        return run_mesh(args.mesh, params, args.spec)
+    if args.nest:
+        params = load_params(args.params)
+        return run_nest([("default", params)], args.nest, sheets, args.kerf, args.writer, args.toolpath, args.spec)
+    if args.watch:
+        if not args.params:
+            parser.error("--watch needs a --params file")
+        return watch(args.params, args.targets or None, args.jobs or 1, args.toolpath, args.blocks, args.writer,
+                     args.spec, deterministic=args.deterministic, preview=args.preview)
+    if args.preview:
+        params = load_params(args.params)
+        return run_preview(args.preview, params, args.preview_dpi, args.render_backend, args.spec)
+
+    start = time.perf_counter()
+    params = load_params(args.params)
+    failed = run_build(args.targets or None, args.jobs, params, args.incremental,
+                       args.toolpath, args.blocks, args.writer, args.spec, args.ir_cache, args.deterministic)
+
+    if args.art or args.art_bottom or args.art_batch:
+        # Only now pay for the rendering stack
+        from .art import combine_hitbox_layout_and_image, combine_hitbox_layout_and_image_bottom, composite_batch
+        cache = None
+        if args.render_cache:
+            from .cache import RenderCache
+            cache = RenderCache(args.render_cache, args.render_cache_size * 1024 * 1024)
+        if args.art_batch:
+            sides = ("top", "bottom") if args.art_side == "both" else (args.art_side,)
+            for result in composite_batch(args.art_batch, args.art_out, sides, params, args.jobs, cache, args.spec):
+                if result.ok:
+                    print(f"ok      {result.name:<20} {result.seconds:6.2f}s  {result.path}")
+                else:
+                    failed += 1
+                    print(f"FAILED  {result.name:<20} {result.seconds:6.2f}s  {result.error}")
+        if args.art:
+            combine_hitbox_layout_and_image(args.art, cache, params, args.render_backend, args.spec)
+        if args.art_bottom:
+            combine_hitbox_layout_and_image_bottom(args.art_bottom, cache, params, args.render_backend, args.spec)
+        if cache is not None:
+            print(f"render cache: {cache.hits} hits, {cache.misses} misses")
+
+    print(f"finish in {time.perf_counter() - start:.2f}s")
+    return 1 if failed else 0
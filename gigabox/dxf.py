@@ -0,0 +1,231 @@
+"""
+Writing layers to DXF files with ezdxf.
+"""
+import io
+import os
+import re
+from datetime import datetime
+
+import ezdxf
+from ezdxf.document import CREATED_BY_EZDXF, WRITTEN_BY_EZDXF
+from ezdxf.lldxf.const import DXF12
+from ezdxf.tools.juliandate import juliandate
+
+from .geometry import DEFAULT_PARAMS, LAYER_DRAWERS
+from .spec import compile_layout
+from .trace import span
+
+output_dxf_dir = "output_dxf"
+output_image_dir = "output_image"
+# What saveas(deterministic=True) writes for the times, GUIDs and ezdxf marker
+deterministic_date = datetime(2000, 1, 1)
+deterministic_guid = "{00000000-0000-0000-0000-000000000000}"
+deterministic_marker = f"{ezdxf.__version__} @ {deterministic_date.isoformat()}"
+deterministic_digits = 10  # decimal places of every float in a deterministic file
+# Bumped when deterministic files come out differently for the same drawing
+deterministic_version = 2
+# DXF group codes whose values are floats
+_FLOAT_CODES = frozenset([*range(10, 60), *range(110, 150), *range(210, 240), *range(460, 470),
+                          *range(1010, 1060)])
+
+
+def _header_value(text, name, value):
+    """text of a DXF file with the value of the header variable name replaced by value."""
+    return re.sub(rf"(\n *9\n{re.escape(name)}\n *\d+\n)[^\n]*", lambda match: match.group(1) + value, text, count=1)
+
+
+def _canonical_floats(text):
+    """
+    text of a DXF file with every float value rounded to deterministic_digits
+    places and written as the shortest repr, with -0.0 as 0.0.
+    """
+    lines = text.split("\n")
+    is_float = {}
+    for index in range(0, len(lines) - 1, 2):
+        code = lines[index]
+        if code not in is_float:
+            is_float[code] = int(code) in _FLOAT_CODES
+        if is_float[code]:
+            lines[index + 1] = repr(round(float(lines[index + 1]), deterministic_digits) + 0.0)
+    return "\n".join(lines)
+
+
+def saveas(doc, file_name, deterministic=False):
+    """
+    Save doc to file_name. With deterministic=True the same drawing always
+    gives the same bytes. The creation time and fingerprint GUID ezdxf puts
+    in the header are set to fixed values, and the CLASSES section is added
+    in sorted order. ezdxf stamps the update time, the version GUID and its
+    written-by marker while writing, so those are put back to fixed values
+    in the written text. Every float is rounded to deterministic_digits
+    places, so coordinates that differ in the last bit, e.g. from another
+    libm or NumPy build, are written the same. Entities are written, and
+    handles handed out, in drawing order, which the layout spec fixes, and
+    $HANDSEED is the next handle, so all three are already stable.
+    """
+    with span("saveas"):
+        if not deterministic:
+            doc.saveas(file_name)
+            return
+        date = juliandate(deterministic_date)
+        doc.header["$TDCREATE"] = doc.header["$TDUCREATE"] = date
+        doc.header["$FINGERPRINTGUID"] = deterministic_guid
+        metadata = doc.ezdxf_metadata()
+        metadata[CREATED_BY_EZDXF] = deterministic_marker
+        if doc.dxfversion > DXF12:
+            # ezdxf adds the classes of the entity types in use from a set, in hash order; classes
+            # already there are kept where they are
+            for name in sorted(doc.entitydb.dxf_types_in_use()):
+                doc.classes.add_class(name)
+        stream = io.StringIO()
+        doc.write(stream)
+        text = stream.getvalue().replace(metadata[WRITTEN_BY_EZDXF], deterministic_marker)
+        text = text.replace(doc.header["$VERSIONGUID"], deterministic_guid)
+        text = _header_value(text, "$TDUPDATE", repr(date))
+        text = _canonical_floats(_header_value(text, "$TDUUPDATE", repr(date)))
+        with open(file_name, "wb") as f:
+            f.write(doc.encode(text))
+
+
+def create_dxf_layer(layer, file_name, doc=None, geometry=None, params=DEFAULT_PARAMS, deterministic=False,
+                     spec=None):
+    """
+    Write one layer to a DXF file.
+
+    Args:
+    - layer: The layer key in the layout spec, 1-6, "art" or "bottom".
+    - file_name: Path of the DXF file to write.
+    - doc: The document to draw into, a new one is created by default.
+    - geometry: A recorded LayerGeometry or CompiledLayer for the layer. When
+      given it is replayed instead of compiling the layer here.
+    - params: The BoxParams used when the layer is compiled here.
+    - deterministic: Write the same bytes for the same drawing, see saveas().
+    - spec: The layout spec, see spec.compile_layout().
+    """
+    # Create a new DXF document
+    if doc is None:
+        doc = ezdxf.new(dxfversion='R2010')
+    msp = doc.modelspace()
+
+    if geometry is None:
+        geometry = compile_layout(params, spec).layers[layer]
+    geometry.replay(msp)
+
+    # Save the DXF document
+    saveas(doc, file_name, deterministic)
+    return doc
+
+
+def save_geometry(geometry, file_name, deterministic=False):
+    """Write a recorded LayerGeometry to a new DXF file."""
+    doc = ezdxf.new(dxfversion='R2010')
+    geometry.replay(doc.modelspace())
+    saveas(doc, file_name, deterministic)
+    return doc
+
+
+def explode_dxf(file_name, out_name=None, deterministic=False):
+    """
+    Replace every block reference in the model space of a DXF file with the
+    entities of its block, for CAM tools that need flat geometry.
+
+    Args:
+    - file_name: The DXF file to read.
+    - out_name: Where to write the result, defaults to overwriting file_name.
+    - deterministic: Write the same bytes for the same drawing, see saveas().
+    """
+    doc = ezdxf.readfile(file_name)
+    msp = doc.modelspace()
+    for insert in msp.query("INSERT"):
+        layer = insert.dxf.layer
+        for entity in insert.explode():
+            # Block entities on layer 0 are drawn on the layer of their reference
+            if entity.dxf.layer == "0":
+                entity.dxf.layer = layer
+    saveas(doc, out_name or file_name, deterministic)
+    return doc
+
+
+def create_dxf_layer1(file_name, doc=None):
+    return create_dxf_layer(1, file_name, doc)
+
+def create_dxf_layer2(file_name, doc=None):
+    return create_dxf_layer(2, file_name, doc)
+
+def create_dxf_layer3(file_name, doc=None):
+    return create_dxf_layer(3, file_name, doc)
+
+def create_dxf_layer4(file_name, doc=None):
+    return create_dxf_layer(4, file_name, doc)
+
+def create_dxf_layer5(file_name, doc=None):
+    return create_dxf_layer(5, file_name, doc)
+
+def create_dxf_layer6(file_name, doc=None):
+    return create_dxf_layer(6, file_name, doc)
+
+def compose_total(geometries):
+    """
+    Put all layers into one new document, each on its own named DXF layer
+    ("layer1" ... "layer6").
+
+    Args:
+    - geometries: Recorded layers as returned by record_layers().
+    """
+    doc = ezdxf.new(dxfversion='R2010')
+    msp = doc.modelspace()
+    for layer in LAYER_DRAWERS:
+        layer_name = f"layer{layer}"
+        doc.layers.add(layer_name)
+        geometries[layer].replay(msp, dxfattribs={"layer": layer_name})
+    return doc
+
+def create_dxf_total(file_name, geometries=None, params=DEFAULT_PARAMS, spec=None, deterministic=False):
+    """
+    Write all layers into one DXF file in the output directory.
+
+    Args:
+    - file_name: File name inside the output directory.
+    - geometries: Recorded layers as returned by record_layers(). Missing
+      layers are compiled here.
+    - params: The BoxParams used for layers compiled here.
+    - spec: The layout spec, see spec.compile_layout().
+    - deterministic: Write the same bytes for the same drawing, see saveas().
+    """
+    # Full path for the output file
+    path = dxf_file_path(file_name)
+    geometries = dict(geometries or {})
+    if any(layer not in geometries for layer in LAYER_DRAWERS):
+        layers = compile_layout(params, spec).layers
+        geometries.update({layer: layers[layer] for layer in LAYER_DRAWERS if layer not in geometries})
+
+    doc = compose_total(geometries)
+    saveas(doc, path, deterministic)
+    return doc
+
+def dxf_file_path(file_name):
+   return os.path.join(output_dxf_dir, file_name)
+
+def image_file_path(file_name):
+    return os.path.join(output_image_dir, file_name)
+
+def create_dxf_art(doc=None, params=DEFAULT_PARAMS, spec=None, deterministic=False):
+    if doc is None:
+        doc = ezdxf.new(dxfversion='R2010')
+    msp = doc.modelspace()
+
+    compile_layout(params, spec).layers["art"].replay(msp)
+
+    saveas(doc, dxf_file_path("layer-art.dxf"), deterministic)
+
+    return doc
+
+
+def create_dxf_art_bottom(doc=None, params=DEFAULT_PARAMS, spec=None):
+    if doc is None:
+        doc = ezdxf.new(dxfversion='R2010')
+    msp = doc.modelspace()
+
+    compile_layout(params, spec).layers["bottom"].replay(msp)
+
+    return doc
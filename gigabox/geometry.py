@@ -0,0 +1,439 @@
+"""
+Box geometry: the sizing constants, the button layout engine and the draw_*
+functions. The shapes of the layers live in the layout spec (layout.json,
+see gigabox.spec), the draw functions replay it: they only call add_*
+methods on whatever they are given (an ezdxf model space or a
+LayerGeometry), so importing this module does not pull in ezdxf.
+"""
+import hashlib
+import math
+from dataclasses import dataclass, fields
+from functools import lru_cache
+
+import numpy as np
+
+from .trace import span
+
+# constant
+box_width = 40  # in cm
+box_height = 20  # in cm
+corner_radius = 1  # 1 cm radius for the rounded corners
+pico_w = 2.3
+pico_h = 5.2
+switch_width = 1.4
+oled_height = 1.9
+oled_width = 3.6
+pico_y_from_top = .38
+screw_radius = 0.2
+
+
+@dataclass(frozen=True)
+class BoxParams:
+    """
+    Everything that sizes a box. The defaults are the module constants above,
+    one BoxParams is one customer variant.
+    """
+    box_width: float = box_width
+    box_height: float = box_height
+    corner_radius: float = corner_radius
+    pico_w: float = pico_w
+    pico_h: float = pico_h
+    switch_width: float = switch_width
+    oled_height: float = oled_height
+    oled_width: float = oled_width
+    pico_y_from_top: float = pico_y_from_top
+    button_spacing: float = 2.8  # 28 mm = 2.8 cm
+    button_angle: float = 20  # in degrees
+    button_radius: float = 1.315
+    small_button_radius: float = 1.05
+    button_x_from_center: float = 8  # LP button, right of the centre line
+    button_y_from_top: float = 5  # LP button, below the top edge
+
+    def layout(self):
+        return button_layout(self.box_width, self.box_height, self.button_spacing, self.button_angle,
+                             self.button_radius, self.small_button_radius,
+                             (self.box_width / 2 + self.button_x_from_center, self.box_height - self.button_y_from_top))
+
+
+DEFAULT_PARAMS = BoxParams()
+PARAM_FIELDS = [field.name for field in fields(BoxParams)]
+# The sizes and the spacing, which have to be > 0; the offsets and the angle may be anything finite
+POSITIVE_PARAMS = frozenset({"box_width", "box_height", "corner_radius", "pico_w", "pico_h", "switch_width",
+                             "oled_height", "oled_width", "button_spacing", "button_radius", "small_button_radius"})
+
+
+def check_param(name, value):
+    """
+    The value of a BoxParams field as a float. Raises ValueError naming the
+    field when the value is not a finite number, or not > 0 for one of
+    POSITIVE_PARAMS.
+    """
+    if isinstance(value, bool):
+        raise ValueError(f"{name} must be a number, got {value!r}")
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be a number, got {value!r}") from None
+    if not math.isfinite(number):
+        raise ValueError(f"{name} must be finite, got {value!r}")
+    if name in POSITIVE_PARAMS and number <= 0:
+        raise ValueError(f"{name} must be > 0, got {number:g}")
+    return number
+
+
+def reverse_x(x, width):
+    return width - x
+
+def cal_equiliteral_triangle(xHP, yHP, xHK, yHK):
+    # Works on floats as well as on NumPy arrays of point pairs.
+    # Since DI, HP, and HK form an equilateral triangle, the distance from DI to HP and DI to HK is the same as d_HP_HK
+    # Distance between HP and HK
+    d_HP_HK = np.hypot(xHP - xHK, yHP - yHK)
+    # Using the midpoint formula and properties of an equilateral triangle
+    x_mid = (xHP + xHK) / 2
+    y_mid = (yHP + yHK) / 2
+    # Calculate the distance from the midpoint to the center of DI
+    height = np.sqrt(d_HP_HK ** 2 - ((d_HP_HK / 2) ** 2))
+    # Calculate the coordinates of DI
+    xDI = x_mid - height * (yHP - yHK) / d_HP_HK
+    yDI = y_mid + height * (xHP - xHK) / d_HP_HK
+    # Calculate the coordinates of DI on the right side
+    xDI_right = x_mid + height * (yHP - yHK) / d_HP_HK
+    yDI_right = y_mid - height * (xHP - xHK) / d_HP_HK
+
+    return xDI_right, yDI_right, xDI, yDI
+
+
+BIG_BUTTON_NAMES = ('LP', 'MP', 'HP', 'LK', 'MK', 'HK', 'DI', 'L1', 'L2')
+SMALL_BUTTON_NAMES = ('Select', 'Start')
+
+
+@dataclass(frozen=True, eq=False)
+class ButtonLayout:
+    """
+    Centres of every button, the big ones first and then the small ones.
+    Each group lists the left-hand buttons followed by their mirrors.
+
+    Attributes:
+    - names: Button names, in the same order as points.
+    - points: Read-only (n, 3) array of x, y, radius rows.
+    - big_count: Number of big buttons at the start of points.
+    """
+    names: tuple
+    points: np.ndarray
+    big_count: int
+
+    @property
+    def big(self):
+        return self.points[:self.big_count]
+
+    @property
+    def small(self):
+        return self.points[self.big_count:]
+
+    def items(self):
+        return zip(self.names, map(tuple, self.points.tolist()))
+
+
+@lru_cache(maxsize=4096)
+def button_layout(box_width=box_width, box_height=box_height, spacing=2.8, angle=20,
+                  big_radius=1.315, small_radius=1.05, anchor=(28, 15)):
+    """
+    Compute every button centre and its mirror in one NumPy pass. Results are
+    cached by the layout parameters, so repeated calls are free.
+
+    Args:
+    - box_width: Width of the box, the mirror axis is at box_width / 2.
+    - box_height: Height of the box.
+    - spacing: Distance between neighbouring big button centres (28 mm = 2.8 cm).
+    - angle: Angle in degrees between the LP and MP buttons.
+    - big_radius: Radius of the big buttons.
+    - small_radius: Radius of the Select/Start buttons.
+    - anchor: (x, y) centre of the LP button.
+    """
+    angle_radians = math.radians(angle)
+    xLP, yLP = anchor
+    xLP_LK = 0.5
+    yLP_LK = 2.8
+
+    left = np.empty((len(BIG_BUTTON_NAMES) + len(SMALL_BUTTON_NAMES), 2))
+    left[0] = xLP, yLP  # LP
+    left[1] = left[0] + spacing * np.array((math.cos(angle_radians), math.sin(angle_radians)))  # MP
+    left[2] = left[1] + (spacing, 0)  # HP
+    left[3:6] = left[0:3] - (xLP_LK, yLP_LK)  # LK, MK, HK
+    # DI and L2 sit on equilateral triangles over (HP, HK) and (MK, LK)
+    p, k = left[[2, 4]], left[[5, 3]]
+    left[[6, 8], 0], left[[6, 8], 1] = cal_equiliteral_triangle(p[:, 0], p[:, 1], k[:, 0], k[:, 1])[:2]
+    left[7] = left[3] - (1, 3.5)  # L1
+    left[9] = box_width / 2 - 3.5, box_height - 1.5  # Select
+    left[10] = left[9] - (2.5, 0)  # Start
+
+    mirrored = left.copy()
+    mirrored[:, 0] = box_width - left[:, 0]
+
+    big, small = len(BIG_BUTTON_NAMES), len(SMALL_BUTTON_NAMES)
+    points = np.empty((2 * (big + small), 3))
+    points[:big, :2] = left[:big]
+    points[big:2 * big, :2] = mirrored[:big]
+    points[2 * big:2 * big + small, :2] = left[big:]
+    points[2 * big + small:, :2] = mirrored[big:]
+    points[:2 * big, 2] = big_radius
+    points[2 * big:, 2] = small_radius
+    points.setflags(write=False)
+
+    names = (BIG_BUTTON_NAMES + tuple(name + '_reverse' for name in BIG_BUTTON_NAMES)
+             + SMALL_BUTTON_NAMES + tuple(name + '_reverse' for name in SMALL_BUTTON_NAMES))
+    return ButtonLayout(names, points, 2 * big)
+
+
+def get_big_circle_points():
+    layout = button_layout()
+    return dict(zip(layout.names[:layout.big_count], map(tuple, layout.big.tolist()))).items()
+
+def get_small_circle_points(box_width, box_height):
+    layout = button_layout(box_width, box_height)
+    return dict(zip(layout.names[layout.big_count:], map(tuple, layout.small.tolist()))).items()
+
+
+def block_name(feature, size):
+    """A DXF safe block name for a feature of the given size, e.g. SCREW_HOLE_0_2."""
+    return f"{feature}_{size:g}".replace(".", "_").replace("-", "M")
+
+
+class LayerGeometry:
+    """
+    Records the add_* calls made by the draw functions, so a layer is drawn
+    once and can then be replayed into any number of DXF documents.
+
+    With blocks=True, the repeated features of the layout spec (the ones
+    with a "block" name) are recorded once in blocks, keyed by block name,
+    and referenced with add_blockref.
+    """
+
+    def __init__(self, blocks=False):
+        self.entities = []
+        self.blocks = {} if blocks else None
+
+    def add_lwpolyline(self, points, format=None, close=False):
+        # format is only recorded when given, e.g. "xyb" for points with bulges
+        args = (list(points),) if format is None else (list(points), format)
+        self.entities.append(("add_lwpolyline", args, {"close": close}))
+
+    def add_arc(self, center, radius, start_angle, end_angle):
+        self.entities.append(("add_arc", (center, radius, start_angle, end_angle), {}))
+
+    def add_circle(self, center, radius):
+        self.entities.append(("add_circle", (center, radius), {}))
+
+    def add_point(self, location):
+        self.entities.append(("add_point", (location,), {}))
+
+    def add_blockref(self, name, insert):
+        self.entities.append(("add_blockref", (name, insert), {}))
+
+    def fingerprint(self):
+        """A hash of the recorded calls; equal geometry gives an equal fingerprint."""
+        recorded = repr(self.entities)
+        if self.blocks:
+            recorded += repr(sorted((name, block.entities) for name, block in self.blocks.items()))
+        return hashlib.sha256(recorded.encode()).hexdigest()
+
+    def iter_entities(self):
+        """The recorded calls, like CompiledLayer.iter_entities()."""
+        return iter(self.entities)
+
+    def explode(self):
+        """A copy without blocks, every block reference replaced by its entities."""
+        flat = LayerGeometry()
+        flat.entities = list(flat_entities(self))
+        return flat
+
+    def replay(self, msp, dxfattribs=None):
+        """
+        Add the recorded entities to a model space.
+
+        Args:
+        - msp: The model space the entities are added to.
+        - dxfattribs: Extra DXF attributes for every entity, e.g. {"layer": "layer1"}.
+        """
+        replay_entities(msp, self.entities, self.blocks, dxfattribs)
+
+
+def replay_entities(msp, entities, blocks, dxfattribs=None):
+    """
+    Make the recorded (method, args, kwargs) calls on msp, defining the
+    blocks the block references need in its document first.
+    """
+    with span("replay"):
+        for method, args, kwargs in entities:
+            if method == "add_blockref" and args[0] not in msp.doc.blocks:
+                # Block entities stay on layer 0, so they take the layer of the reference
+                blocks[args[0]].replay(msp.doc.blocks.new(args[0]))
+            if dxfattribs:
+                kwargs = dict(kwargs, dxfattribs=dxfattribs)
+            getattr(msp, method)(*args, **kwargs)
+
+
+def flat_entities(source):
+    """
+    Yield the calls of a LayerGeometry or CompiledLayer one at a time, every
+    block reference replaced by the calls of its block, moved into place.
+    """
+    for method, args, kwargs in source.iter_entities():
+        if method == "add_blockref":
+            name, (dx, dy) = args
+            for entity in source.blocks[name].iter_entities():
+                yield _translate(entity, dx, dy)
+        else:
+            yield method, args, kwargs
+
+
+def _translate(entity, dx, dy):
+    method, args, kwargs = entity
+    if method == "add_lwpolyline":
+        points = [(x + dx, y + dy, *rest) for x, y, *rest in args[0]]
+        return method, (points,) + args[1:], kwargs
+    (x, y), *rest = args
+    return method, ((x + dx, y + dy), *rest), kwargs
+
+
+def iter_primitives(source):
+    """
+    Yield the drawable primitives of a LayerGeometry (or a spec.CompiledLayer),
+    an ezdxf document or a layout as ("line", x0, y0, x1, y1),
+    ("arc", cx, cy, r, start, end), ("circle", cx, cy, r) or ("point", x, y)
+    tuples.
+    """
+    if hasattr(source, "replay"):
+        for method, args, kwargs in flat_entities(source):
+            if method == "add_lwpolyline":
+                points = args[0]
+                if len(args) == 1:
+                    points = [(x, y, 0) for x, y in points]
+                if kwargs.get("close") and points[0][:2] != points[-1][:2]:
+                    points = points + points[:1]
+                yield from _polyline_primitives(points)
+            elif method == "add_arc":
+                (cx, cy), radius, start, end = args
+                yield "arc", cx, cy, radius, start, end
+            elif method == "add_circle":
+                (cx, cy), radius = args
+                yield "circle", cx, cy, radius
+            elif method == "add_point":
+                yield "point", args[0][0], args[0][1]
+        return
+
+    msp = source.modelspace() if hasattr(source, "modelspace") else source
+    for entity in msp:
+        yield from _entity_primitives(entity)
+
+
+def bulge_arc(x0, y0, x1, y1, bulge):
+    """
+    The (cx, cy, radius, start, end) arc, angles in degrees counter clockwise,
+    of a polyline segment from (x0, y0) to (x1, y1) with the given bulge.
+    """
+    if bulge < 0:
+        x0, y0, x1, y1, bulge = x1, y1, x0, y0, -bulge
+    sweep = 4 * math.atan(bulge)
+    chord = math.hypot(x1 - x0, y1 - y0)
+    radius = chord / (2 * math.sin(sweep / 2))
+    # The centre sits on the left of the chord for sweeps under 180 degrees
+    offset = radius * math.cos(sweep / 2) / chord
+    cx = (x0 + x1) / 2 - (y1 - y0) * offset
+    cy = (y0 + y1) / 2 + (x1 - x0) * offset
+    start = math.degrees(math.atan2(y0 - cy, x0 - cx))
+    end = math.degrees(math.atan2(y1 - cy, x1 - cx))
+    return cx, cy, radius, start, end
+
+
+def _polyline_primitives(points):
+    for (x0, y0, bulge), (x1, y1, _) in zip(points, points[1:]):
+        if bulge:
+            yield ("arc",) + bulge_arc(x0, y0, x1, y1, bulge)
+        else:
+            yield "line", x0, y0, x1, y1
+
+
+def _entity_primitives(entity):
+    kind = entity.dxftype()
+    if kind == "LINE":
+        yield "line", entity.dxf.start.x, entity.dxf.start.y, entity.dxf.end.x, entity.dxf.end.y
+    elif kind == "LWPOLYLINE":
+        points = list(entity.get_points("xyb"))
+        if entity.closed and points[0][:2] != points[-1][:2]:
+            points.append(points[0])
+        yield from _polyline_primitives(points)
+    elif kind == "POLYLINE" and entity.is_2d_polyline:
+        points = [(v.dxf.location.x, v.dxf.location.y, v.dxf.bulge) for v in entity.vertices]
+        if entity.is_closed and points[0][:2] != points[-1][:2]:
+            points.append(points[0])
+        yield from _polyline_primitives(points)
+    elif kind == "ARC":
+        yield ("arc", entity.dxf.center.x, entity.dxf.center.y, entity.dxf.radius,
+               entity.dxf.start_angle, entity.dxf.end_angle)
+    elif kind == "CIRCLE":
+        yield "circle", entity.dxf.center.x, entity.dxf.center.y, entity.dxf.radius
+    elif kind == "POINT":
+        yield "point", entity.dxf.location.x, entity.dxf.location.y
+    elif kind == "INSERT":
+        for child in entity.virtual_entities():
+            yield from _entity_primitives(child)
+
+
+def _add_compiled(layer, msp):
+    blocks = getattr(msp, "blocks", None)
+    for name, block in (layer.blocks or {}).items():
+        if name not in blocks:
+            blocks[name] = LayerGeometry()
+            _add_compiled(block, blocks[name])
+    for method, args, kwargs in layer.entities:
+        getattr(msp, method)(*args, **kwargs)
+
+
+def spec_drawer(key):
+    """
+    The draw(msp, params) function of a layer of the built-in layout spec,
+    gigabox/layout.json, see spec.compile_layout(). A LayerGeometry
+    recording blocks gets the repeated features as blocks.
+    """
+    def draw(msp, params=DEFAULT_PARAMS):
+        from .spec import compile_layout
+        _add_compiled(compile_layout(params, blocks=getattr(msp, "blocks", None) is not None).layers[key], msp)
+    draw.__name__ = draw.__qualname__ = f"draw_layer{key}" if isinstance(key, int) else f"draw_{key}"
+    return draw
+
+
+draw_layer1, draw_layer2, draw_layer3, draw_layer4, draw_layer5, draw_layer6 = map(spec_drawer, range(1, 7))
+draw_art = spec_drawer("art")
+draw_art_bottom = spec_drawer("bottom")
+
+LAYER_DRAWERS = {
+    1: draw_layer1,  # 3mm
+    2: draw_layer2,  # 3mm
+    3: draw_layer3,  # 1.6mm
+    4: draw_layer4,  # 1.6mm
+    5: draw_layer5,  # 3mm
+    6: draw_layer6,  # 3mm
+}
+# Material thickness of every layer in mm, sheets are nested per thickness
+LAYER_THICKNESS = {1: 3, 2: 3, 3: 1.6, 4: 1.6, 5: 3, 6: 3}
+
+
+def record_layers(layers=None, params=DEFAULT_PARAMS, blocks=False):
+    """
+    Compile the layout spec once and record each layer into a LayerGeometry.
+
+    Args:
+    - layers: Layer numbers to record, defaults to all of LAYER_DRAWERS.
+    - params: The BoxParams of the variant.
+    - blocks: Record repeated features as blocks, see LayerGeometry.
+    """
+    from .spec import compile_layout
+    compiled = compile_layout(params, blocks=blocks).layers
+    geometries = {}
+    for layer in layers or LAYER_DRAWERS:
+        geometry = LayerGeometry(blocks)
+        _add_compiled(compiled[layer], geometry)
+        geometries[layer] = geometry
+    return geometries
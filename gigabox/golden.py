@@ -0,0 +1,427 @@
+"""
+Reading generated DXF files back and diffing them against golden copies.
+
+read_dxf() does not build a document: it streams the group code and value
+pairs of the file, skips every section but ENTITIES and BLOCKS and keeps
+the entities this project writes (CIRCLE, ARC, LWPOLYLINE and POINT, the
+POLYLINE/VERTEX pairs of the R12 stream writer and INSERTs of its own
+blocks, exploded) as a CompiledLayer per DXF layer. The
+diff matches the features of two such layers by shape and position.
+"""
+import os
+import time
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from .pool import run_bounded
+from .spec import ARC, CIRCLE, POINT, POLYLINE, PRIMITIVE_DTYPE, CompiledLayer
+from .trace import count, traced
+
+default_tolerance = 1e-4  # in cm, how far apart matching features may be
+compare_chunk = 1 << 20  # bytes read at a time when checking files for equal bytes
+
+
+def _pairs(f):
+    """The (group code, value) pairs of an open DXF file, read a line pair at a time."""
+    for code, value in zip(f, f):
+        yield code.strip(), value.rstrip("\r\n")
+
+
+def _entities(pairs):
+    """
+    (kind, tags) of every entity up to the end of the section pairs is in,
+    each with the (code, value) tags up to the next entity. Only one
+    entity's tags are held at a time.
+    """
+    kind, tags = None, []
+    for code, value in pairs:
+        if code == "0":
+            if kind is not None:
+                yield kind, tags
+            kind, tags = value.strip(), []
+            if kind == "ENDSEC":
+                return
+        else:
+            tags.append((code, value))
+    if kind is not None:
+        yield kind, tags
+
+
+class _Collector:
+    """The rows and vertices of every DXF layer, as lists, while a file is read."""
+
+    def __init__(self):
+        self.layers = {}
+
+    def layer(self, name):
+        if name not in self.layers:
+            self.layers[name] = ([], [])
+        return self.layers[name]
+
+    def compiled(self):
+        return {name: CompiledLayer(np.array(rows, PRIMITIVE_DTYPE), np.array(vertices, float).reshape(-1, 3))
+                for name, (rows, vertices) in self.layers.items()}
+
+
+class _EntityReader:
+    """
+    Adds entities to out, a _Collector, one at a time. blocks maps block
+    names to (base x, base y, _Collector) for the INSERTs to explode. The
+    R12 POLYLINE being read is kept until its SEQEND.
+    """
+
+    def __init__(self, out, blocks):
+        self.out = out
+        self.blocks = blocks
+        self.polyline = None
+
+    def add(self, kind, tags):
+        if kind not in ("CIRCLE", "ARC", "LWPOLYLINE", "POINT", "POLYLINE", "VERTEX", "SEQEND", "INSERT"):
+            return
+        layer = "0"
+        x = y = radius = start_angle = end_angle = bulge = 0.0
+        flags = 0
+        name = None
+        scaled = False
+        points = []
+        for code, value in tags:
+            if code == "8":
+                layer = value.strip()
+            elif code == "10":
+                x = float(value)
+                if kind == "LWPOLYLINE":
+                    points.append([x, 0.0, 0.0])
+            elif code == "20":
+                y = float(value)
+                if kind == "LWPOLYLINE" and points:
+                    points[-1][1] = y
+            elif code == "42":
+                if kind == "LWPOLYLINE" and points:
+                    points[-1][2] = float(value)
+                elif kind == "VERTEX":
+                    bulge = float(value)
+                elif kind == "INSERT" and float(value) != 1:
+                    scaled = True
+            elif code == "40":
+                radius = float(value)
+            elif code == "50":
+                start_angle = float(value)
+                if kind == "INSERT" and start_angle:
+                    scaled = True
+            elif code == "51":
+                end_angle = float(value)
+            elif code == "70":
+                flags = int(value)
+            elif code == "2":
+                name = value.strip()
+            elif code in ("41", "43") and kind == "INSERT" and float(value) != 1:
+                scaled = True
+
+        polyline = self.polyline
+        if kind == "VERTEX":
+            if polyline is not None:
+                polyline[1].append((x, y, bulge))
+            return
+        if kind == "SEQEND":
+            if polyline is not None:
+                (rows, vertices), points, closed = self.out.layer(polyline[0]), polyline[1], polyline[2]
+                rows.append((POLYLINE, closed, 0, 0, 0, 0, 0, len(vertices), len(points)))
+                vertices += points
+                self.polyline = None
+            return
+        if kind == "POLYLINE":
+            self.polyline = (layer, [], bool(flags & 1))
+            return
+        if kind == "INSERT":
+            if name not in self.blocks:
+                raise ValueError(f"INSERT of unknown block {name!r}")
+            if scaled:
+                raise ValueError(f"INSERT of {name!r} is scaled or rotated, which this reader does not support")
+            _insert(self.out.layer(layer), self.blocks[name], x, y)
+            return
+        rows, vertices = self.out.layer(layer)
+        if kind == "CIRCLE":
+            rows.append((CIRCLE, False, x, y, radius, 0, 0, 0, 0))
+        elif kind == "ARC":
+            rows.append((ARC, False, x, y, radius, start_angle, end_angle, 0, 0))
+        elif kind == "POINT":
+            rows.append((POINT, False, x, y, 0, 0, 0, 0, 0))
+        else:
+            rows.append((POLYLINE, bool(flags & 1), 0, 0, 0, 0, 0, len(vertices), len(points)))
+            vertices += map(tuple, points)
+
+
+def _insert(target, block, x, y):
+    """Add the entities of a block, moved to (x, y), to the (rows, vertices) lists of a layer."""
+    base_x, base_y, collected = block
+    dx, dy = x - base_x, y - base_y
+    rows, vertices = target
+    # Entities of a block keep their own layers in the file, but land on the layer of the INSERT here
+    for block_rows, block_vertices in collected.layers.values():
+        for kind, closed, cx, cy, radius, start, end, first, size in block_rows:
+            if kind == POLYLINE:
+                rows.append((kind, closed, 0, 0, 0, 0, 0, len(vertices), size))
+                vertices += [(px + dx, py + dy, bulge) for px, py, bulge in block_vertices[first:first + size]]
+            else:
+                rows.append((kind, closed, cx + dx, cy + dy, radius, start, end, 0, 0))
+
+
+def _read_blocks(pairs, blocks):
+    """Add block name to (base x, base y, _Collector) for the blocks of the BLOCKS section to blocks."""
+    reader = header = None
+    for kind, tags in _entities(pairs):
+        if kind == "BLOCK":
+            header = {}
+            for code, value in tags:
+                header.setdefault(code, value)
+            reader = _EntityReader(_Collector(), blocks)
+        elif kind == "ENDBLK" and reader is not None:
+            blocks[header.get("2", "").strip()] = (float(header.get("10", 0)), float(header.get("20", 0)),
+                                                   reader.out)
+            reader = None
+        elif reader is not None:
+            reader.add(kind, tags)
+
+
+@traced
+def read_dxf(path):
+    """
+    Read the entities of a DXF file this project wrote (with ezdxf or the
+    stream writer) into a CompiledLayer per DXF layer name, in the order the
+    layers first appear. Block references are exploded.
+
+    The file is read a line pair at a time: sections other than BLOCKS and
+    ENTITIES are skipped as they are read, and of those two only the entity
+    being read and the collected rows are kept in memory.
+    """
+    count("golden.bytes", os.path.getsize(path))
+    blocks = {}
+    out = _Collector()
+    with open(path, encoding="utf-8", errors="replace") as f:
+        pairs = _pairs(f)
+        for code, value in pairs:
+            if code != "0" or value.strip() != "SECTION":
+                continue
+            code, value = next(pairs, (None, ""))
+            name = value.strip()
+            if name == "BLOCKS":
+                _read_blocks(pairs, blocks)
+            elif name == "ENTITIES":
+                reader = _EntityReader(out, blocks)
+                for kind, tags in _entities(pairs):
+                    reader.add(kind, tags)
+            else:
+                for code, value in pairs:
+                    if code == "0" and value.strip() == "ENDSEC":
+                        break
+    return out.compiled()
+
+
+@dataclass
+class Feature:
+    """A primitive of a layer: its kind, where it is and what it looks like."""
+    kind: str
+    x: float
+    y: float
+    # radius for circles, (radius, start, end) for arcs, the vertices for polylines
+    shape: object = None
+
+    def __str__(self):
+        if self.kind == "circle":
+            return f"circle r{self.shape:g} at ({self.x:.4f}, {self.y:.4f})"
+        if self.kind == "arc":
+            radius, start, end = self.shape
+            return f"arc r{radius:g} {start:g}-{end:g} at ({self.x:.4f}, {self.y:.4f})"
+        if self.kind == "polyline":
+            return f"polyline of {len(self.shape)} vertices from ({self.x:.4f}, {self.y:.4f})"
+        return f"point at ({self.x:.4f}, {self.y:.4f})"
+
+
+@dataclass
+class LayerDiff:
+    """How a layer differs from its golden copy."""
+    added: list = field(default_factory=list)  # Features only in the new layer
+    removed: list = field(default_factory=list)  # Features only in the golden layer
+    moved: list = field(default_factory=list)  # (golden Feature, new Feature) pairs of the same shape
+
+    @property
+    def same(self):
+        return not (self.added or self.removed or self.moved)
+
+
+def _feature(layer, index):
+    """The Feature of a row of a flat CompiledLayer."""
+    kind, closed, x, y, radius, start, end, first, size = layer.rows[index].tolist()
+    if kind == POLYLINE:
+        points = layer.vertices[first:first + size]
+        return Feature("polyline", float(points[0, 0]), float(points[0, 1]),
+                       (points - (points[0, 0], points[0, 1], 0)).tolist())
+    if kind == CIRCLE:
+        return Feature("circle", x, y, radius)
+    if kind == ARC:
+        return Feature("arc", x, y, (radius, start, end))
+    return Feature("point", x, y)
+
+
+def _shapes(layer, tolerance):
+    """
+    The positions of the rows of a flat CompiledLayer, the first vertex for
+    polylines, and a shape key per row, the shape rounded to the tolerance,
+    so features that can match share a key. Empty polylines get None.
+    """
+    rows, vertices = layer.rows, layer.vertices
+    positions = np.column_stack([rows["x"], rows["y"]])
+    sizes = np.column_stack([rows["radius"], rows["start"], rows["end"]])
+    keys = list(zip(rows["kind"].tolist(), rows["closed"].tolist(),
+                    map(tuple, np.round(sizes / tolerance).astype(np.int64).tolist())))
+    for index in np.flatnonzero(rows["kind"] == POLYLINE).tolist():
+        first, size = int(rows["first"][index]), int(rows["count"][index])
+        if not size:
+            keys[index] = None
+            continue
+        points = vertices[first:first + size]
+        positions[index] = points[0, :2]
+        relative = points - (points[0, 0], points[0, 1], 0)
+        keys[index] = (POLYLINE, keys[index][1], np.round(relative / tolerance).astype(np.int64).tobytes())
+    return positions, keys
+
+
+@traced
+def diff_layers(golden, new, tolerance=default_tolerance):
+    """
+    Match the features of two layers. Features of the same shape within the
+    tolerance of each other are unchanged; of the ones left, features of
+    the same shape are paired up nearest first as moved and the rest are
+    added or removed.
+
+    Args:
+    - golden, new: The CompiledLayers, from read_dxf() or compile_layout().
+    - tolerance: In cm, for positions and shapes.
+    """
+    golden, new = golden.explode(), new.explode()
+    diff = LayerDiff()
+    if golden.rows.tobytes() == new.rows.tobytes() and golden.vertices.tobytes() == new.vertices.tobytes():
+        return diff
+    (golden_positions, golden_keys), (new_positions, new_keys) = _shapes(golden, tolerance), _shapes(new, tolerance)
+    groups = {}
+    for side, keys in enumerate((golden_keys, new_keys)):
+        for index, key in enumerate(keys):
+            if key is not None:
+                groups.setdefault(key, ([], []))[side].append(index)
+
+    for old, current in groups.values():
+        old, current = np.array(old, int), np.array(current, int)
+        moved = []
+        if len(old) and len(current):
+            a, b = golden_positions[old], new_positions[current]
+            distance = np.hypot(a[:, None, 0] - b[None, :, 0], a[:, None, 1] - b[None, :, 1])
+            # Most features have not changed: they are each other's nearest, within the tolerance
+            nearest = distance.argmin(axis=1)
+            same = (distance.argmin(axis=0)[nearest] == np.arange(len(a))) & (
+                distance[np.arange(len(a)), nearest] <= tolerance)
+            left_b = np.ones(len(b), bool)
+            left_b[nearest[same]] = False
+            old, current, distance = old[~same], current[left_b], distance[~same][:, left_b]
+            # Pair up the rest nearest first, each feature in one pair at most
+            used_a, used_b = np.zeros(len(old), bool), np.zeros(len(current), bool)
+            for flat in np.argsort(distance, axis=None, kind="stable").tolist()[:distance.size]:
+                if used_a.all() or used_b.all():
+                    break
+                i, j = divmod(flat, len(current))
+                if used_a[i] or used_b[j]:
+                    continue
+                used_a[i] = used_b[j] = True
+                if distance[i, j] > tolerance:
+                    moved.append((old[i], current[j]))
+            old, current = old[~used_a], current[~used_b]
+        diff.moved += [(_feature(golden, i), _feature(new, j)) for i, j in moved]
+        diff.removed += [_feature(golden, i) for i in old.tolist()]
+        diff.added += [_feature(new, j) for j in current.tolist()]
+    return diff
+
+
+def _same_bytes(a, b, chunk=compare_chunk):
+    """Whether two files have the same bytes, compared a chunk at a time."""
+    if os.path.getsize(a) != os.path.getsize(b):
+        return False
+    with open(a, "rb") as fa, open(b, "rb") as fb:
+        while True:
+            data = fa.read(chunk)
+            if data != fb.read(chunk):
+                return False
+            if not data:
+                return True
+
+
+def diff_files(golden_path, new_path, tolerance=default_tolerance):
+    """
+    Diff two DXF files layer by layer. Returns DXF layer name to LayerDiff
+    for the layers that differ; a layer in only one of the files counts as
+    all added or all removed. Files with the same bytes, as deterministic
+    builds of the same layout are, are only compared a chunk at a time.
+    """
+    if _same_bytes(golden_path, new_path):
+        count("golden.identical")
+        return {}
+    golden, new = read_dxf(golden_path), read_dxf(new_path)
+    empty = CompiledLayer(np.zeros(0, PRIMITIVE_DTYPE), np.zeros((0, 3)))
+    diffs = {}
+    for name in {**golden, **new}:
+        diff = diff_layers(golden.get(name, empty), new.get(name, empty), tolerance)
+        if not diff.same:
+            diffs[name] = diff
+    return diffs
+
+
+@dataclass
+class GoldenResult:
+    """The diff of one file of a golden set: its relative name and DXF layer name to LayerDiff."""
+    name: str
+    diffs: dict
+    seconds: float
+    error: str = None
+
+    @property
+    def same(self):
+        return self.error is None and not self.diffs
+
+
+def diff_golden_file(name, golden_dir, new_dir, tolerance=default_tolerance):
+    start = time.perf_counter()
+    new_path = os.path.join(new_dir, name)
+    if not os.path.exists(new_path):
+        return GoldenResult(name, {}, 0, f"{new_path} is missing")
+    try:
+        diffs = diff_files(os.path.join(golden_dir, name), new_path, tolerance)
+    except (OSError, ValueError) as e:
+        return GoldenResult(name, {}, time.perf_counter() - start, repr(e))
+    return GoldenResult(name, diffs, time.perf_counter() - start)
+
+
+def golden_names(golden_dir):
+    """The .dxf files under golden_dir, as sorted paths relative to it."""
+    names = []
+    for directory, dirs, files in os.walk(golden_dir):
+        dirs.sort()
+        names += [os.path.relpath(os.path.join(directory, name), golden_dir)
+                  for name in sorted(files) if name.lower().endswith(".dxf")]
+    return names
+
+
+def diff_golden(golden_dir, new_dir, tolerance=default_tolerance, jobs=None):
+    """
+    Diff every .dxf file under golden_dir against the file at the same
+    relative path under new_dir on a process pool, yielding a GoldenResult
+    for each as it finishes.
+
+    Args:
+    - golden_dir: The golden set, e.g. a copy of output_dxf or of a batch.
+    - new_dir: The build to check.
+    - tolerance: In cm, for positions and shapes.
+    - jobs: Number of worker processes, defaults to one per CPU. With jobs=1
+      everything runs in the current process.
+    """
+    tasks = ((name, golden_dir, new_dir, tolerance) for name in golden_names(golden_dir))
+    return run_bounded(diff_golden_file, tasks, jobs)
+
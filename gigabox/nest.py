@@ -0,0 +1,302 @@
+"""
+Nesting the plates of many boxes onto stock sheets. Parts are packed by
+their bounding boxes with a skyline packer, per material thickness, and
+every sheet is streamed to its own file with the parts moved into place.
+"""
+import json
+import os
+import re
+from dataclasses import dataclass, field
+
+from .geometry import LAYER_THICKNESS, flat_entities
+from .stream import _format, drawing_bounds, open_stream
+from .trace import count, span, traced
+
+default_sheet = (122, 61)  # in cm, width x height of the stock, 4 x 2 ft
+default_kerf = 0.1  # in cm, space left between parts and around the sheet
+fit_tolerance = 1e-9  # in cm
+
+
+@dataclass
+class Part:
+    """A plate to cut: its geometry, material and the bounds of the geometry."""
+    name: str
+    material: str
+    geometry: object
+    bounds: tuple
+
+    @property
+    def width(self):
+        return self.bounds[2] - self.bounds[0]
+
+    @property
+    def height(self):
+        return self.bounds[3] - self.bounds[1]
+
+
+@dataclass
+class Placement:
+    """Where a part goes: the corner of its bounds on the sheet, turned 90 degrees or not."""
+    part: Part
+    x: float
+    y: float
+    rotated: bool = False
+
+
+@dataclass
+class Sheet:
+    material: str
+    width: float
+    height: float
+    placements: list = field(default_factory=list)
+
+    @property
+    def utilization(self):
+        """The share of the sheet covered by the bounds of its parts."""
+        used = sum(placement.part.width * placement.part.height for placement in self.placements)
+        return used / (self.width * self.height)
+
+
+def material_name(thickness):
+    return f"{thickness:g}mm"
+
+
+def variant_parts(variants, layers=None, toolpath=False, spec=None):
+    """
+    Yield a Part for every layer of every (name, params) variant, named
+    <variant>-layer<n>, with the material of LAYER_THICKNESS. Raises
+    ValueError for a variant iter_variants() could not parse.
+
+    Args:
+    - variants: Iterable of (name, BoxParams), e.g. from build.iter_variants().
+    - layers: Layer numbers to nest, defaults to all of LAYER_THICKNESS.
+    - toolpath: Nest the layers as optimized laser toolpaths.
+    - spec: The layout spec, see spec.compile_layout().
+    """
+    from .build import record_targets
+    for name, params in variants:
+        if isinstance(params, Exception):
+            raise ValueError(f"variant {name}: {params}")
+        geometries = record_targets(params, toolpath, spec=spec)
+        for layer in layers or LAYER_THICKNESS:
+            geometry = geometries[layer]
+            bounds = geometry.bounds() if hasattr(geometry, "bounds") else drawing_bounds([geometry])
+            yield Part(f"{name}-layer{layer}", material_name(LAYER_THICKNESS[layer]), geometry, bounds)
+
+
+class _Skyline:
+    """
+    The top edge of the parts packed so far, as [x, y, width] segments from
+    left to right. A part is put where its top ends up lowest, then leftmost.
+    """
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.segments = [[0, 0, width]]
+        # Sizes that did not fit; the skyline only grows, so no larger size will
+        self.misses = []
+
+    def find(self, width, height):
+        """(top, x, y) of the best spot for a width x height part, or None."""
+        if any(width >= miss_width and height >= miss_height for miss_width, miss_height in self.misses):
+            return None
+        best = None
+        segments = self.segments
+        for i, (x, y, _) in enumerate(segments):
+            if x + width > self.width + fit_tolerance:
+                break
+            # The part rests on the highest segment under it
+            j, end = i, x + width
+            while j < len(segments) and segments[j][0] < end - fit_tolerance:
+                y = max(y, segments[j][1])
+                j += 1
+            if y + height <= self.height + fit_tolerance and (best is None or (y + height, x) < best[:2]):
+                best = (y + height, x, y)
+        if best is None:
+            self.misses.append((width, height))
+        return best
+
+    def place(self, x, y, width, height):
+        end = x + width
+        left = [segment for segment in self.segments if segment[0] + segment[2] <= x + fit_tolerance]
+        right = [segment for segment in self.segments if segment[0] >= end - fit_tolerance]
+        covered = self.segments[len(left):len(self.segments) - len(right)]
+        segments = left
+        if covered and covered[0][0] < x:
+            segments.append([covered[0][0], covered[0][1], x - covered[0][0]])
+        segments.append([x, y + height, width])
+        if covered and covered[-1][0] + covered[-1][2] > end:
+            segments.append([end, covered[-1][1], covered[-1][0] + covered[-1][2] - end])
+        segments += right
+        # Neighbours at the same height become one segment
+        merged = [segments[0]]
+        for segment in segments[1:]:
+            if abs(segment[1] - merged[-1][1]) <= fit_tolerance:
+                merged[-1] = [merged[-1][0], merged[-1][1], segment[0] + segment[2] - merged[-1][0]]
+            else:
+                merged.append(segment)
+        self.segments = merged
+
+
+@traced
+def pack(parts, sheet=default_sheet, sheet_sizes=None, kerf=default_kerf, rotate=True):
+    """
+    Pack parts onto as few sheets as the skyline packer manages, each
+    material on its own sheets. Returns the Sheets, grouped by material in
+    the order the materials first appear.
+
+    Args:
+    - parts: Iterable of Parts.
+    - sheet: (width, height) of the sheets in cm.
+    - sheet_sizes: Material name to (width, height) for materials cut from
+      other sheets.
+    - kerf: Space in cm between the parts and to the sheet edges.
+    - rotate: Also try every part turned by 90 degrees.
+    """
+    sheet_sizes = sheet_sizes or {}
+    by_material = {}
+    for part in parts:
+        by_material.setdefault(part.material, []).append(part)
+
+    sheets = []
+    for material, material_parts in by_material.items():
+        width, height = sheet_sizes.get(material, sheet)
+        # The skyline holds the parts grown by the kerf, inside the sheet minus the kerf
+        area = (width - kerf, height - kerf)
+        material_parts.sort(key=lambda part: (-max(part.width, part.height), -min(part.width, part.height)))
+        # Every part covers a square of the smallest side, a sheet without room for it is full
+        smallest = min(min(part.width, part.height) for part in material_parts) + kerf
+        open_sheets = []
+        for part in material_parts:
+            sizes = [(part.width + kerf, part.height + kerf, False)]
+            if rotate and part.width != part.height:
+                sizes.append((part.height + kerf, part.width + kerf, True))
+            for target, skyline in open_sheets:
+                if _place(target, skyline, part, sizes, kerf):
+                    break
+            else:
+                target, skyline = Sheet(material, width, height), _Skyline(*area)
+                if not _place(target, skyline, part, sizes, kerf):
+                    raise ValueError(f"{part.name} ({part.width:g} x {part.height:g}cm) does not fit on a "
+                                     f"{width:g} x {height:g}cm {material} sheet with {kerf:g}cm kerf")
+                sheets.append(target)
+                open_sheets.append((target, skyline))
+            if skyline.find(smallest, smallest) is None:
+                # By identity: Sheet compares equal by value, so remove() would compare placements
+                open_sheets = [entry for entry in open_sheets if entry[0] is not target]
+    count("nest.parts", sum(len(sheet.placements) for sheet in sheets))
+    count("nest.sheets", len(sheets))
+    return sheets
+
+
+def _place(sheet, skyline, part, sizes, kerf):
+    best = None
+    for width, height, rotated in sizes:
+        spot = skyline.find(width, height)
+        if spot is not None and (best is None or spot[:2] < best[0][:2]):
+            best = spot, width, height, rotated
+    if best is None:
+        return False
+    (top, x, y), width, height, rotated = best
+    skyline.place(x, y, width, height)
+    sheet.placements.append(Placement(part, x + kerf, y + kerf, rotated))
+    return True
+
+
+class _Placed:
+    """
+    Passes the add_* calls of a part on to out, with the geometry moved
+    (and turned) to its placement on the sheet.
+    """
+
+    def __init__(self, out, placement):
+        self.out = out
+        self.rotated = placement.rotated
+        x0, y0, x1, y1 = placement.part.bounds
+        if self.rotated:
+            # (x, y) turns to (-y, x), which puts the bounds at (-y1, x0)
+            self.dx, self.dy = placement.x + y1, placement.y - x0
+        else:
+            self.dx, self.dy = placement.x - x0, placement.y - y0
+
+    def _point(self, x, y):
+        if self.rotated:
+            return self.dx - y, self.dy + x
+        return self.dx + x, self.dy + y
+
+    def add_lwpolyline(self, points, format=None, close=False, dxfattribs=None):
+        points = [(*self._point(*point[:2]), *point[2:]) for point in points]
+        self.out.add_lwpolyline(points, format, close, dxfattribs=dxfattribs)
+
+    def add_arc(self, center, radius, start_angle, end_angle, dxfattribs=None):
+        turn = 90 if self.rotated else 0
+        self.out.add_arc(self._point(*center), radius, start_angle + turn, end_angle + turn, dxfattribs=dxfattribs)
+
+    def add_circle(self, center, radius, dxfattribs=None):
+        self.out.add_circle(self._point(*center), radius, dxfattribs=dxfattribs)
+
+    def add_point(self, location, dxfattribs=None):
+        self.out.add_point(self._point(*location[:2]), dxfattribs=dxfattribs)
+
+
+def _layer_name(name):
+    # Characters DXF does not allow in layer names
+    return re.sub(r'[<>/\\":;?*|=`]', "_", name)
+
+
+@traced
+def write_sheets(sheets, out_dir, extension=".dxf"):
+    """
+    Stream every sheet to out_dir/sheet-<material>-<n><extension>, each part
+    on a layer named after it, and list the placements in sheets.json.
+    Returns the paths written.
+
+    Args:
+    - sheets: The Sheets from pack().
+    - out_dir: Output directory, created if needed.
+    - extension: .dxf, .svg, .pdf or .gcode, see stream.STREAM_FORMATS.
+    """
+    _format("sheet" + extension)
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    numbers = {}
+    summary = {}
+    for sheet in sheets:
+        numbers[sheet.material] = numbers.get(sheet.material, 0) + 1
+        path = os.path.join(out_dir, f"sheet-{sheet.material}-{numbers[sheet.material]:03d}{extension}")
+        with span("write_sheet"), open_stream(path, (0, 0, sheet.width, sheet.height)) as out:
+            for placement in sheet.placements:
+                placed, dxfattribs = _Placed(out, placement), {"layer": _layer_name(placement.part.name)}
+                for method, args, kwargs in flat_entities(placement.part.geometry):
+                    getattr(placed, method)(*args, **kwargs, dxfattribs=dxfattribs)
+        paths.append(path)
+        summary[os.path.basename(path)] = {
+            "material": sheet.material, "size": [sheet.width, sheet.height],
+            "utilization": round(sheet.utilization, 4),
+            "parts": [{"name": p.part.name, "x": p.x, "y": p.y, "rotated": p.rotated} for p in sheet.placements],
+        }
+    with open(os.path.join(out_dir, "sheets.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+    return paths
+
+
+def parse_sheet_sizes(specs):
+    """
+    Parse --sheet options, WxH for every material or MATERIAL=WxH for one
+    (e.g. 1.6mm=60x40), in cm. Returns (sheet, sheet_sizes) for pack().
+    """
+    default, sizes = default_sheet, {}
+    for spec in specs:
+        material, sep, size = spec.rpartition("=")
+        try:
+            width, height = (float(value) for value in size.lower().split("x"))
+        except ValueError:
+            raise ValueError(f"expected WxH or MATERIAL=WxH but got {spec!r}") from None
+        if width <= 0 or height <= 0:
+            raise ValueError(f"sheet sizes must be positive, got {spec!r}")
+        if sep:
+            sizes[material] = (width, height)
+        else:
+            default = (width, height)
+    return default, sizes
@@ -0,0 +1,67 @@
+"""
+The process pool plumbing shared by the DXF and image batch builds.
+"""
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+from dataclasses import dataclass
+
+from . import trace
+
+
+@dataclass
+class BuildResult:
+    name: str
+    path: str
+    ok: bool
+    seconds: float
+    error: str = None
+    skipped: bool = False
+    digest: str = None  # SHA-256 of what was written
+
+
+def run_bounded(fn, tasks, jobs=None, initializer=None, initargs=()):
+    """
+    Call fn(*args) for every args tuple in tasks on a process pool and yield
+    the results as they finish. Tasks are pulled from the iterable only as
+    workers free up, so memory stays bounded however many tasks there are.
+
+    Args:
+    - fn: A picklable, module level function.
+    - tasks: Iterable of argument tuples.
+    - jobs: Number of worker processes, defaults to one per CPU. With jobs=1
+      everything runs in the current process.
+    - initializer, initargs: Run once in every worker before its first task.
+
+    Spans and counters recorded in the workers are merged into this process.
+    """
+    if jobs == 1:
+        if initializer is not None:
+            initializer(*initargs)
+        for args in tasks:
+            yield fn(*args)
+        return
+
+    max_pending = 2 * (jobs or os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(initializer, initargs)) as executor:
+        pending = set()
+        for args in tasks:
+            if len(pending) >= max_pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield _merged(future)
+            pending.add(executor.submit(trace.call_recorded, fn, args, trace.recording_events()))
+        for future in as_completed(pending):
+            yield _merged(future)
+
+
+def _init_worker(initializer, initargs):
+    # Forked workers start with a copy of what the parent recorded so far
+    trace.reset()
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def _merged(future):
+    result, recorded = future.result()
+    trace.merge(recorded)
+    return result
@@ -0,0 +1,289 @@
+"""
+A local HTTP service that generates box files and previews on demand, run
+it with `python -m gigabox --serve`. Generation runs on a pool of warm
+worker processes, identical requests in flight share one job, and requests
+beyond the queue limit are turned away with a 503 instead of piling up.
+
+Parameters are BoxParams overrides, as a JSON object body (POST) or in the
+query string. They are checked before any work is queued, a value that is
+not finite or out of range gets a 400 naming the field:
+- GET /health: the queue and the service counters as JSON.
+- GET|POST /dxf?writer=stream&toolpath=1&blocks=1: a zip of every
+  BUILD_TARGETS file, in the format of each writer given.
+- GET|POST /preview?layer=art&dpi=72&backend=native: a PNG of the art
+  layer, the bottom art ("bottom") or a plate (1-6). With width=N a
+  thumbnail N px wide instead, drawn at its own size.
+"""
+import asyncio
+import io
+import json
+import os
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, replace
+from urllib.parse import parse_qsl, urlsplit
+
+from . import trace
+from .build import BUILD_TARGETS, parse_params, record_targets, target_path, write_target, writer_list
+from .geometry import DEFAULT_PARAMS, LAYER_DRAWERS
+from .spec import compile_layout, load_spec
+from .trace import count
+
+default_host = "127.0.0.1"
+default_port = 8040
+default_max_queue = 32  # distinct jobs queued or running before requests get a 503
+max_body = 64 * 1024
+read_timeout = 10  # in seconds, for the request line, headers and body
+preview_dpi = 72
+# Query string keys that are options of the output rather than BoxParams
+OPTIONS = {"/dxf": ("writer", "toolpath", "blocks"), "/preview": ("layer", "dpi", "backend", "width")}
+
+
+class QueueFull(Exception):
+    pass
+
+
+def _warm_worker(spec):
+    # Pay for the imports and the spec compile once per worker, not per request
+    import ezdxf  # noqa: F401
+    from . import render  # noqa: F401
+    compile_layout(DEFAULT_PARAMS, spec)
+    trace.reset()
+
+
+def generate_files(params, writers, toolpath, blocks, spec=None):
+    """The zip, as bytes, of every BUILD_TARGETS file and the params.json of one variant."""
+    geometries = record_targets(params, toolpath, blocks, spec)
+    buffer = io.BytesIO()
+    with tempfile.TemporaryDirectory() as directory, zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for target in BUILD_TARGETS:
+            for writer in writers:
+                path = target_path(target, directory, writer)
+                write_target(target, geometries, path, writer)
+                archive.write(path, os.path.basename(path))
+        archive.writestr("params.json", json.dumps(asdict(params), indent=2))
+    return buffer.getvalue()
+
+
+def generate_preview(params, layer, dpi, backend, width=None, spec=None):
+    """
+    A PNG, as bytes, of one layer of a variant.
+
+    Args:
+    - params: The BoxParams of the variant.
+    - layer: "art", "bottom" or a layer number of LAYER_DRAWERS.
+    - dpi: Pixels per inch of the drawing.
+    - backend: The render.convert_dxf2img backend.
+    - width: Make a thumbnail this many px wide instead.
+    - spec: The layout spec, see spec.compile_layout().
+    """
+    from .render import PreviewPyramid
+    geometry = compile_layout(params, spec).layers[layer]
+    pyramid = PreviewPyramid(geometry, (dpi,), width, backend, size=(params.box_width, params.box_height))
+    image = pyramid.thumbnail() if width else pyramid.level(dpi)
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+def _flag(options, name):
+    return options.get(name, "0").lower() in ("1", "true", "yes")
+
+
+def parse_request(path, query, body):
+    """
+    The (function, args) job of a /dxf or /preview request. Raises ValueError
+    for bad parameters or options.
+
+    Args:
+    - path: "/dxf" or "/preview".
+    - query: The query string pairs, options and BoxParams overrides.
+    - body: The request body, empty or a JSON object of BoxParams overrides.
+    """
+    options = {key: value for key, value in query if key in OPTIONS[path]}
+    row = {key: value for key, value in query if key not in OPTIONS[path]}
+    if body.strip():
+        data = json.loads(body)
+        if not isinstance(data, dict):
+            raise ValueError("the body must be a JSON object of parameters")
+        row.update(data)
+    overrides = parse_params(row)
+    if any(isinstance(value, list) for value in overrides.values()):
+        raise ValueError("parameters take single values")
+    params = replace(DEFAULT_PARAMS, **overrides)
+
+    if path == "/dxf":
+        writers = writer_list([writer for key, writer in query if key == "writer"] or ["ezdxf"])
+        return generate_files, (params, tuple(writers), _flag(options, "toolpath"), _flag(options, "blocks"))
+    layer = options.get("layer", "art")
+    if layer not in ("art", "bottom"):
+        if not layer.isdigit() or int(layer) not in LAYER_DRAWERS:
+            raise ValueError(f"unknown layer: {layer}")
+        layer = int(layer)
+    dpi = float(options.get("dpi", preview_dpi))
+    if not 10 <= dpi <= 600:
+        raise ValueError("dpi must be between 10 and 600")
+    backend = options.get("backend", "native")
+    if backend not in ("native", "matplotlib"):
+        raise ValueError(f"unknown render backend: {backend}")
+    width = int(options["width"]) if "width" in options else None
+    if width is not None and not 16 <= width <= 4096:
+        raise ValueError("width must be between 16 and 4096")
+    return generate_preview, (params, layer, dpi, backend, width)
+
+
+class GenerationService:
+    """
+    Runs generation jobs on a process pool for the HTTP handler. A job is a
+    module level function and its arguments; requests for the same job while
+    it is queued or running wait for that one instead of adding another.
+
+    Args:
+    - jobs: Number of worker processes, defaults to one per CPU.
+    - max_queue: Distinct jobs queued or running before QueueFull is raised.
+    - spec: The layout spec, see spec.load_spec().
+    """
+
+    def __init__(self, jobs=None, max_queue=default_max_queue, spec=None):
+        self.jobs = jobs or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.spec = spec
+        self.executor = None
+        self.in_flight = {}
+        self.counters = {"requests": 0, "jobs": 0, "coalesced": 0, "rejected": 0, "failed": 0}
+
+    async def start(self):
+        """Start the workers and wait until every one of them is warm."""
+        load_spec(self.spec)
+        self.executor = ProcessPoolExecutor(self.jobs, initializer=_warm_worker, initargs=(self.spec,))
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self.executor, os.getpid) for _ in range(self.jobs)))
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+
+    async def run(self, fn, args):
+        """The result of fn(*args, spec), shared with identical jobs in flight."""
+        self.counters["requests"] += 1
+        key = (fn.__name__, args)
+        task = self.in_flight.get(key)
+        if task is not None:
+            self.counters["coalesced"] += 1
+            count("service.coalesced")
+        else:
+            if len(self.in_flight) >= self.max_queue:
+                self.counters["rejected"] += 1
+                count("service.rejected")
+                raise QueueFull(f"{len(self.in_flight)} jobs in flight")
+            self.counters["jobs"] += 1
+            task = self.in_flight[key] = asyncio.ensure_future(self._job(key, fn, args))
+        # A client hanging up must not cancel the job the others wait for
+        return await asyncio.shield(task)
+
+    async def _job(self, key, fn, args):
+        loop = asyncio.get_running_loop()
+        try:
+            result, recorded = await loop.run_in_executor(
+                self.executor, trace.call_recorded, fn, args + (self.spec,), trace.recording_events())
+        except Exception:
+            self.counters["failed"] += 1
+            raise
+        finally:
+            del self.in_flight[key]
+        trace.merge(recorded)
+        return result
+
+    def health(self):
+        return {"workers": self.jobs, "in_flight": len(self.in_flight), "max_queue": self.max_queue,
+                **self.counters}
+
+    async def handle(self, reader, writer):
+        """asyncio.start_server() callback, one request per connection."""
+        try:
+            status, headers, body = await self._respond(reader)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            return
+        reason = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+                  413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}[status]
+        head = [f"HTTP/1.1 {status} {reason}", f"Content-Length: {len(body)}", "Connection: close"]
+        head += [f"{name}: {value}" for name, value in headers.items()]
+        try:
+            writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, reader):
+        request_line = await asyncio.wait_for(reader.readline(), read_timeout)
+        parts = request_line.decode("latin-1").split()
+        length = 0
+        while True:
+            line = await asyncio.wait_for(reader.readline(), read_timeout)
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            if name.strip().lower() == "content-length":
+                length = int(value.strip()) if value.strip().isdigit() else -1
+        if len(parts) != 3:
+            return _json(400, {"error": "malformed request line"})
+        method, target, _ = parts
+        if length < 0 or length > max_body:
+            return _json(413, {"error": f"bodies are limited to {max_body} bytes"})
+        body = await asyncio.wait_for(reader.readexactly(length), read_timeout) if length else b""
+
+        url = urlsplit(target)
+        if url.path == "/health":
+            return _json(200, self.health())
+        if url.path not in OPTIONS:
+            return _json(404, {"error": f"no such endpoint: {url.path}"})
+        if method not in ("GET", "POST"):
+            return _json(405, {"error": f"{method} is not supported"})
+        try:
+            fn, args = parse_request(url.path, parse_qsl(url.query), body.decode("utf-8"))
+        except (ValueError, TypeError) as e:
+            return _json(400, {"error": str(e)})
+        try:
+            result = await self.run(fn, args)
+        except QueueFull as e:
+            return 503, {"Content-Type": "application/json", "Retry-After": "1"}, json.dumps(
+                {"error": f"the queue is full, {e}"}).encode()
+        except Exception as e:
+            return _json(500, {"error": repr(e)})
+        if fn is generate_files:
+            return 200, {"Content-Type": "application/zip",
+                         "Content-Disposition": 'attachment; filename="gigabox.zip"'}, result
+        return 200, {"Content-Type": "image/png"}, result
+
+
+def _json(status, data):
+    return status, {"Content-Type": "application/json"}, json.dumps(data).encode()
+
+
+async def serve(host=default_host, port=default_port, jobs=None, max_queue=default_max_queue, spec=None,
+                ready=None):
+    """
+    Run the service until cancelled.
+
+    Args:
+    - host, port: Address to listen on, port 0 picks a free one.
+    - jobs: Number of worker processes, defaults to one per CPU.
+    - max_queue: Distinct jobs queued or running before requests get a 503.
+    - spec: The layout spec, see spec.load_spec().
+    - ready: Called with the (host, port) listened on once the workers are warm.
+    """
+    service = GenerationService(jobs, max_queue, spec)
+    await service.start()
+    try:
+        server = await asyncio.start_server(service.handle, host, port)
+        async with server:
+            if ready is not None:
+                ready(server.sockets[0].getsockname()[:2])
+            await server.serve_forever()
+    finally:
+        service.close()
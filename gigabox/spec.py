@@ -0,0 +1,717 @@
+"""
+Declarative layout specs and the compact geometry IR they compile to.
+
+A spec (JSON, or TOML on Python 3.11+) names the features of the box, the
+shape of each one written as arithmetic on the BoxParams fields, and which
+features every layer is cut with; gigabox/layout.json is the built-in box.
+load_spec() parses a spec and checks its expressions once, and
+compile_layout() evaluates it for one BoxParams into a LayoutIR: per layer a
+CompiledLayer, a structured NumPy array of primitives plus a vertex array.
+CompiledLayer has the replay/fingerprint/explode interface of LayerGeometry,
+so the writers, renderers and checkers take either.
+"""
+import ast
+import hashlib
+import json
+import operator
+import os
+import tempfile
+from functools import lru_cache
+
+import numpy as np
+
+from .geometry import DEFAULT_PARAMS, PARAM_FIELDS, block_name, replay_entities
+from .trace import count, traced
+
+default_spec_path = os.path.join(os.path.dirname(__file__), "layout.json")
+ir_version = 2  # bump when the IR layout changes, it is part of the cache key
+entity_chunk = 4096  # rows converted to Python at a time by CompiledLayer.iter_entities()
+
+# Primitive kinds of a CompiledLayer row
+POLYLINE, ARC, CIRCLE, POINT, INSERT = range(5)
+# One row per primitive. x, y is the centre of arcs and circles, the location
+# of points and the insert point of block references. first and count are
+# the vertex slice of a polyline; first is the block index of an INSERT.
+PRIMITIVE_DTYPE = np.dtype([
+    ("kind", "u1"), ("closed", "?"),
+    ("x", "f8"), ("y", "f8"), ("radius", "f8"), ("start", "f8"), ("end", "f8"),
+    ("first", "i4"), ("count", "i4"),
+])
+
+_expression_nodes = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Constant, ast.Name, ast.Load,
+                     ast.Add, ast.Sub, ast.Mult, ast.Div, ast.USub, ast.UAdd)
+_binary_operators = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Div: operator.truediv}
+_unary_operators = {ast.USub: operator.neg, ast.UAdd: operator.pos}
+
+
+class CompiledLayer:
+    """
+    One layer of a LayoutIR.
+
+    Attributes:
+    - rows: Structured array of PRIMITIVE_DTYPE, in drawing order.
+    - vertices: (n, 3) array of x, y, bulge rows of the polylines.
+    - blocks: Block name to CompiledLayer, in block index order, or None when
+      the layer was compiled without blocks.
+    """
+    __slots__ = ("rows", "vertices", "blocks")
+
+    def __init__(self, rows, vertices, blocks=None):
+        self.rows = rows
+        self.vertices = vertices
+        self.blocks = blocks
+
+    @property
+    def entities(self):
+        """The rows as LayerGeometry style (method, args, kwargs) calls."""
+        return list(self.iter_entities())
+
+    def iter_entities(self):
+        """
+        Yield the calls of entities one at a time, converting entity_chunk
+        rows at a time, so streaming a layer does not hold all its calls.
+        """
+        names = list(self.blocks or ())
+        for chunk in range(0, len(self.rows), entity_chunk):
+            for kind, closed, x, y, radius, start, end, first, count in self.rows[chunk:chunk + entity_chunk].tolist():
+                if kind == POLYLINE:
+                    points = self.vertices[first:first + count].tolist()
+                    if any(bulge for px, py, bulge in points):
+                        args = (list(map(tuple, points)), "xyb")
+                    else:
+                        args = ([(px, py) for px, py, bulge in points],)
+                    yield "add_lwpolyline", args, {"close": closed}
+                elif kind == ARC:
+                    yield "add_arc", ((x, y), radius, start, end), {}
+                elif kind == CIRCLE:
+                    yield "add_circle", ((x, y), radius), {}
+                elif kind == POINT:
+                    yield "add_point", ((x, y),), {}
+                else:
+                    yield "add_blockref", (names[first], (x, y)), {}
+
+    def replay(self, msp, dxfattribs=None):
+        """Add the primitives to a model space, see LayerGeometry.replay()."""
+        replay_entities(msp, self.entities, self.blocks, dxfattribs)
+
+    def fingerprint(self):
+        """A hash of the arrays; equal geometry gives an equal fingerprint."""
+        digest = hashlib.sha256(self.rows.tobytes())
+        digest.update(self.vertices.tobytes())
+        for name, block in (self.blocks or {}).items():
+            digest.update(f"{name}:{block.fingerprint()}".encode())
+        return digest.hexdigest()
+
+    def bounds(self):
+        """The (x0, y0, x1, y1) stream.drawing_bounds() gives, worked out on the arrays."""
+        extent = self.extent()
+        return (0, 0, 0, 0) if extent is None else extent
+
+    def extent(self):
+        """
+        The bounds, or None when there is nothing to draw. Blocks are measured
+        once and moved by the extremes of their insert points.
+        """
+        if self.blocks:
+            inserts = self.rows["kind"] == INSERT
+            extents = [CompiledLayer(self.rows[~inserts], self.vertices).extent()]
+            for index, block in enumerate(self.blocks.values()):
+                placed = self.rows[inserts & (self.rows["first"] == index)]
+                extent = block.extent() if len(placed) else None
+                if extent is not None:
+                    x0, y0, x1, y1 = extent
+                    extents.append((x0 + placed["x"].min(), y0 + placed["y"].min(),
+                                    x1 + placed["x"].max(), y1 + placed["y"].max()))
+            extents = [extent for extent in extents if extent is not None]
+            if not extents:
+                return None
+            x0, y0, x1, y1 = zip(*extents)
+            return float(min(x0)), float(min(y0)), float(max(x1)), float(max(y1))
+        rows, vertices = self.rows, self.vertices
+        # Bulged polyline segments count with the whole circle of their arc
+        after = np.arange(1, len(vertices) + 1)
+        polylines = rows[rows["kind"] == POLYLINE]
+        after[polylines["first"] + polylines["count"] - 1] = np.where(polylines["closed"], polylines["first"], -1)
+        start = np.flatnonzero((vertices[:, 2] != 0) & (after >= 0))
+        x0, y0, bulge = vertices[start].T
+        x1, y1 = vertices[after[start], :2].T
+        x0, y0, x1, y1 = (np.where(bulge < 0, b, a) for a, b in ((x0, x1), (y0, y1), (x1, x0), (y1, y0)))
+        sweep = 4 * np.arctan(np.abs(bulge))
+        chord = np.hypot(x1 - x0, y1 - y0)
+        arc = chord > 0
+        sweep, chord, x0, y0, x1, y1 = sweep[arc], chord[arc], x0[arc], y0[arc], x1[arc], y1[arc]
+        radius = chord / (2 * np.sin(sweep / 2))
+        offset = radius * np.cos(sweep / 2) / chord
+        cx = (x0 + x1) / 2 - (y1 - y0) * offset
+        cy = (y0 + y1) / 2 + (x1 - x0) * offset
+
+        round_rows = rows[(rows["kind"] == ARC) | (rows["kind"] == CIRCLE)]
+        point_rows = rows[rows["kind"] == POINT]
+        xs = np.concatenate([vertices[:, 0], cx - radius, cx + radius, round_rows["x"] - round_rows["radius"],
+                             round_rows["x"] + round_rows["radius"], point_rows["x"]])
+        ys = np.concatenate([vertices[:, 1], cy - radius, cy + radius, round_rows["y"] - round_rows["radius"],
+                             round_rows["y"] + round_rows["radius"], point_rows["y"]])
+        if not len(xs):
+            return None
+        return float(xs.min()), float(ys.min()), float(xs.max()), float(ys.max())
+
+    def explode(self):
+        """A copy without blocks, every block reference replaced by its primitives."""
+        if not self.blocks:
+            return self
+        blocks = list(self.blocks.values())
+        pieces = []
+        for index, row in enumerate(self.rows):
+            if row["kind"] == POLYLINE:
+                rows = self.rows[index:index + 1].copy()
+                rows["first"] = 0
+                pieces.append((rows, self.vertices[row["first"]:row["first"] + row["count"]]))
+                continue
+            if row["kind"] != INSERT:
+                pieces.append((self.rows[index:index + 1], self.vertices[:0]))
+                continue
+            block = blocks[row["first"]]
+            rows = block.rows.copy()
+            placed = rows["kind"] != POLYLINE
+            rows["x"][placed] += row["x"]
+            rows["y"][placed] += row["y"]
+            vertices = block.vertices.copy()
+            vertices[:, :2] += (row["x"], row["y"])
+            pieces.append((rows, vertices))
+        return CompiledLayer(*_concat(pieces))
+
+
+class LayoutIR:
+    """
+    A compiled layout: the CompiledLayer of every layer of a spec, keyed like
+    LAYER_DRAWERS with "art" and "bottom" for the art layers.
+    """
+    __slots__ = ("layers",)
+
+    def __init__(self, layers):
+        self.layers = layers
+
+    def save(self, path):
+        """
+        Write the IR to an .npz file, without pickles. All rows and vertices
+        go into one array each, with the slice of every layer and block in a
+        JSON index, so loading it reads three arrays.
+        """
+        rows, vertices, index = [], [], {}
+        row_end = vertex_end = 0
+
+        def add(layer):
+            nonlocal row_end, vertex_end
+            rows.append(layer.rows)
+            vertices.append(layer.vertices)
+            row_end += len(layer.rows)
+            vertex_end += len(layer.vertices)
+            return [row_end - len(layer.rows), row_end, vertex_end - len(layer.vertices), vertex_end]
+
+        for key, layer in self.layers.items():
+            blocks = None if layer.blocks is None else {name: add(block) for name, block in layer.blocks.items()}
+            index[str(key)] = add(layer), blocks
+        arrays = {
+            "rows": np.concatenate(rows or [np.zeros(0, PRIMITIVE_DTYPE)]),
+            "vertices": np.concatenate(vertices or [np.zeros((0, 3))]),
+            "index": np.array(json.dumps({"version": ir_version, "layers": index})),
+        }
+        # Write to a temporary file first, so other processes never read half an IR
+        directory = os.path.dirname(path) or "."
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Read an IR written by save(); raises ValueError for other versions."""
+        with np.load(path, allow_pickle=False) as arrays:
+            index = json.loads(arrays["index"].item())
+            if index["version"] != ir_version:
+                raise ValueError(f"{path}: IR version {index['version']}, expected {ir_version}")
+            rows, vertices = arrays["rows"], arrays["vertices"]
+
+        def layer(row_start, row_end, vertex_start, vertex_end, blocks=None):
+            return CompiledLayer(rows[row_start:row_end], vertices[vertex_start:vertex_end], blocks)
+
+        layers = {}
+        for key, (ranges, blocks) in index["layers"].items():
+            blocks = None if blocks is None else {name: layer(*block) for name, block in blocks.items()}
+            layers[int(key) if key.isdigit() else key] = layer(*ranges, blocks)
+        return cls(layers)
+
+
+def _concat(pieces):
+    """Join (rows, vertices) pieces into one pair, moving the vertex slices of the polylines."""
+    if not pieces:
+        return np.zeros(0, PRIMITIVE_DTYPE), np.zeros((0, 3))
+    all_rows = []
+    offset = 0
+    for rows, vertices in pieces:
+        rows = rows.copy()
+        rows["first"][rows["kind"] == POLYLINE] += offset
+        offset += len(vertices)
+        all_rows.append(rows)
+    return np.concatenate(all_rows), np.concatenate([vertices for rows, vertices in pieces])
+
+
+class _Expr:
+    """
+    A checked spec expression, as an AST node. Arithmetic on it builds the
+    node of the result, so the shape functions below work on expressions as
+    they would on numbers, and _value() computes them over NumPy arrays.
+    """
+    __slots__ = ("node",)
+
+    def __init__(self, node):
+        self.node = node
+
+    def _apply(self, op, other, swap=False):
+        other = other.node if isinstance(other, _Expr) else ast.Constant(float(other))
+        return _Expr(ast.BinOp(other, op(), self.node) if swap else ast.BinOp(self.node, op(), other))
+
+    def __add__(self, other):
+        return self._apply(ast.Add, other)
+
+    def __radd__(self, other):
+        return self._apply(ast.Add, other, True)
+
+    def __sub__(self, other):
+        return self._apply(ast.Sub, other)
+
+    def __rsub__(self, other):
+        return self._apply(ast.Sub, other, True)
+
+    def __mul__(self, other):
+        return self._apply(ast.Mult, other)
+
+    def __rmul__(self, other):
+        return self._apply(ast.Mult, other, True)
+
+    def __truediv__(self, other):
+        return self._apply(ast.Div, other)
+
+    def __rtruediv__(self, other):
+        return self._apply(ast.Div, other, True)
+
+    def __neg__(self):
+        return _Expr(ast.UnaryOp(ast.USub(), self.node))
+
+
+def _evaluate(node, names):
+    """The value of a checked expression node; names maps names to floats or arrays."""
+    if isinstance(node, ast.BinOp):
+        return _binary_operators[type(node.op)](_evaluate(node.left, names), _evaluate(node.right, names))
+    if isinstance(node, ast.UnaryOp):
+        return _unary_operators[type(node.op)](_evaluate(node.operand, names))
+    if isinstance(node, ast.Name):
+        return names[node.id]
+    return node.value
+
+
+def _value(value, names):
+    """The value of an _Expr, or of a number from a shape template."""
+    return _evaluate(value.node, names) if isinstance(value, _Expr) else value
+
+
+def _rectangle(x, y, width, height):
+    return ("polyline", [(x, y), (x + width, y), (x + width, y + height), (x, y + height), (x, y)], False)
+
+
+def _square(center, size):
+    # Corners counter clockwise from the bottom left, closed and back at the start
+    x, y = center
+    half = size / 2
+    return [("polyline", [(x - half, y - half), (x + half, y - half), (x + half, y + half), (x - half, y + half),
+                          (x - half, y - half)], True)]
+
+
+def _rounded_rect(x, y, width, height, radius):
+    # Sides and corner arcs counter clockwise from the bottom side
+    return [
+        ("polyline", [(x + radius, y), (x + width - radius, y)], False),
+        ("arc", x + width - radius, y + radius, radius, 270, 360),
+        ("polyline", [(x + width, y + radius), (x + width, y + height - radius)], False),
+        ("arc", x + width - radius, y + height - radius, radius, 0, 90),
+        ("polyline", [(x + width - radius, y + height), (x + radius, y + height)], False),
+        ("arc", x + radius, y + height - radius, radius, 90, 180),
+        ("polyline", [(x, y + height - radius), (x, y + radius)], False),
+        ("arc", x + radius, y + radius, radius, 180, 270),
+    ]
+
+
+# Shapes: the fields they take (the optional ones after a "?"), what they
+# draw as ("polyline", points, closed), ("arc", cx, cy, r, start, end) and
+# ("circle", cx, cy, r) templates, and the field that sizes their block name,
+# see geometry.block_name().
+SHAPES = {
+    "circle": (("center", "radius"), lambda center, radius: [("circle", center[0], center[1], radius)], "radius"),
+    "circles": (("circles",), lambda circles: [("circle", x, y, radius) for x, y, radius in circles], None),
+    "square": (("center", "size"), _square, "size"),
+    "rect": (("x", "y", "width", "height"),
+             lambda x, y, width, height: [_rectangle(x, y, width, height)], None),
+    "rounded_rect": (("x", "y", "width", "height", "radius"), _rounded_rect, None),
+    "polyline": (("points", "?close"), lambda points, close=False: [("polyline", points, close)], None),
+}
+
+
+def _parse(value, allowed, where):
+    """
+    Check the expressions in value, a number, string or nested list, and
+    return them as _Expr. Booleans are kept as they are. Expressions may
+    only use numbers, the allowed names and + - * /, so evaluating one takes
+    no more than a few float or array operations.
+    """
+    if isinstance(value, list):
+        return [_parse(item, allowed, where) for item in value]
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return _Expr(ast.Constant(float(value)))
+    if not isinstance(value, str):
+        raise ValueError(f"{where}: expected an expression, got {value!r}")
+    try:
+        tree = ast.parse(value, mode="eval")
+    except SyntaxError as e:
+        raise ValueError(f"{where}: {value!r} is not an expression") from e
+    for node in ast.walk(tree):
+        if not isinstance(node, _expression_nodes):
+            raise ValueError(f"{where}: {value!r} may only use numbers, names and + - * /")
+        if isinstance(node, ast.Constant):
+            if type(node.value) not in (int, float):
+                raise ValueError(f"{where}: {value!r} may only use numbers, names and + - * /")
+            node.value = float(node.value)
+        if isinstance(node, ast.Name) and node.id not in allowed:
+            raise ValueError(f"{where}: unknown name {node.id!r}")
+    return _Expr(tree.body)
+
+
+def _interleave(values, n):
+    """Flatten values, scalars or arrays of n, instance by instance."""
+    columns = np.empty((len(values), n))
+    for index, value in enumerate(values):
+        columns[index] = value
+    return columns.T.ravel()
+
+
+def _structure(templates):
+    """The kind, closed flag and vertex count of each template."""
+    structure = []
+    for kind, *values in templates:
+        if kind == "polyline":
+            points, closed = values
+            if not isinstance(closed, bool):
+                raise ValueError(f"close must be true or false, got {closed}")
+            structure.append((POLYLINE, closed, len(points)))
+        else:
+            structure.append((ARC if kind == "arc" else CIRCLE, False, 0))
+    return structure
+
+
+def _template_rows(structure, n):
+    """Rows of PRIMITIVE_DTYPE for n instances of a structure, without coordinates."""
+    vertex_count = sum(count for kind, closed, count in structure)
+    rows = np.zeros((n, len(structure)), PRIMITIVE_DTYPE)
+    offset = 0
+    for index, (kind, closed, count) in enumerate(structure):
+        rows[:, index]["kind"] = kind
+        rows[:, index]["closed"] = closed
+        if kind == POLYLINE:
+            rows[:, index]["first"] = np.arange(n) * vertex_count + offset
+            rows[:, index]["count"] = count
+            offset += count
+    return rows.ravel()
+
+
+def _fill(rows, values, vertices):
+    """Copy rows and set their x, y, radius, start, end from a flat value list."""
+    rows = rows.copy()
+    columns = np.array(values, dtype=float).reshape(-1, 5)
+    for index, field in enumerate(("x", "y", "radius", "start", "end")):
+        rows[field] = columns[:, index]
+    vertex_array = np.zeros((len(vertices) // 2, 3))
+    vertex_array[:, :2] = np.reshape(vertices, (-1, 2))
+    return rows, vertex_array
+
+
+class _Feature:
+    """
+    A feature as used on a layer, its spec with the layer overrides applied,
+    checked and turned into expressions for its rows, see draw().
+    """
+    __slots__ = ("name", "at", "block", "structure", "variables", "row_values", "vertex_values", "size")
+
+    def __init__(self, name, spec, overrides, point_sets):
+        where = f"feature {name}"
+        if not isinstance(spec, dict):
+            raise ValueError(f"{where}: expected an object")
+        self.name = name
+        shape = spec.get("shape")
+        if shape not in SHAPES:
+            raise ValueError(f"{where}: unknown shape {shape!r}, one of {', '.join(SHAPES)}")
+        self.at = overrides.pop("at", spec.get("at"))
+        if self.at is not None and self.at not in point_sets:
+            raise ValueError(f"{where}: unknown points {self.at!r}")
+        self.block = spec.get("block")
+
+        fields, draw, size_field = SHAPES[shape]
+        required = [field for field in fields if not field.startswith("?")]
+        fields = [field.lstrip("?") for field in fields]
+        unknown = sorted(set(spec) - set(fields) - {"shape", "at", "block", "vars"})
+        missing = [field for field in required if field not in spec]
+        if unknown or missing:
+            raise ValueError(f"{where}: " + "; ".join(
+                ([f"unknown fields {', '.join(unknown)}"] if unknown else [])
+                + ([f"missing fields {', '.join(missing)}"] if missing else [])))
+
+        allowed = set(PARAM_FIELDS) | ({"x", "y", "r"} if self.at else set())
+        self.variables = []
+        for var, value in {**spec.get("vars", {}), **overrides}.items():
+            if not var.isidentifier() or var.startswith("_") or var in ("x", "y", "r"):
+                raise ValueError(f"{where}: {var!r} cannot be a variable name")
+            self.variables.append((var, _parse(value, allowed, f"{where}.{var}")))
+            allowed.add(var)
+        values = {field: _parse(spec[field], allowed, f"{where}.{field}") for field in fields if field in spec}
+        templates = draw(**values)
+        try:
+            self.structure = _structure(templates)
+        except ValueError as e:
+            raise ValueError(f"{where}: {e}") from None
+
+        self.row_values = []
+        self.vertex_values = []
+        for kind, *template in templates:
+            if kind == "polyline":
+                self.row_values += [0.0] * 5
+                self.vertex_values += [coordinate for point in template[0] for coordinate in point]
+            else:
+                self.row_values += template + [0.0] * (5 - len(template))
+        self.size = values[size_field] if size_field else None
+
+    def draw(self, params, points):
+        """
+        Evaluate the feature. Returns the flat x, y, radius, start, end values
+        of its rows, the flat x, y values of its vertices and the block sizes
+        (or None), instance by instance. Placed features are drawn for all
+        their (n, 3) x, y, r points at once, with x, y and r as arrays.
+
+        Args:
+        - params: BoxParams field name to value.
+        - points: The (n, 3) points of a placed feature, or None.
+        """
+        names = dict(params)
+        if points is not None:
+            names["x"], names["y"], names["r"] = points[:, 0], points[:, 1], points[:, 2]
+        for var, value in self.variables:
+            names[var] = _evaluate(value.node, names)
+        rows = [_value(value, names) for value in self.row_values]
+        vertices = [_value(value, names) for value in self.vertex_values]
+        sizes = None if self.size is None else [_value(self.size, names)]
+        if points is None:
+            return rows, vertices, sizes
+        n = points.shape[0]
+        return _interleave(rows, n), _interleave(vertices, n), None if sizes is None else _interleave(sizes, n)
+
+
+class LayoutSpec:
+    """
+    A parsed spec with every feature compiled, see load_spec().
+
+    Attributes:
+    - digest: Hash of the spec, stable across key order and formatting.
+    - points: Point set name to its x, y, r rows of expressions. The
+      buttons, buttons.big and buttons.small sets come from BoxParams.layout().
+    - layers: Layer key to its _Features, in drawing order. Layers using a
+      feature with the same overrides share one _Feature.
+    """
+
+    def __init__(self, data, where="spec"):
+        self.digest = hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+        self.points = {}
+        for name, rows in data.get("points", {}).items():
+            if not isinstance(rows, list) or any(not isinstance(row, list) or len(row) not in (2, 3)
+                                                 for row in rows):
+                raise ValueError(f"{where}: points {name} must be a list of [x, y] or [x, y, r]")
+            self.points[name] = [_parse(row, set(PARAM_FIELDS), f"points {name}") + ([] if len(row) == 3 else [0.0])
+                                 for row in rows]
+        point_sets = set(self.points) | {"buttons", "buttons.big", "buttons.small"}
+
+        features = data.get("features", {})
+        compiled = {}
+        self.layers = {}
+        for key, entries in data.get("layers", {}).items():
+            layer = []
+            for entry in entries:
+                overrides = dict(entry) if isinstance(entry, dict) else {"feature": entry}
+                name = overrides.pop("feature", None)
+                if name not in features:
+                    raise ValueError(f"{where}: layer {key} uses unknown feature {name!r}")
+                signature = json.dumps([name, overrides], sort_keys=True)
+                if signature not in compiled:
+                    compiled[signature] = _Feature(name, features[name], overrides, point_sets)
+                layer.append(compiled[signature])
+            self.layers[int(key) if key.isdigit() else key] = layer
+        self._plans = {}
+
+    def _plan(self, blocks, sizes):
+        """
+        How to evaluate the spec, cached by blocks and the point set sizes.
+        Returns (draws, rows, value_index, vertex_index, ends): the distinct
+        (feature, as block references) draws in order, the template rows of
+        all layers one after another, where each row value and vertex value
+        comes from in the concatenated draws, and the (row, vertex) end of
+        every layer. Vertex slices count from the start of their layer.
+        """
+        if (blocks, sizes) in self._plans:
+            return self._plans[blocks, sizes]
+        point_counts = dict(sizes)
+        draws = {}
+        value_end = vertex_end = 0
+        layers, value_index, vertex_index, ends = [], [], [], []
+        row_count = vertex_count = 0
+        for features in self.layers.values():
+            pieces = []
+            for feature in features:
+                n = 1 if feature.at is None else point_counts[feature.at]
+                draw = (feature, bool(blocks and feature.block and feature.at))
+                structure = [(INSERT, False, 0)] if draw[1] else feature.structure
+                feature_vertices = n * sum(count for kind, closed, count in structure)
+                if draw not in draws:
+                    draws[draw] = (value_end, vertex_end)
+                    value_end += 5 * n * len(structure)
+                    vertex_end += 2 * feature_vertices
+                values_start, vertices_start = draws[draw]
+                value_index.append(np.arange(values_start, values_start + 5 * n * len(structure)))
+                vertex_index.append(np.arange(vertices_start, vertices_start + 2 * feature_vertices))
+                pieces.append((_template_rows(structure, n), np.zeros((feature_vertices, 3))))
+            rows = _concat(pieces)[0]
+            layers.append(rows)
+            row_count += len(rows)
+            vertex_count += sum(len(vertices) for rows, vertices in pieces)
+            ends.append((row_count, vertex_count))
+        plan = (list(draws), np.concatenate(layers or [np.zeros(0, PRIMITIVE_DTYPE)]),
+                np.concatenate(value_index or [[]]).astype(np.intp),
+                np.concatenate(vertex_index or [[]]).astype(np.intp), ends)
+        self._plans[blocks, sizes] = plan
+        return plan
+
+    def evaluate(self, params=DEFAULT_PARAMS, blocks=False):
+        """
+        Evaluate the spec for one BoxParams into a LayoutIR. Every distinct
+        feature is drawn once, and the rows and vertices of all layers are
+        filled from those draws in one go; each layer holds views of them.
+
+        Args:
+        - params: The BoxParams of the variant.
+        - blocks: Turn features with a "block" name into one block per size
+          and block references, like LayerGeometry(blocks=True) does.
+        """
+        layout = params.layout()
+        names = {field: getattr(params, field) for field in PARAM_FIELDS}
+        point_sets = {"buttons": layout.points, "buttons.big": layout.big, "buttons.small": layout.small}
+        for name, rows in self.points.items():
+            point_sets[name] = np.array([[_value(value, names) for value in row] for row in rows], dtype=float)
+        sizes = {name: len(points) for name, points in point_sets.items()}
+        draws, template, value_index, vertex_index, ends = self._plan(blocks, tuple(sorted(sizes.items())))
+
+        values = []
+        vertices = []
+        block_draws = {}
+        for feature, as_blocks in draws:
+            points = point_sets[feature.at] if feature.at else None
+            if as_blocks:
+                # Every instance is drawn at the origin, one per size becomes a block
+                origin = points.copy()
+                origin[:, :2] = 0
+                block_draws[feature] = feature.draw(names, origin)
+                values.append(_interleave([points[:, 0], points[:, 1], 0, 0, 0], len(points)))
+            else:
+                feature_values, feature_vertices, sizes = feature.draw(names, points)
+                values.append(feature_values)
+                vertices.append(feature_vertices)
+        rows, vertex_array = _fill(template, np.concatenate(values or [[]])[value_index],
+                                   np.concatenate(vertices or [[]])[vertex_index])
+
+        layers = {}
+        inserts = []
+        row_start = vertex_start = 0
+        for (key, features), (row_end, vertex_end) in zip(self.layers.items(), ends):
+            block_table = {} if blocks else None
+            for feature in features:
+                if feature not in block_draws:
+                    continue
+                block_values, block_vertices, sizes = block_draws[feature]
+                k, v = 5 * len(feature.structure), 2 * sum(count for kind, closed, count in feature.structure)
+                n = len(point_sets[feature.at])
+                for i, size in enumerate(sizes.tolist() if sizes is not None else [None] * n):
+                    name = feature.block if size is None else block_name(feature.block, size)
+                    if name not in block_table:
+                        block_table[name] = CompiledLayer(*_fill(
+                            _template_rows(feature.structure, 1),
+                            block_values[i * k:(i + 1) * k], block_vertices[i * v:(i + 1) * v]))
+                    inserts.append(list(block_table).index(name))
+            layers[key] = CompiledLayer(rows[row_start:row_end], vertex_array[vertex_start:vertex_end], block_table)
+            count(f"layer{key}.entities", row_end - row_start)
+            row_start, vertex_start = row_end, vertex_end
+        if inserts:
+            rows["first"][rows["kind"] == INSERT] = inserts
+        return LayoutIR(layers)
+
+
+@lru_cache(maxsize=32)
+def _load_spec_file(path, mtime_ns):
+    with open(path, "rb") as f:
+        if path.lower().endswith(".toml"):
+            import tomllib
+            data = tomllib.load(f)
+        else:
+            data = json.load(f)
+    if not isinstance(data, dict):
+        raise ValueError(f"{path}: a layout spec is an object")
+    return LayoutSpec(data, path)
+
+
+def load_spec(spec=None):
+    """
+    Parse and compile a layout spec. Files are read once per process, until
+    they change.
+
+    Args:
+    - spec: Path of a .json or .toml spec, a LayoutSpec (returned as is) or
+      None for the built-in layout.json.
+    """
+    if isinstance(spec, LayoutSpec):
+        return spec
+    path = spec or default_spec_path
+    return _load_spec_file(path, os.stat(path).st_mtime_ns)
+
+
+@traced
+def compile_layout(params=DEFAULT_PARAMS, spec=None, blocks=False, cache_dir=None):
+    """
+    Evaluate a layout spec for one variant into a LayoutIR.
+
+    Args:
+    - params: The BoxParams of the variant.
+    - spec: A spec path or LayoutSpec, see load_spec().
+    - blocks: Compile repeated features into blocks, see LayoutSpec.evaluate().
+    - cache_dir: Keep the IR in this directory as .npz files named by the
+      spec, parameters and blocks, and load it from there on later runs.
+    """
+    spec = load_spec(spec)
+    if cache_dir is None:
+        return spec.evaluate(params, blocks)
+
+    key = hashlib.sha256(f"{ir_version}:{spec.digest}:{params!r}:{blocks}".encode()).hexdigest()
+    path = os.path.join(cache_dir, key + ".npz")
+    try:
+        ir = LayoutIR.load(path)
+        count("ir_cache.hits")
+        return ir
+    except (OSError, ValueError, KeyError):
+        count("ir_cache.misses")
+    ir = spec.evaluate(params, blocks)
+    os.makedirs(cache_dir, exist_ok=True)
+    ir.save(path)
+    return ir
@@ -0,0 +1,346 @@
+"""
+3D export of the layer stack: the closed contours of every layer extruded by
+its thickness (LAYER_THICKNESS) and stacked, written as STL or glTF, and a
+check that holes line up through the stack.
+
+Meshing works on whole arrays. The arcs and circles of a layer are
+flattened in one go, holes are the loops straight inside an outer one,
+the faces of a plate come from a trapezoid decomposition of all its loops
+at once and the walls are one quad per loop edge. The trapezoids meet in
+T-junctions, so the mesh is for looking at and checking, not for slicing.
+"""
+import base64
+import json
+import math
+import struct
+
+import numpy as np
+
+from .geometry import LAYER_THICKNESS, iter_primitives, screw_radius
+from .toolpath import merge_contours
+from .trace import count, traced
+
+arc_tolerance = 0.002  # in cm, how far a flattened arc may be from the true one
+STACK_ORDER = (6, 5, 4, 3, 2, 1)  # bottom to top
+# Layer colours in the glTF export, RGBA
+LAYER_COLORS = [(0.85, 0.85, 0.9, 0.6), (0.35, 0.35, 0.4, 1), (0.9, 0.75, 0.45, 1)]
+_STL_DTYPE = np.dtype([("normal", "<f4", 3), ("vertices", "<f4", (3, 3)), ("attribute", "<u2")])
+
+
+@traced
+def layer_loops(source):
+    """
+    Flatten the closed contours of a layer into polygon loops.
+
+    Returns (points, starts, open_count): the (n, 2) loop points one loop
+    after another, the index where each loop starts with n at the end, and
+    how many open contours were left out.
+    """
+    contours, _ = merge_contours(source)
+    vertices, loop_sizes = [], []
+    open_count = 0
+    for contour in contours:
+        if contour.circle:
+            # Two half circle bulges
+            cx, cy, radius = contour.circle
+            vertices += [(cx + radius, cy, 1), (cx - radius, cy, 1)]
+            loop_sizes.append(2)
+        elif contour.closed:
+            vertices += contour.points
+            loop_sizes.append(len(contour.points))
+        else:
+            open_count += 1
+    if not vertices:
+        return np.zeros((0, 2)), np.zeros(1, int), open_count
+    vertices = np.array(vertices, dtype=float)
+    starts = np.concatenate([[0], np.cumsum(loop_sizes)])
+    after = _following(starts)
+
+    # Each segment becomes k pieces, k = 1 for straight ones
+    x0, y0, bulge = vertices.T
+    x1, y1 = vertices[after, 0], vertices[after, 1]
+    sweep = 4 * np.arctan(bulge)
+    chord = np.hypot(x1 - x0, y1 - y0)
+    arc = (bulge != 0) & (chord > 0)
+    safe_bulge = np.where(arc, bulge, 1)
+    sagitta = safe_bulge * chord / 2
+    radius = (chord * chord / 4 + sagitta * sagitta) / (2 * sagitta)
+    # Positive bulges turn counter clockwise, with the centre left of the chord
+    left_x, left_y = -(y1 - y0) / np.where(arc, chord, 1), (x1 - x0) / np.where(arc, chord, 1)
+    cx = (x0 + x1) / 2 + left_x * (radius - sagitta)
+    cy = (y0 + y1) / 2 + left_y * (radius - sagitta)
+    step = 2 * np.arccos(np.clip(1 - arc_tolerance / np.maximum(np.abs(radius), arc_tolerance), -1, 1))
+    pieces = np.where(arc, np.maximum(np.ceil(np.abs(sweep) / step), 1), 1).astype(int)
+
+    segment = np.repeat(np.arange(len(vertices)), pieces)
+    offsets = np.concatenate([[0], np.cumsum(pieces)])
+    fraction = (np.arange(offsets[-1]) - offsets[segment]) / pieces[segment]
+    start_angle = np.arctan2(y0 - cy, x0 - cx)[segment]
+    angle = start_angle + sweep[segment] * fraction
+    on_arc = arc[segment]
+    points = np.where(on_arc[:, None],
+                      np.stack([cx[segment] + np.abs(radius[segment]) * np.cos(angle),
+                                cy[segment] + np.abs(radius[segment]) * np.sin(angle)], axis=1),
+                      vertices[segment, :2])
+    return points, offsets[starts], open_count
+
+
+def _following(starts):
+    """The index of the next point of every point, wrapping around each loop."""
+    after = np.arange(1, starts[-1] + 1)
+    after[starts[1:] - 1] = starts[:-1]
+    return after
+
+
+def _plate(points, starts):
+    """
+    The loops of the plate: the outer loops turned counter clockwise and
+    the holes straight inside them turned clockwise. Loops inside two or
+    more others are on pieces that fall out with a hole and are left out.
+    Returns (points, starts) of the loops kept.
+    """
+    after = _following(starts)
+    loop = np.repeat(np.arange(len(starts) - 1), np.diff(starts))
+    x, y = points.T
+    area = np.add.reduceat(x * y[after] - x[after] * y, starts[:-1]) / 2
+
+    # Test every loop a hair inside its first edge, so loops that touch it do not count
+    first, second = starts[:-1], after[starts[:-1]]
+    dx, dy = x[second] - x[first], y[second] - y[first]
+    inward = np.sign(area) * 1e-6 / np.maximum(np.hypot(dx, dy), 1e-12)
+    px = ((x[first] + x[second]) / 2 - dy * inward)[:, None]
+    py = ((y[first] + y[second]) / 2 + dx * inward)[:, None]
+    # A ray to +x crosses a loop an odd number of times when it starts inside it
+    ax, ay, bx, by = x[None, :], y[None, :], x[after][None, :], y[after][None, :]
+    straddles = (ay > py) != (by > py)
+    crossing_x = ax + (py - ay) * (bx - ax) / np.where(by != ay, by - ay, 1)
+    inside = np.add.reduceat(straddles & (px < crossing_x), starts[:-1], axis=1) % 2
+    np.fill_diagonal(inside, 0)
+    depth = inside.sum(axis=1)
+
+    keep = (depth < 2) & (area != 0)
+    flip = (area > 0) == (depth == 1)
+    sizes = np.diff(starts)
+    index = np.arange(len(points))
+    # Reversed loops keep their first point
+    reverse = starts[loop] + (starts[loop + 1] - index) % sizes[loop]
+    index = np.where(flip[loop], reverse, index)[keep[loop]]
+    return points[index], np.concatenate([[0], np.cumsum(sizes[keep])])
+
+
+def _caps(points, starts):
+    """
+    Counter clockwise (m, 3, 2) triangles covering the inside of the loops by
+    the even-odd rule: every band between two neighbouring point heights is
+    cut into trapezoids between the edges crossing it, and trapezoids
+    between the same two edges in neighbouring bands are joined.
+    """
+    after = _following(starts)
+    a, b = points, points[after]
+    edges = np.flatnonzero(a[:, 1] != b[:, 1])
+    low = np.minimum(a[edges, 1], b[edges, 1])
+    high = np.maximum(a[edges, 1], b[edges, 1])
+    ys = np.unique(points[:, 1])
+    first = np.searchsorted(ys, low)
+    spans = np.searchsorted(ys, high) - first
+    edge = np.repeat(edges, spans)
+    band = np.repeat(first, spans) + np.arange(spans.sum()) - np.repeat(np.cumsum(spans) - spans, spans)
+
+    def x_at(edge, y):
+        ax, ay, bx, by = a[edge, 0], a[edge, 1], b[edge, 0], b[edge, 1]
+        return ax + (y - ay) * (bx - ax) / (by - ay)
+
+    order = np.lexsort((x_at(edge, (ys[band] + ys[band + 1]) / 2), band))
+    edge, band = edge[order], band[order]
+    if np.any(np.bincount(band) % 2):
+        raise ValueError("the loops do not close, every band needs an even number of edges")
+    left, right, band = edge[0::2], edge[1::2], band[0::2]
+
+    # Join runs of the same pair of edges over neighbouring bands
+    order = np.lexsort((band, right, left))
+    left, right, band = left[order], right[order], band[order]
+    new_run = np.ones(len(band), bool)
+    new_run[1:] = (left[1:] != left[:-1]) | (right[1:] != right[:-1]) | (band[1:] != band[:-1] + 1)
+    run_start = np.flatnonzero(new_run)
+    run_end = np.append(run_start[1:], len(band)) - 1
+    left, right = left[run_start], right[run_start]
+    bottom, top = ys[band[run_start]], ys[band[run_end] + 1]
+
+    corners = np.stack([
+        np.stack([x_at(left, bottom), bottom], axis=1), np.stack([x_at(right, bottom), bottom], axis=1),
+        np.stack([x_at(right, top), top], axis=1), np.stack([x_at(left, top), top], axis=1)], axis=1)
+    triangles = np.concatenate([corners[:, [0, 1, 2]], corners[:, [0, 2, 3]]])
+    u, v = triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0]
+    return triangles[u[:, 0] * v[:, 1] - u[:, 1] * v[:, 0] > 1e-12]
+
+
+@traced
+def extrude(source, bottom, height):
+    """
+    The (m, 3, 3) triangles, in cm, of the closed contours of source
+    extruded from z = bottom up by height. Returns (triangles, open_count).
+    """
+    points, starts, open_count = layer_loops(source)
+    if len(points) == 0:
+        return np.zeros((0, 3, 3)), open_count
+    points, starts = _plate(points, starts)
+    top = bottom + height
+
+    caps = _caps(points, starts)
+    n = len(caps)
+    lid = np.empty((n, 3, 3))
+    lid[:, :, :2], lid[:, :, 2] = caps, top
+    base = np.empty((n, 3, 3))
+    base[:, :, :2], base[:, :, 2] = caps[:, ::-1], bottom
+
+    # The material is left of every oriented edge, so the walls face right
+    a, b = points, points[_following(starts)]
+    a0, b0 = np.column_stack([a, np.full(len(a), bottom)]), np.column_stack([b, np.full(len(b), bottom)])
+    a1, b1 = np.column_stack([a, np.full(len(a), top)]), np.column_stack([b, np.full(len(b), top)])
+    walls = np.concatenate([np.stack([a0, b0, b1], axis=1), np.stack([a0, b1, a1], axis=1)])
+    triangles = np.concatenate([lid, base, walls])
+    count("stack.triangles", len(triangles))
+    return triangles, open_count
+
+
+@traced
+def stack_meshes(geometries, thickness=None, order=STACK_ORDER):
+    """
+    Extrude and stack the layers, the first of order at the bottom. Returns
+    [(layer, triangles)] and the number of open contours left out.
+
+    Args:
+    - geometries: Layer number to geometry, e.g. compile_layout().layers.
+    - thickness: Layer number to thickness in mm, defaults to LAYER_THICKNESS.
+    - order: The layers from bottom to top.
+    """
+    thickness = {**LAYER_THICKNESS, **(thickness or {})}
+    meshes = []
+    bottom = 0
+    skipped = 0
+    for layer in order:
+        height = thickness[layer] / 10
+        triangles, open_count = extrude(geometries[layer], bottom, height)
+        meshes.append((layer, triangles))
+        skipped += open_count
+        bottom += height
+    return meshes, skipped
+
+
+def write_stl(path, meshes):
+    """Write the meshes as one binary STL, in mm."""
+    triangles = np.concatenate([triangles for layer, triangles in meshes]) * 10
+    records = np.zeros(len(triangles), _STL_DTYPE)
+    normals = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    records["normal"] = normals / np.where(lengths > 0, lengths, 1)
+    records["vertices"] = triangles
+    with open(path, "wb") as f:
+        f.write(b"gigabox layer stack".ljust(80, b" "))
+        f.write(struct.pack("<I", len(records)))
+        f.write(records.tobytes())
+
+
+def _gltf(meshes):
+    """The glTF JSON and binary buffer of the meshes, one node per layer, in metres."""
+    gltf = {"asset": {"version": "2.0", "generator": "gigabox"}, "scene": 0, "scenes": [{"nodes": []}],
+            "nodes": [], "meshes": [], "materials": [], "accessors": [], "bufferViews": [], "buffers": []}
+    chunks = []
+    offset = 0
+    for index, (layer, triangles) in enumerate(meshes):
+        # glTF is y up, the stack is z up
+        positions = (triangles.reshape(-1, 3)[:, [0, 2, 1]] * [0.01, 0.01, -0.01]).astype("<f4")
+        data = positions.tobytes()
+        gltf["bufferViews"].append({"buffer": 0, "byteOffset": offset, "byteLength": len(data), "target": 34962})
+        gltf["accessors"].append({"bufferView": index, "componentType": 5126, "count": len(positions),
+                                  "type": "VEC3", "min": positions.min(axis=0).tolist() if len(positions) else [0] * 3,
+                                  "max": positions.max(axis=0).tolist() if len(positions) else [0] * 3})
+        color = LAYER_COLORS[index % len(LAYER_COLORS)]
+        gltf["materials"].append({"name": f"layer{layer}", "doubleSided": True,
+                                  "alphaMode": "BLEND" if color[3] < 1 else "OPAQUE",
+                                  "pbrMetallicRoughness": {"baseColorFactor": list(color), "metallicFactor": 0}})
+        gltf["meshes"].append({"name": f"layer{layer}", "primitives": [{"attributes": {"POSITION": index},
+                                                                         "material": index}]})
+        gltf["nodes"].append({"name": f"layer{layer}", "mesh": index})
+        gltf["scenes"][0]["nodes"].append(index)
+        chunks.append(data)
+        offset += len(data)
+    return gltf, b"".join(chunks)
+
+
+def write_gltf(path, meshes):
+    """Write the meshes as .glb, or as .gltf with the buffer embedded."""
+    gltf, data = _gltf(meshes)
+    if path.lower().endswith(".glb"):
+        gltf["buffers"].append({"byteLength": len(data)})
+        text = json.dumps(gltf).encode()
+        text += b" " * (-len(text) % 4)
+        data += b"\0" * (-len(data) % 4)
+        with open(path, "wb") as f:
+            f.write(struct.pack("<4sII", b"glTF", 2, 12 + 8 + len(text) + 8 + len(data)))
+            f.write(struct.pack("<I4s", len(text), b"JSON") + text)
+            f.write(struct.pack("<I4s", len(data), b"BIN\0") + data)
+    else:
+        gltf["buffers"].append({"byteLength": len(data),
+                                "uri": "data:application/octet-stream;base64," + base64.b64encode(data).decode()})
+        with open(path, "w") as f:
+            json.dump(gltf, f)
+
+
+# Mesh writers by file extension
+MESH_FORMATS = {".stl": write_stl, ".glb": write_gltf, ".gltf": write_gltf}
+
+
+def write_mesh(path, meshes):
+    extension = path[path.rfind("."):].lower() if "." in path else ""
+    if extension not in MESH_FORMATS:
+        raise ValueError(f"no mesh writer for {extension or path!r} files, use {', '.join(MESH_FORMATS)}")
+    MESH_FORMATS[extension](path, meshes)
+
+
+def _circles(source, radius, tolerance):
+    if hasattr(source, "rows"):
+        # A CompiledLayer, read straight from its arrays
+        from .spec import CIRCLE
+        rows = source.explode().rows
+        rows = rows[(rows["kind"] == CIRCLE) & (np.abs(rows["radius"] - radius) <= tolerance)]
+        return np.column_stack([rows["x"], rows["y"]])
+    centres = [values[:2] for kind, *values in iter_primitives(source)
+               if kind == "circle" and abs(values[2] - radius) <= tolerance]
+    return np.array(centres, dtype=float).reshape(-1, 2)
+
+
+@traced
+def hole_alignment(geometries, radius=screw_radius, tolerance=1e-4, layers=None):
+    """
+    Check that the holes of one radius go straight through the stack: a
+    hole on any layer has to be on every layer. Returns layer number to the
+    (n, 2) centres of the holes it is missing.
+
+    Args:
+    - geometries: Layer number to geometry, e.g. compile_layout().layers.
+    - radius: Radius of the holes in cm, the screw holes by default.
+    - tolerance: How far in cm centres and radii may be apart.
+    - layers: The layers to compare, defaults to STACK_ORDER.
+    """
+    centres = {layer: _circles(geometries[layer], radius, tolerance) for layer in layers or STACK_ORDER}
+    every = np.concatenate(list(centres.values()))
+    if not len(every):
+        return {layer: every for layer in centres}
+    # One centre per hole, holes closer than the tolerance are the same
+    keys = np.round(every / tolerance).astype(np.int64)
+    every = every[np.unique(keys, axis=0, return_index=True)[1]]
+    missing = {}
+    for layer, found in centres.items():
+        if len(found):
+            distance = np.hypot(every[:, None, 0] - found[None, :, 0], every[:, None, 1] - found[None, :, 1])
+            missing[layer] = every[distance.min(axis=1) > tolerance]
+        else:
+            missing[layer] = every
+    return missing
+
+
+def stack_height(thickness=None, order=STACK_ORDER):
+    """Total height of the stack in mm."""
+    thickness = {**LAYER_THICKNESS, **(thickness or {})}
+    return math.fsum(thickness[layer] for layer in order)
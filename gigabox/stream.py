@@ -0,0 +1,355 @@
+"""
+Streaming writers for bulk runs: entities go straight to the file one at a
+time, without an ezdxf document in memory. DXFStream writes a minimal R12
+DXF, SVGStream an SVG, PDFStream a one page vector PDF and GCodeStream laser
+G-code; all take the add_* calls the draw functions make.
+"""
+import math
+import os
+
+from .geometry import bulge_arc, flat_entities, iter_primitives
+from .trace import traced
+
+svg_margin = 0.5  # in cm, around the drawing
+svg_stroke = 0.02  # in cm
+pdf_scale = 72 / 2.54  # points per cm
+gcode_feed = 1000  # mm/min
+gcode_power = 1000  # spindle S value, the laser power
+
+
+def _number(value):
+    return repr(float(value))
+
+
+class _Stream:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class DXFStream(_Stream):
+    """
+    Writes a DXF R12 file: a header naming the version, then one ENTITIES
+    section. R12 has no LWPOLYLINE, so polylines become POLYLINE, VERTEX and
+    SEQEND entities, bulges included. Blocks are not supported, so repeated
+    features are drawn in place.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        f.write("0\nSECTION\n2\nHEADER\n9\n$ACADVER\n1\nAC1009\n0\nENDSEC\n0\nSECTION\n2\nENTITIES\n")
+
+    def _entity(self, kind, dxfattribs, *groups):
+        layer = (dxfattribs or {}).get("layer", "0")
+        self.f.write(f"0\n{kind}\n8\n{layer}\n" + "".join(f"{code}\n{value}\n" for code, value in groups))
+
+    def add_lwpolyline(self, points, format=None, close=False, dxfattribs=None):
+        self._entity("POLYLINE", dxfattribs, (66, 1), (10, "0.0"), (20, "0.0"), (30, "0.0"), (70, 1 if close else 0))
+        for point in points:
+            x, y = point[:2]
+            bulge = point[2] if format == "xyb" else 0
+            groups = [(10, _number(x)), (20, _number(y)), (30, "0.0")]
+            if bulge:
+                groups.append((42, _number(bulge)))
+            self._entity("VERTEX", dxfattribs, *groups)
+        self._entity("SEQEND", dxfattribs)
+
+    def add_arc(self, center, radius, start_angle, end_angle, dxfattribs=None):
+        self._entity("ARC", dxfattribs, (10, _number(center[0])), (20, _number(center[1])), (30, "0.0"),
+                     (40, _number(radius)), (50, _number(start_angle)), (51, _number(end_angle)))
+
+    def add_circle(self, center, radius, dxfattribs=None):
+        self._entity("CIRCLE", dxfattribs, (10, _number(center[0])), (20, _number(center[1])), (30, "0.0"),
+                     (40, _number(radius)))
+
+    def add_point(self, location, dxfattribs=None):
+        self._entity("POINT", dxfattribs, (10, _number(location[0])), (20, _number(location[1])), (30, "0.0"))
+
+    def close(self):
+        self.f.write("0\nENDSEC\n0\nEOF\n")
+        self.f.close()
+
+
+class SVGStream(_Stream):
+    """
+    Writes an SVG in cm, y pointing up like the DXF. The view box has to be
+    known up front, so the bounds of the drawing are passed in.
+
+    Args:
+    - f: Text file to write to.
+    - bounds: (x0, y0, x1, y1) of the drawing in cm.
+    """
+
+    def __init__(self, f, bounds):
+        self.f = f
+        x0, y0, x1, y1 = bounds
+        x0, y0, x1, y1 = x0 - svg_margin, y0 - svg_margin, x1 + svg_margin, y1 + svg_margin
+        f.write(f'<svg xmlns="http://www.w3.org/2000/svg" width="{x1 - x0:g}cm" height="{y1 - y0:g}cm" '
+                f'viewBox="{x0:g} {-y1:g} {x1 - x0:g} {y1 - y0:g}">\n'
+                f'<g transform="scale(1,-1)" fill="none" stroke="black" stroke-width="{svg_stroke:g}">\n')
+
+    def _class(self, dxfattribs):
+        layer = (dxfattribs or {}).get("layer")
+        return f' class="{layer}"' if layer else ""
+
+    def add_lwpolyline(self, points, format=None, close=False, dxfattribs=None):
+        points = [(point[0], point[1], point[2] if format == "xyb" else 0) for point in points]
+        if close:
+            points.append(points[0])
+        x, y, _ = points[0]
+        path = [f"M{x:.6g} {y:.6g}"]
+        for (x0, y0, bulge), (x1, y1, _) in zip(points, points[1:]):
+            if bulge:
+                radius = bulge_arc(x0, y0, x1, y1, bulge)[2]
+                # In the flipped y-up space a positive bulge turns the positive way
+                path.append(f"A{radius:.6g} {radius:.6g} 0 {int(abs(bulge) > 1)} {int(bulge > 0)} {x1:.6g} {y1:.6g}")
+            else:
+                path.append(f"L{x1:.6g} {y1:.6g}")
+        self.f.write(f'<path{self._class(dxfattribs)} d="{" ".join(path)}"/>\n')
+
+    def add_arc(self, center, radius, start_angle, end_angle, dxfattribs=None):
+        sweep = (end_angle - start_angle) % 360 or 360
+        x0 = center[0] + radius * math.cos(math.radians(start_angle))
+        y0 = center[1] + radius * math.sin(math.radians(start_angle))
+        x1 = center[0] + radius * math.cos(math.radians(end_angle))
+        y1 = center[1] + radius * math.sin(math.radians(end_angle))
+        self.f.write(f'<path{self._class(dxfattribs)} d="M{x0:.6g} {y0:.6g} '
+                     f'A{radius:.6g} {radius:.6g} 0 {int(sweep > 180)} 1 {x1:.6g} {y1:.6g}"/>\n')
+
+    def add_circle(self, center, radius, dxfattribs=None):
+        self.f.write(f'<circle{self._class(dxfattribs)} cx="{center[0]:.6g}" cy="{center[1]:.6g}" r="{radius:.6g}"/>\n')
+
+    def add_point(self, location, dxfattribs=None):
+        self.f.write(f'<circle{self._class(dxfattribs)} cx="{location[0]:.6g}" cy="{location[1]:.6g}" '
+                     f'r="{svg_stroke:g}" fill="black" stroke="none"/>\n')
+
+    def close(self):
+        self.f.write("</g>\n</svg>\n")
+        self.f.close()
+
+
+def _arc_curves(cx, cy, radius, start, sweep):
+    """
+    Cubic Bezier pieces, (c1, c2, end) point triples, of the arc around
+    (cx, cy) from angle start turning by sweep (radians, negative clockwise).
+    """
+    pieces = max(int(math.ceil(abs(sweep) / (math.pi / 2) - 1e-9)), 1)
+    step = sweep / pieces
+    k = 4 / 3 * math.tan(step / 4) * radius
+    curves = []
+    for piece in range(pieces):
+        a0, a1 = start + piece * step, start + (piece + 1) * step
+        x0, y0 = cx + radius * math.cos(a0), cy + radius * math.sin(a0)
+        x1, y1 = cx + radius * math.cos(a1), cy + radius * math.sin(a1)
+        curves.append(((x0 - k * math.sin(a0), y0 + k * math.cos(a0)),
+                       (x1 + k * math.sin(a1), y1 - k * math.cos(a1)), (x1, y1)))
+    return curves
+
+
+class PDFStream(_Stream):
+    """
+    Writes a one page PDF at 1:1 scale with the drawing as stroked paths.
+    The page content is streamed; its length goes into an object after it,
+    so nothing is buffered. Like SVGStream it needs the drawing bounds.
+
+    Args:
+    - f: Binary file to write to.
+    - bounds: (x0, y0, x1, y1) of the drawing in cm.
+    """
+
+    def __init__(self, f, bounds):
+        self.f = f
+        x0, y0, x1, y1 = bounds
+        self.origin = x0 - svg_margin, y0 - svg_margin
+        width = (x1 - x0 + 2 * svg_margin) * pdf_scale
+        height = (y1 - y0 + 2 * svg_margin) * pdf_scale
+        self.offsets = []
+        f.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        self._object(b"<< /Type /Catalog /Pages 2 0 R >>")
+        self._object(b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>")
+        self._object(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {width:.2f} {height:.2f}] "
+                     f"/Contents 4 0 R /Resources << >> >>".encode())
+        self.offsets.append(f.tell())
+        f.write(b"4 0 obj\n<< /Length 5 0 R >>\nstream\n")
+        self.content_start = f.tell()
+        self._write(f"{svg_stroke * pdf_scale:.3f} w 1 J 1 j\n")
+
+    def _object(self, body):
+        self.offsets.append(self.f.tell())
+        self.f.write(f"{len(self.offsets)} 0 obj\n".encode() + body + b"\nendobj\n")
+
+    def _write(self, text):
+        self.f.write(text.encode("ascii"))
+
+    def _xy(self, x, y):
+        return f"{(x - self.origin[0]) * pdf_scale:.3f} {(y - self.origin[1]) * pdf_scale:.3f}"
+
+    def _curves(self, curves):
+        return "".join(f"{self._xy(*c1)} {self._xy(*c2)} {self._xy(*end)} c\n" for c1, c2, end in curves)
+
+    def add_lwpolyline(self, points, format=None, close=False, dxfattribs=None):
+        points = [(point[0], point[1], point[2] if format == "xyb" else 0) for point in points]
+        if close:
+            points.append(points[0])
+        path = [f"{self._xy(*points[0][:2])} m\n"]
+        for (x0, y0, bulge), (x1, y1, _) in zip(points, points[1:]):
+            if bulge:
+                cx, cy, radius = bulge_arc(x0, y0, x1, y1, bulge)[:3]
+                path.append(self._curves(_arc_curves(cx, cy, radius, math.atan2(y0 - cy, x0 - cx),
+                                                     4 * math.atan(bulge))))
+            else:
+                path.append(f"{self._xy(x1, y1)} l\n")
+        self._write("".join(path) + "S\n")
+
+    def add_arc(self, center, radius, start_angle, end_angle, dxfattribs=None):
+        sweep = math.radians((end_angle - start_angle) % 360 or 360)
+        curves = _arc_curves(center[0], center[1], radius, math.radians(start_angle), sweep)
+        start = center[0] + radius * math.cos(math.radians(start_angle)), \
+            center[1] + radius * math.sin(math.radians(start_angle))
+        self._write(f"{self._xy(*start)} m\n{self._curves(curves)}S\n")
+
+    def add_circle(self, center, radius, dxfattribs=None):
+        curves = _arc_curves(center[0], center[1], radius, 0, 2 * math.pi)
+        self._write(f"{self._xy(center[0] + radius, center[1])} m\n{self._curves(curves)}h S\n")
+
+    def add_point(self, location, dxfattribs=None):
+        # A zero length line with round caps is a dot
+        self._write(f"{self._xy(*location)} m {self._xy(*location)} l S\n")
+
+    def close(self):
+        length = self.f.tell() - self.content_start
+        self.f.write(b"\nendstream\nendobj\n")
+        self._object(str(length).encode())
+        xref = self.f.tell()
+        self.f.write(f"xref\n0 {len(self.offsets) + 1}\n0000000000 65535 f \n".encode())
+        self.f.write("".join(f"{offset:010d} 00000 n \n" for offset in self.offsets).encode())
+        self.f.write(f"trailer\n<< /Size {len(self.offsets) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+        self.f.close()
+
+
+class GCodeStream(_Stream):
+    """
+    Writes laser G-code in mm: every entity is one cut, with a rapid move to
+    its start, the laser on (M4, power scaled with speed on GRBL), G1 lines
+    and G2/G3 arcs, and the laser off. Points are not cut. Cuts come out in
+    the order they are drawn, so write toolpath optimized geometry.
+    """
+
+    def __init__(self, f, feed=gcode_feed, power=gcode_power):
+        self.f = f
+        self.feed = feed
+        self.power = power
+        self.layer = None
+        f.write("; gigabox laser cut, units mm\nG21\nG90\nM5\n")
+
+    def _start(self, x, y, dxfattribs):
+        layer = (dxfattribs or {}).get("layer")
+        if layer != self.layer:
+            self.layer = layer
+            self.f.write(f"; {layer or 'layer 0'}\n")
+        self.f.write(f"G0 X{x * 10:.4f} Y{y * 10:.4f}\nM4 S{self.power} F{self.feed}\n")
+
+    def _arc(self, x0, y0, x1, y1, cx, cy, clockwise):
+        return (f"{'G2' if clockwise else 'G3'} X{x1 * 10:.4f} Y{y1 * 10:.4f} "
+                f"I{(cx - x0) * 10:.4f} J{(cy - y0) * 10:.4f}\n")
+
+    def add_lwpolyline(self, points, format=None, close=False, dxfattribs=None):
+        points = [(point[0], point[1], point[2] if format == "xyb" else 0) for point in points]
+        if close:
+            points.append(points[0])
+        self._start(points[0][0], points[0][1], dxfattribs)
+        moves = []
+        for (x0, y0, bulge), (x1, y1, _) in zip(points, points[1:]):
+            if bulge:
+                cx, cy = bulge_arc(x0, y0, x1, y1, bulge)[:2]
+                moves.append(self._arc(x0, y0, x1, y1, cx, cy, bulge < 0))
+            else:
+                moves.append(f"G1 X{x1 * 10:.4f} Y{y1 * 10:.4f}\n")
+        self.f.write("".join(moves) + "M5\n")
+
+    def add_arc(self, center, radius, start_angle, end_angle, dxfattribs=None):
+        cx, cy = center
+        x0, y0 = cx + radius * math.cos(math.radians(start_angle)), cy + radius * math.sin(math.radians(start_angle))
+        x1, y1 = cx + radius * math.cos(math.radians(end_angle)), cy + radius * math.sin(math.radians(end_angle))
+        self._start(x0, y0, dxfattribs)
+        self.f.write(self._arc(x0, y0, x1, y1, cx, cy, False) + "M5\n")
+
+    def add_circle(self, center, radius, dxfattribs=None):
+        cx, cy = center
+        self._start(cx + radius, cy, dxfattribs)
+        self.f.write(self._arc(cx + radius, cy, cx + radius, cy, cx, cy, False) + "M5\n")
+
+    def add_point(self, location, dxfattribs=None):
+        pass
+
+    def close(self):
+        self.f.write("M5\nG0 X0 Y0\nM2\n")
+        self.f.close()
+
+
+# Streamed formats by file extension, and whether they need the bounds up front
+STREAM_FORMATS = {
+    ".dxf": (lambda file_name, bounds: DXFStream(open(file_name, "w", encoding="ascii")), False),
+    ".svg": (lambda file_name, bounds: SVGStream(open(file_name, "w", encoding="utf-8"), bounds), True),
+    ".pdf": (lambda file_name, bounds: PDFStream(open(file_name, "wb"), bounds), True),
+    ".gcode": (lambda file_name, bounds: GCodeStream(open(file_name, "w", encoding="ascii")), False),
+}
+
+
+def _format(file_name):
+    extension = os.path.splitext(file_name)[1].lower()
+    if extension not in STREAM_FORMATS:
+        raise ValueError(f"no stream writer for {extension or file_name!r} files")
+    return STREAM_FORMATS[extension]
+
+
+def open_stream(file_name, bounds):
+    """A stream writer for file_name, picked by its extension (see STREAM_FORMATS)."""
+    return _format(file_name)[0](file_name, bounds)
+
+
+def drawing_bounds(sources):
+    """(x0, y0, x1, y1) around the primitives of some LayerGeometries, CompiledLayers or documents."""
+    x0 = y0 = math.inf
+    x1 = y1 = -math.inf
+    for source in sources:
+        if hasattr(source, "rows"):
+            # Worked out on the arrays of a CompiledLayer
+            extent = source.extent()
+            if extent is not None:
+                x0, y0, x1, y1 = min(x0, extent[0]), min(y0, extent[1]), max(x1, extent[2]), max(y1, extent[3])
+            continue
+        for kind, *values in iter_primitives(source):
+            if kind == "line":
+                xs, ys = values[0::2], values[1::2]
+            elif kind == "point":
+                xs, ys = values[:1], values[1:]
+            else:
+                cx, cy, radius = values[:3]
+                xs, ys = (cx - radius, cx + radius), (cy - radius, cy + radius)
+            x0, x1 = min(x0, *xs), max(x1, *xs)
+            y0, y1 = min(y0, *ys), max(y1, *ys)
+    return (x0, y0, x1, y1) if x0 <= x1 else (0, 0, 0, 0)
+
+
+@traced
+def write_geometries(file_name, layers):
+    """
+    Stream recorded geometries into one .dxf, .svg, .pdf or .gcode file. The
+    entities are written as they are read off the geometries, block
+    references expanded one at a time, so writing holds no more than the
+    geometries themselves.
+
+    Args:
+    - file_name: Path of the file to write, the extension picks the format.
+    - layers: (layer name, LayerGeometry or CompiledLayer) pairs, layer "0"
+      is the default.
+    """
+    bounds = drawing_bounds(geometry for name, geometry in layers) if _format(file_name)[1] else None
+    with open_stream(file_name, bounds) as out:
+        for name, geometry in layers:
+            extra = {"dxfattribs": {"layer": name}} if name != "0" else {}
+            for method, args, kwargs in flat_entities(geometry):
+                getattr(out, method)(*args, **kwargs, **extra)
@@ -0,0 +1,315 @@
+"""
+Laser toolpaths: the connected lines and arcs of a layer merged into single
+polylines with bulges, so every outline is one pierce, and the contours put
+in a cutting order with little rapid travel between them.
+"""
+import math
+from collections import defaultdict
+from dataclasses import dataclass
+
+import numpy as np
+
+from .check import candidate_pairs
+from .geometry import LayerGeometry, iter_primitives
+from .trace import traced
+
+join_tolerance = 1e-6  # in cm, end points closer than this are joined
+two_opt_window = 32  # longest run of contours 2-opt reverses at once
+two_opt_passes = 8
+
+
+@dataclass
+class Contour:
+    """
+    One pierce of the laser. points are (x, y, bulge) vertices; a circle has
+    no points, only circle = (cx, cy, radius).
+    """
+    points: list
+    closed: bool
+    circle: tuple = None
+
+    def bbox(self):
+        if self.circle:
+            cx, cy, radius = self.circle
+            return cx - radius, cy - radius, cx + radius, cy + radius
+        xs = [point[0] for point in self.points]
+        ys = [point[1] for point in self.points]
+        return min(xs), min(ys), max(xs), max(ys)
+
+    def entries(self):
+        """The points the cut can start from."""
+        if self.circle:
+            cx, cy, radius = self.circle
+            return [(cx + radius, cy)]
+        if self.closed:
+            return [point[:2] for point in self.points]
+        return [self.points[0][:2], self.points[-1][:2]]
+
+    def start_at(self, index):
+        """Make the cut start at entries()[index]."""
+        if self.circle:
+            return
+        if self.closed:
+            self.points = self.points[index:] + self.points[:index]
+        elif index:
+            self.reverse()
+
+    def reverse(self):
+        """Cut an open contour the other way round."""
+        # A bulge belongs to the segment after its vertex, so it moves one
+        # vertex along and flips sign
+        points = self.points[::-1]
+        self.points = [(x, y, -points[i + 1][2] if i + 1 < len(points) else 0)
+                       for i, (x, y, _) in enumerate(points)]
+
+    def begin(self):
+        return self.entries()[0] if self.circle else self.points[0][:2]
+
+    def end(self):
+        if self.circle or self.closed:
+            return self.begin()
+        return self.points[-1][:2]
+
+    def draw(self, msp):
+        if self.circle:
+            cx, cy, radius = self.circle
+            msp.add_circle((cx, cy), radius)
+        else:
+            msp.add_lwpolyline(self.points, format="xyb", close=self.closed)
+
+
+def _key(x, y):
+    return round(x / join_tolerance), round(y / join_tolerance)
+
+
+def merge_contours(source):
+    """
+    Chain the lines and arcs of source that share end points into contours.
+    Circles are contours of their own; points are returned separately.
+
+    Returns (contours, points).
+    """
+    edges = []  # (x0, y0, x1, y1, bulge)
+    contours = []
+    points = []
+    for kind, *values in iter_primitives(source):
+        if kind == "line":
+            edges.append((*values, 0))
+        elif kind == "arc":
+            cx, cy, radius, start, end = values
+            sweep = (end - start) % 360 or 360
+            x0, y0 = cx + radius * math.cos(math.radians(start)), cy + radius * math.sin(math.radians(start))
+            x1, y1 = cx + radius * math.cos(math.radians(end)), cy + radius * math.sin(math.radians(end))
+            edges.append((x0, y0, x1, y1, math.tan(math.radians(sweep) / 4)))
+        elif kind == "circle":
+            contours.append(Contour([], True, tuple(values)))
+        elif kind == "point":
+            points.append(tuple(values))
+
+    at = defaultdict(list)
+    for index, (x0, y0, x1, y1, bulge) in enumerate(edges):
+        at[_key(x0, y0)].append(index)
+        at[_key(x1, y1)].append(index)
+    used = [False] * len(edges)
+
+    def take(key):
+        # An unused edge touching key, turned to start there
+        for index in at[key]:
+            if not used[index]:
+                used[index] = True
+                x0, y0, x1, y1, bulge = edges[index]
+                return (x0, y0, x1, y1, bulge) if _key(x0, y0) == key else (x1, y1, x0, y0, -bulge)
+        return None
+
+    for index, edge in enumerate(edges):
+        if used[index]:
+            continue
+        used[index] = True
+        chain = [edge]
+        head = _key(edge[0], edge[1])
+        while _key(chain[-1][2], chain[-1][3]) != head:
+            following = take(_key(chain[-1][2], chain[-1][3]))
+            if following is None:
+                break
+            chain.append(following)
+        closed = _key(chain[-1][2], chain[-1][3]) == head
+        if not closed:
+            # Grow the open chain backwards from its first point too
+            while True:
+                previous = take(_key(chain[0][0], chain[0][1]))
+                if previous is None:
+                    break
+                x0, y0, x1, y1, bulge = previous
+                chain.insert(0, (x1, y1, x0, y0, -bulge))
+        vertices = [(x0, y0, bulge) for x0, y0, x1, y1, bulge in chain]
+        if not closed:
+            vertices.append((chain[-1][2], chain[-1][3], 0))
+        contours.append(Contour(vertices, closed))
+    return contours, points
+
+
+def nesting_depth(contours):
+    """How many other contours enclose each contour, judged by bounding boxes."""
+    boxes = np.array([contour.bbox() for contour in contours], dtype=float).reshape(-1, 4)
+    depth = np.zeros(len(contours), dtype=int)
+    a, b = candidate_pairs(boxes, 0)
+    for inner, outer in ((a, b), (b, a)):
+        inside = (np.all(boxes[inner, :2] >= boxes[outer, :2], axis=1)
+                  & np.all(boxes[inner, 2:] <= boxes[outer, 2:], axis=1)
+                  & np.any(boxes[inner] != boxes[outer], axis=1))
+        np.add.at(depth, inner[inside], 1)
+    return depth
+
+
+def nearest_neighbour(contours, position):
+    """
+    Order contours greedily, always cutting next the one that can be entered
+    closest to where the last one ended. Entry points live in a uniform grid,
+    so each step only looks at the cells around the head.
+    """
+    owners, xs, ys = [], [], []
+    for number, contour in enumerate(contours):
+        for x, y in contour.entries():
+            owners.append(number)
+            xs.append(x)
+            ys.append(y)
+    xs, ys = np.array(xs), np.array(ys)
+    span = max(xs.max() - xs.min(), ys.max() - ys.min(), join_tolerance)
+    cell = span / max(math.sqrt(len(xs)), 1)
+    grid = defaultdict(set)
+    cells = list(zip(((xs - xs.min()) // cell).astype(int).tolist(), ((ys - ys.min()) // cell).astype(int).tolist()))
+    first_entry = {}
+    for entry, (owner, key) in enumerate(zip(owners, cells)):
+        grid[key].add(entry)
+        first_entry.setdefault(owner, entry)
+    remaining = np.ones(len(xs), dtype=bool)
+    entry_range = defaultdict(list)
+    for entry, owner in enumerate(owners):
+        entry_range[owner].append(entry)
+
+    order = []
+    x, y = position
+    for _ in range(len(contours)):
+        home = int((x - xs.min()) // cell), int((y - ys.min()) // cell)
+        best, best_distance = None, math.inf
+        for ring in range(8):
+            for cx in range(home[0] - ring, home[0] + ring + 1):
+                for cy in range(home[1] - ring, home[1] + ring + 1):
+                    if max(abs(cx - home[0]), abs(cy - home[1])) != ring:
+                        continue
+                    for entry in grid.get((cx, cy), ()):
+                        distance = math.hypot(xs[entry] - x, ys[entry] - y)
+                        if distance < best_distance:
+                            best, best_distance = entry, distance
+            if best is not None and best_distance <= ring * cell:
+                break
+        else:
+            # Nothing near the head any more: look at every remaining entry
+            candidates = np.flatnonzero(remaining)
+            distances = np.hypot(xs[candidates] - x, ys[candidates] - y)
+            closest = candidates[distances.argmin()]
+            if best is None or distances.min() < best_distance:
+                best = closest
+
+        owner = owners[best]
+        contour = contours[owner]
+        contour.start_at(best - first_entry[owner])
+        order.append(contour)
+        for entry in entry_range[owner]:
+            grid[cells[entry]].discard(entry)
+            remaining[entry] = False
+        x, y = contour.end()
+    return order
+
+
+def two_opt(order, position, window=two_opt_window, passes=two_opt_passes):
+    """
+    Shorten the rapid travel of a cutting order by reversing runs of up to
+    window contours. Every run length is evaluated for the whole order at
+    once; non-overlapping improvements are applied together.
+    """
+    count = len(order)
+    for _ in range(passes):
+        entry = np.array([contour.begin() for contour in order])
+        exit = np.array([contour.end() for contour in order])
+        before = np.vstack([position, exit[:-1]])
+        improved = False
+        taken = np.zeros(count + 2, dtype=bool)
+        moves = []
+        for length in range(min(window, count)):
+            i = np.arange(count - length)
+            j = i + length
+            last = j + 1 >= count
+            following = entry[np.minimum(j + 1, count - 1)]
+            gain = (np.hypot(*(before[i] - entry[i]).T) - np.hypot(*(before[i] - exit[j]).T)
+                    + np.where(last, 0, np.hypot(*(exit[j] - following).T) - np.hypot(*(entry[i] - following).T)))
+            for k in np.flatnonzero(gain > join_tolerance):
+                moves.append((gain[k], int(i[k]), int(j[k])))
+        for gain, i, j in sorted(moves, reverse=True):
+            # Runs must not share a contour or the link between two runs
+            if taken[i:j + 2].any():
+                continue
+            taken[i:j + 2] = True
+            run = order[i:j + 1][::-1]
+            for contour in run:
+                if not contour.closed:
+                    contour.reverse()
+            order[i:j + 1] = run
+            improved = True
+        if not improved:
+            break
+    return order
+
+
+@traced
+def optimize_toolpath(source, start=(0, 0)):
+    """
+    Return a LayerGeometry with the outlines of source merged into polylines
+    and the contours in cutting order: the most deeply nested ones first, so
+    parts never drop out before their holes are cut, and within each nesting
+    level by nearest neighbour improved with 2-opt.
+
+    Args:
+    - source: A LayerGeometry or an ezdxf document.
+    - start: Where the laser head starts, in cm.
+    """
+    contours, points = merge_contours(source)
+    geometry = LayerGeometry()
+    position = start
+    if contours:
+        depth = nesting_depth(contours)
+        for level in sorted(set(depth.tolist()), reverse=True):
+            order = nearest_neighbour([contours[i] for i in np.flatnonzero(depth == level)], position)
+            for contour in two_opt(order, position):
+                contour.draw(geometry)
+                position = contour.end()
+    for point in points:
+        geometry.add_point(point)
+    return geometry
+
+
+def travel(source, start=(0, 0)):
+    """
+    (pierces, rapid travel in cm) of cutting the entities of a LayerGeometry
+    one after another in the order they are stored.
+    """
+    pierces = 0
+    distance = 0
+    position = start
+    for method, args, kwargs in source.entities:
+        if method == "add_lwpolyline":
+            points = [point[:2] for point in args[0]]
+            begin, end = points[0], points[0] if kwargs.get("close") else points[-1]
+        elif method == "add_arc":
+            (cx, cy), radius, start_angle, end_angle = args
+            begin = cx + radius * math.cos(math.radians(start_angle)), cy + radius * math.sin(math.radians(start_angle))
+            end = cx + radius * math.cos(math.radians(end_angle)), cy + radius * math.sin(math.radians(end_angle))
+        elif method == "add_circle":
+            (cx, cy), radius = args
+            begin = end = cx + radius, cy
+        else:
+            continue
+        pierces += 1
+        distance += math.hypot(begin[0] - position[0], begin[1] - position[1])
+        position = end
+    return pierces, distance
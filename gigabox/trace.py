@@ -0,0 +1,141 @@
+"""
+Lightweight instrumentation: timing spans and counters. Span totals and
+counters are always kept, a few dict updates per span, so they can stay on
+in production; individual span events are only kept once record_events()
+is called, for a Chrome trace (chrome://tracing or https://ui.perfetto.dev).
+"""
+import functools
+import json
+import os
+import threading
+import time
+
+event_limit = 1_000_000  # events beyond this are counted, not kept
+
+_totals = {}  # span name -> [calls, total ns, max ns]
+_counters = {}
+_events = None
+_dropped = 0
+
+
+class Span:
+    """Times a with block under name; args end up in the trace event."""
+    __slots__ = ("name", "args", "start")
+
+    def __init__(self, name, args=None):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        global _dropped
+        duration = time.perf_counter_ns() - self.start
+        total = _totals.get(self.name)
+        if total is None:
+            total = _totals[self.name] = [0, 0, 0]
+        total[0] += 1
+        total[1] += duration
+        if duration > total[2]:
+            total[2] = duration
+        if _events is not None:
+            if len(_events) < event_limit:
+                _events.append((self.name, self.start, duration, os.getpid(), threading.get_ident(), self.args))
+            else:
+                _dropped += 1
+
+
+def span(name, **args):
+    return Span(name, args or None)
+
+
+def traced(function):
+    """Decorator that runs every call of function in a span named after it."""
+    name = function.__name__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with Span(name):
+            return function(*args, **kwargs)
+    return wrapper
+
+
+def count(name, value=1):
+    _counters[name] = _counters.get(name, 0) + value
+
+
+def record_events(enabled=True):
+    """Start (or stop) keeping every span as an event for write_chrome_trace()."""
+    global _events
+    if enabled and _events is None:
+        _events = []
+    elif not enabled:
+        _events = None
+
+
+def recording_events():
+    return _events is not None
+
+
+def reset():
+    global _dropped
+    _totals.clear()
+    _counters.clear()
+    if _events is not None:
+        _events.clear()
+    _dropped = 0
+
+
+def drain():
+    """Everything recorded so far, removed from this process, for merge()."""
+    recorded = {"totals": dict(_totals), "counters": dict(_counters), "events": list(_events or ())}
+    reset()
+    return recorded
+
+
+def merge(recorded):
+    """Add what drain() returned in another process to this one."""
+    for name, (calls, total_ns, max_ns) in recorded["totals"].items():
+        total = _totals.setdefault(name, [0, 0, 0])
+        total[0] += calls
+        total[1] += total_ns
+        total[2] = max(total[2], max_ns)
+    for name, value in recorded["counters"].items():
+        count(name, value)
+    if _events is not None:
+        _events.extend(recorded["events"][:max(event_limit - len(_events), 0)])
+
+
+def call_recorded(fn, args, events):
+    """Run fn(*args) in a pool worker and hand back (result, drain())."""
+    record_events(events)
+    result = fn(*args)
+    return result, drain()
+
+
+def summary():
+    """The span totals and counters as a text table, slowest spans first."""
+    lines = [f"{'span':<32} {'calls':>8} {'total ms':>10} {'mean ms':>9} {'max ms':>9}"]
+    for name, (calls, total_ns, max_ns) in sorted(_totals.items(), key=lambda item: -item[1][1]):
+        lines.append(f"{name:<32} {calls:>8} {total_ns / 1e6:>10.2f} "
+                     f"{total_ns / calls / 1e6:>9.3f} {max_ns / 1e6:>9.3f}")
+    if _counters:
+        lines.append(f"{'counter':<32} {'value':>8}")
+        lines.extend(f"{name:<32} {value:>8}" for name, value in sorted(_counters.items()))
+    if _dropped:
+        lines.append(f"{_dropped} events dropped over the limit of {event_limit}")
+    return "\n".join(lines)
+
+
+def write_chrome_trace(path):
+    """Write the recorded events and the counters in the Chrome trace event format."""
+    events = [{"name": name, "ph": "X", "ts": start / 1000, "dur": duration / 1000, "pid": pid, "tid": tid,
+               **({"args": args} if args else {})}
+              for name, start, duration, pid, tid, args in _events or ()]
+    end = max((event["ts"] + event["dur"] for event in events), default=0)
+    events.extend({"name": name, "ph": "C", "ts": end, "pid": os.getpid(), "args": {"value": value}}
+                  for name, value in sorted(_counters.items()))
+    with open(path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
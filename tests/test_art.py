@@ -0,0 +1,125 @@
+import os
+import struct
+import subprocess
+import sys
+import zlib
+
+import numpy as np
+import pytest
+from PIL import Image, ImageOps
+
+from gigabox import art
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _test_image(mode, size=(157, 203)):
+    rng = np.random.default_rng(1)
+    pixels = np.zeros((size[1], size[0], 4), np.uint8)
+    pixels[..., 0] = np.arange(size[0])[None]
+    pixels[..., 1] = np.arange(size[1])[:, None]
+    pixels[..., 2:] = rng.integers(0, 255, (size[1], size[0], 2))
+    image = Image.fromarray(pixels, "RGBA")
+    return image.convert("RGB").quantize(64) if mode == "P" else image.convert(mode)
+
+
+def _write_png(path, width, height):
+    """A gradient RGB PNG written row by row, so making it takes little memory."""
+    def chunk(f, name, data):
+        f.write(struct.pack(">I", len(data)) + name + data + struct.pack(">I", zlib.crc32(name + data)))
+    x = np.arange(width, dtype=np.uint32)
+    compress = zlib.compressobj(1)
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        chunk(f, b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        for y in range(height):
+            row = np.stack([x % 256, (x + y) % 256, np.full(width, y % 256)], -1).astype(np.uint8)
+            # Up filtered rows, so decoding a strip needs the row before it
+            data = compress.compress(b"\x02" if y else b"\x00") + compress.compress(row.tobytes())
+            if data:
+                chunk(f, b"IDAT", data)
+        chunk(f, b"IDAT", compress.flush())
+        chunk(f, b"IEND", b"")
+
+
+def _write_bmp(path, width, height):
+    """A gradient bottom up 24 bit BMP written row by row."""
+    stride = (width * 3 + 3) // 4 * 4
+    x = np.arange(width, dtype=np.uint32)
+    with open(path, "wb") as f:
+        f.write(b"BM" + struct.pack("<IHHI", 54 + stride * height, 0, 0, 54))
+        f.write(struct.pack("<IiiHHIIiiII", 40, width, height, 1, 24, 0, stride * height, 2835, 2835, 0, 0))
+        for y in range(height):
+            row = np.zeros(stride, np.uint8)
+            row[:width * 3] = np.stack([x % 256, np.full(width, y % 256), (x + y) % 256], -1).astype(np.uint8).ravel()
+            f.write(row.tobytes())
+
+
+@pytest.mark.parametrize("extension, mode, options", [
+    (".png", "RGB", {}), (".png", "RGBA", {"optimize": True}), (".png", "L", {}), (".png", "LA", {}),
+    (".png", "P", {}), (".bmp", "RGB", {}), (".bmp", "P", {}), (".tif", "RGB", {}), (".tga", "L", {}),
+    (".ppm", "RGB", {}),
+])
+@pytest.mark.parametrize("rows", [1, 7, 1000])
+def test_strips_match_full_decode(tmp_path, extension, mode, options, rows):
+    path = str(tmp_path / f"art{extension}")
+    _test_image(mode).save(path, **options)
+    full = np.asarray(Image.open(path).convert("RGBA"))
+    strips = art._strips(Image.open(path), path)
+    assert strips is not None
+    covered = 0
+    for top, strip in strips(rows):
+        assert top == covered
+        assert np.array_equal(np.asarray(strip.convert("RGBA")), full[top:top + strip.height])
+        covered += strip.height
+    assert covered == full.shape[0]
+
+
+def test_strips_not_for_compressed_tiles(tmp_path):
+    path = str(tmp_path / "art.tif")
+    _test_image("RGB").save(path, compression="tiff_lzw")
+    assert art._strips(Image.open(path), path) is None
+
+
+def _padded_composite(original_image, hitbox_image):
+    """composite_art the slow way: pad, resize, paste and crop the black margin."""
+    border = int(original_image.width * art.ART_PADDING[0]), int(original_image.height * art.ART_PADDING[1])
+    padded_image = ImageOps.expand(original_image, border=border, fill=(0, 0, 0)).resize(hitbox_image.size)
+    padded_image.paste(hitbox_image, (0, 0), hitbox_image)
+    return padded_image.crop(padded_image.convert("L").getbbox())
+
+
+def test_composite_art_matches_padded_composite():
+    hitbox_image = art.render_overlay("art")
+    pixels = np.zeros((1000, 1500, 3), np.uint8)
+    pixels[40:-30, 25:-60] = np.random.default_rng(0).integers(1, 255, (930, 1415, 3))
+    original_image = Image.fromarray(pixels)
+
+    expected = np.asarray(_padded_composite(original_image, hitbox_image)).astype(int)
+    combined = np.asarray(art.composite_art(original_image, hitbox_image)).astype(int)
+    assert combined.shape == expected.shape
+    assert np.abs(combined - expected).max() <= 2
+
+
+@pytest.mark.parametrize("write", [_write_png, _write_bmp])
+def test_load_art_memory_bounded(tmp_path, write):
+    # Pillow's buffers are not seen by tracemalloc, so the peak RSS of a fresh process is measured
+    width, height = 9000, 6000
+    path = str(tmp_path / ("art.png" if write is _write_png else "art.bmp"))
+    write(path, width, height)
+    script = (
+        "import resource, sys\n"
+        "from PIL import Image\n"
+        "from gigabox.art import load_art\n"
+        "Image.open(sys.argv[1]).close()\n"
+        "before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss\n"
+        "image = load_art(sys.argv[1], (2000, 1300))\n"
+        "image.load()\n"
+        "print(image.width, image.height, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before)\n"
+    )
+    out = subprocess.run([sys.executable, "-c", script, path], capture_output=True, text=True, check=True,
+                         env={**os.environ, "PYTHONPATH": ROOT}).stdout.split()
+    reduced_width, reduced_height, grown = map(int, out)
+    assert reduced_width < width // 2 and reduced_height < height // 2
+    # ru_maxrss is in KiB; decoded whole the artwork alone takes 4 bytes a pixel
+    assert grown * 1024 < width * height * 4 / 3
@@ -0,0 +1,136 @@
+import os
+import subprocess
+import sys
+import time
+from dataclasses import replace
+
+import ezdxf
+import pytest
+
+from gigabox.build import (BUILD_TARGETS, DEFAULT_PARAMS, build_all, build_variants, checksums_name, file_digest,
+                           iter_variants, manifest_name, parse_params, read_checksums, read_param_sets)
+from gigabox.dxf import create_dxf_art, create_dxf_total, dxf_file_path, explode_dxf, output_dxf_dir, save_geometry
+from gigabox.geometry import LayerGeometry
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _build(out_dir, seed):
+    """Build every target deterministically in a fresh process with the given hash seed."""
+    script = ("import sys\n"
+              "from gigabox.build import build_all\n"
+              "assert all(result.ok for result in build_all(jobs=1, out_dir=sys.argv[1], blocks=True,\n"
+              "                                              writer=['ezdxf', 'svg'], deterministic=True))\n")
+    subprocess.run([sys.executable, "-c", script, out_dir], check=True,
+                   env={**os.environ, "PYTHONPATH": ROOT, "PYTHONHASHSEED": str(seed)})
+    return read_checksums(out_dir)
+
+
+def test_deterministic_bytes_stable_across_hash_seeds(tmp_path):
+    first = _build(str(tmp_path / "a"), 1)
+    second = _build(str(tmp_path / "b"), 2)
+    assert len(first) == 16 and first == second
+    assert (tmp_path / "a" / checksums_name).read_bytes() == (tmp_path / "b" / checksums_name).read_bytes()
+
+
+def test_deterministic_build_leaves_ezdxf_options(tmp_path):
+    fixed = ezdxf.options.write_fixed_meta_data_for_testing
+    results = list(build_all(["layer1.dxf"], jobs=1, out_dir=str(tmp_path), deterministic=True))
+    assert results[0].ok and ezdxf.options.write_fixed_meta_data_for_testing == fixed
+    with open(results[0].path) as f:
+        lines = f.read().split("\n")
+    # ezdxf gives the fixed GUIDs new random ones when it loads the file, so the text is checked
+    for name in ("$FINGERPRINTGUID", "$VERSIONGUID"):
+        assert lines[lines.index(name) + 2] == "{00000000-0000-0000-0000-000000000000}"
+    assert not ezdxf.readfile(results[0].path).audit().has_errors
+
+
+@pytest.mark.parametrize("row, field", [
+    ({"button_spacing": "0"}, "button_spacing"),
+    ({"box_width": "-40"}, "box_width"),
+    ({"box_height": "nan"}, "box_height"),
+    ({"corner_radius": "inf"}, "corner_radius"),
+    ({"pico_h": "tall"}, "pico_h"),
+    ({"switch_width": ["1.4", "0"]}, "switch_width"),
+])
+def test_parse_params_rejects_out_of_range(row, field):
+    with pytest.raises(ValueError, match=field):
+        parse_params(row)
+
+
+def test_bad_variant_rows_fail_alone(tmp_path):
+    path = tmp_path / "variants.csv"
+    path.write_text("name,box_width,button_spacing\nwide,44,\nflat,40,0\nnan,nan,\n")
+    results = {result.name: result for result in build_variants(iter_variants(read_param_sets(str(path))),
+                                                                str(tmp_path / "out"), jobs=1, writer="stream")}
+    assert results["wide"].ok
+    for name, field in (("flat", "button_spacing"), ("nan", "box_width")):
+        assert not results[name].ok and field in results[name].error
+        assert not os.path.exists(results[name].path)
+
+
+def test_deterministic_writers_repeat_bytes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(output_dxf_dir)
+    written = []
+    for _ in range(2):
+        create_dxf_total("total.dxf", deterministic=True)
+        create_dxf_art(deterministic=True)
+        list(build_all(["layer4.dxf"], jobs=1, out_dir="blocks", blocks=True))
+        explode_dxf(os.path.join("blocks", "layer4.dxf"), "exploded.dxf", deterministic=True)
+        written.append([(tmp_path / path).read_bytes() for path in (dxf_file_path("total.dxf"),
+                                                                     dxf_file_path("layer-art.dxf"), "exploded.dxf")])
+        # The header times would differ by at least a tick
+        time.sleep(0.01)
+    assert written[0] == written[1]
+
+
+def test_deterministic_floats_are_canonical(tmp_path):
+    drawn = []
+    for x, y in ((0.1 + 0.2, -0.0), (0.3, 0.0)):
+        geometry = LayerGeometry()
+        geometry.add_circle((x, y), 1)
+        save_geometry(geometry, str(tmp_path / "circle.dxf"), deterministic=True)
+        drawn.append((tmp_path / "circle.dxf").read_bytes())
+    assert drawn[0] == drawn[1] and b"\n 10\n0.3\n 20\n0.0\n" in drawn[0]
+
+
+def _age(out_dir):
+    """Move the mtimes of every output an hour back, so a rewrite shows even on coarse clocks."""
+    stamps = {}
+    for name in sorted(os.listdir(out_dir)):
+        path = os.path.join(out_dir, name)
+        os.utime(path, ns=(os.stat(path).st_atime_ns, os.stat(path).st_mtime_ns - 3600 * 10 ** 9))
+        stamps[name] = os.stat(path).st_mtime_ns
+    return stamps
+
+
+def test_unchanged_build_skips_every_target(tmp_path):
+    out_dir = str(tmp_path)
+    assert all(result.ok and not result.skipped for result in build_all(jobs=1, out_dir=out_dir, incremental=True))
+    stamps = _age(out_dir)
+    checksums = read_checksums(out_dir)
+    results = list(build_all(jobs=1, out_dir=out_dir, incremental=True))
+    assert len(results) == len(BUILD_TARGETS) and all(result.ok and result.skipped for result in results)
+    assert {result.name: result.digest for result in results} == checksums
+    # Not even the manifest or SHA256SUMS are touched by a build that writes nothing
+    assert {name: os.stat(os.path.join(out_dir, name)).st_mtime_ns for name in stamps} == stamps
+
+
+def test_changed_parameter_rewrites_only_its_targets(tmp_path):
+    out_dir = str(tmp_path)
+    assert all(result.ok for result in build_all(jobs=1, out_dir=out_dir, incremental=True))
+    stamps = _age(out_dir)
+    checksums = read_checksums(out_dir)
+    # The OLED window is cut in layers 2 and 3 only
+    params = replace(DEFAULT_PARAMS, oled_width=DEFAULT_PARAMS.oled_width + 0.2)
+    results = list(build_all(jobs=1, out_dir=out_dir, params=params, incremental=True))
+    rewritten = {result.name for result in results if not result.skipped}
+    assert all(result.ok for result in results) and rewritten == {"total.dxf", "layer2.dxf", "layer3.dxf"}
+    changed = {name for name in stamps if os.stat(os.path.join(out_dir, name)).st_mtime_ns != stamps[name]}
+    assert changed == rewritten | {checksums_name, manifest_name}
+
+    updated = read_checksums(out_dir)
+    assert updated.keys() == checksums.keys()
+    assert {name for name in checksums if updated[name] != checksums[name]} == rewritten
+    assert all(updated[name] == file_digest(os.path.join(out_dir, name)) for name in rewritten)
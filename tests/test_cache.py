@@ -0,0 +1,46 @@
+import os
+
+import pytest
+
+from gigabox import cache as cache_module
+from gigabox import render
+from gigabox.cache import RenderCache
+from gigabox.spec import compile_layout
+
+
+@pytest.fixture
+def geometry():
+    return compile_layout().layers["art"]
+
+
+def test_key_resolves_defaults(tmp_path, geometry):
+    cache = RenderCache(str(tmp_path))
+    assert cache.key(geometry) == cache.key(geometry, "native", dpi=render.native_dpi,
+                                            line_width=render.stroke_width, margin=render.ART_PADDING)
+    assert cache.key(geometry, dpi=100) != cache.key(geometry)
+    assert cache.key(geometry, "matplotlib") != cache.key(geometry)
+    with pytest.raises(TypeError):
+        cache.key(geometry, dpi_typo=100)
+
+
+def test_key_follows_renderer(tmp_path, geometry, monkeypatch):
+    cache = RenderCache(str(tmp_path))
+    native, matplotlib = cache.key(geometry), cache.key(geometry, "matplotlib")
+    assert cache.key(geometry, "matplotlib", size=(30, 20)) != matplotlib
+    monkeypatch.setattr(render, "renderer_version", render.renderer_version + 1)
+    assert cache.key(geometry) != native and cache.key(geometry, "matplotlib") != matplotlib
+
+
+def test_render_hits_and_evicted_entry(tmp_path, geometry, monkeypatch):
+    cache = RenderCache(str(tmp_path))
+    first = cache.render(geometry, dpi=40)
+    second = cache.render(geometry, dpi=40)
+    assert cache.stats() == {"hits": 1, "misses": 1}
+    assert second.tobytes() == first.tobytes()
+
+    def evicted(path, *args, **kwargs):
+        # Another process removes the entry between reading and touching it
+        os.remove(path)
+        raise FileNotFoundError(path)
+    monkeypatch.setattr(cache_module.os, "utime", evicted)
+    assert cache.get(cache.key(geometry, dpi=40)).tobytes() == first.tobytes()
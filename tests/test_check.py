@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from gigabox.check import candidate_pairs, check_clearance, flatten
+from gigabox.geometry import LayerGeometry
+
+
+def _slot(geometry, x, y, length, width):
+    """A slot of two lines and two half circle arcs, each drawn on its own and the ends last."""
+    radius = width / 2
+    geometry.add_lwpolyline([(x, y - radius), (x + length, y - radius)])
+    geometry.add_lwpolyline([(x + length, y + radius), (x, y + radius)])
+    geometry.add_arc((x + length, y), radius, -90, 90)
+    geometry.add_arc((x, y), radius, 90, 270)
+
+
+def test_close_circles_are_reported():
+    geometry = LayerGeometry()
+    geometry.add_circle((0, 0), 1)
+    geometry.add_circle((2.05, 0), 1)
+    geometry.add_circle((10, 0), 1)
+    violations = check_clearance(geometry, 0.1, layer=4)
+    assert len(violations) == 1
+    violation = violations[0]
+    assert violation.layer == 4 and violation.distance == pytest.approx(0.05, abs=2e-3)
+    assert {violation.feature_a, violation.feature_b} == {"circle r=1 at (0.000, 0.000)",
+                                                          "circle r=1 at (2.050, 0.000)"}
+    assert violation.location == pytest.approx((1.025, 0), abs=2e-3)
+    assert check_clearance(geometry, 0.04) == []
+
+
+def test_pieces_of_one_contour_are_not_reported():
+    # The sides of a slot narrower than the clearance are one feature, as are the edges of the square
+    geometry = LayerGeometry()
+    _slot(geometry, 0, 0, 2, 0.05)
+    for start, end in (((5, 0), (6, 0)), ((6, 1), (5, 1)), ((6, 0), (6, 1)), ((5, 1), (5, 0))):
+        geometry.add_lwpolyline([start, end])
+    assert check_clearance(geometry, 0.1) == []
+
+    segments, owners, labels = flatten(geometry)
+    assert len(labels) == 2 and sorted(np.unique(owners)) == [0, 1]
+    assert labels[1] == "contour 1.000x1.000 at (5.500, 0.500)"
+
+
+def test_close_pieces_of_two_contours_are_reported_once():
+    geometry = LayerGeometry()
+    _slot(geometry, 0, 0, 2, 0.5)
+    _slot(geometry, 0, 0.58, 2, 0.5)
+    violations = check_clearance(geometry, 0.1)
+    # Many segment pairs are close, the pair of slots is reported at the closest one
+    assert len(violations) == 1 and violations[0].distance == pytest.approx(0.08, abs=1e-3)
+
+
+def test_candidate_pairs_match_brute_force():
+    rng = np.random.default_rng(1)
+    start = rng.uniform(0, 10, (300, 2))
+    segments = np.column_stack([start, start + rng.uniform(-0.5, 0.5, (300, 2))])
+    owners = rng.integers(0, 40, 300)
+    reach = 0.2
+    low = np.minimum(segments[:, :2], segments[:, 2:]) - reach / 2
+    high = np.maximum(segments[:, :2], segments[:, 2:]) + reach / 2
+    near = np.all((low[:, None] <= high[None, :]) & (low[None, :] <= high[:, None]), axis=2)
+    expected = {(i, j) for i, j in zip(*np.nonzero(np.triu(near, 1)))}
+
+    a, b = candidate_pairs(segments, reach)
+    assert set(zip(a.tolist(), b.tolist())) == expected and len(a) == len(expected)
+    a, b = candidate_pairs(segments, reach, owners)
+    assert set(zip(a.tolist(), b.tolist())) == {(i, j) for i, j in expected if owners[i] != owners[j]}
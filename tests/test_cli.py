@@ -0,0 +1,36 @@
+import os
+import subprocess
+import sys
+
+from gigabox.build import BUILD_TARGETS, WRITERS
+from gigabox.check import min_clearance
+from gigabox.cli import make_parser
+from gigabox.dxf import output_dxf_dir
+from gigabox.golden import default_tolerance
+from gigabox.nest import default_kerf, default_sheet
+from gigabox.service import default_host, default_max_queue, default_port
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_cli_starts_without_the_heavy_modules():
+    script = ("import sys\n"
+              "from gigabox.cli import make_parser\n"
+              "make_parser().parse_args([])\n"
+              "print(' '.join(name for name in ('ezdxf', 'asyncio', 'gigabox.build', 'gigabox.dxf', 'gigabox.nest',\n"
+              "                                  'gigabox.golden', 'gigabox.service') if name in sys.modules))\n")
+    loaded = subprocess.run([sys.executable, "-c", script], check=True, capture_output=True, text=True,
+                            env={**os.environ, "PYTHONPATH": ROOT}).stdout
+    assert loaded.split() == []
+
+
+def test_parser_defaults_follow_the_modules():
+    parser = make_parser()
+    args = parser.parse_args(["--serve", "--check"])
+    assert args.serve == f"{default_host}:{default_port}" and args.max_queue == default_max_queue
+    assert args.check == min_clearance and args.kerf == default_kerf
+    assert args.against == output_dxf_dir and args.golden_tolerance == default_tolerance
+    help_text = " ".join(parser.format_help().split())
+    assert f"(default: {default_sheet[0]}x{default_sheet[1]})" in help_text
+    assert f"(default: all of {', '.join(BUILD_TARGETS)})" in help_text
+    assert "{" + ",".join(WRITERS) + "}" in help_text
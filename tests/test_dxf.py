@@ -0,0 +1,23 @@
+import ezdxf
+
+from gigabox.build import BUILD_TARGETS, build_all
+from gigabox.dxf import explode_dxf
+from gigabox.golden import diff_files
+
+
+def test_exploded_blocks_match_flat_build(tmp_path):
+    # The stream writers write blocks flat already, see test_stream
+    for blocks, out_dir in ((False, "flat"), (True, "blocks")):
+        assert all(result.ok for result in build_all(jobs=1, out_dir=str(tmp_path / out_dir), blocks=blocks))
+    inserts = 0
+    for name in BUILD_TARGETS:
+        blocks, flat = str(tmp_path / "blocks" / name), str(tmp_path / "flat" / name)
+        inserts += len(ezdxf.readfile(blocks).modelspace().query("INSERT"))
+        exploded = str(tmp_path / f"exploded-{name}")
+        explode_dxf(blocks, exploded)
+        doc = ezdxf.readfile(exploded)
+        assert len(doc.modelspace().query("INSERT")) == 0 and not doc.audit().has_errors
+        assert diff_files(flat, exploded) == {}
+        assert diff_files(flat, blocks) == {}
+    # The switch footprints and holes were written as blocks, also on the named layers of total.dxf
+    assert inserts > 0
@@ -0,0 +1,40 @@
+import math
+
+import numpy as np
+import pytest
+
+from gigabox.geometry import button_layout, cal_equiliteral_triangle, reverse_x
+
+
+def _per_button(box_width=40, box_height=20, spacing=2.8, angle=20, anchor=(28, 15)):
+    """The button centres worked out one button at a time, as before button_layout."""
+    xLP, yLP = anchor
+    xMP = xLP + spacing * math.cos(math.radians(angle))
+    yMP = yLP + spacing * math.sin(math.radians(angle))
+    xHP, yHP = xMP + spacing, yMP
+    xLK, yLK = xLP - 0.5, yLP - 2.8
+    xMK, yMK = xMP - 0.5, yMP - 2.8
+    xHK, yHK = xHP - 0.5, yHP - 2.8
+    xDI, yDI = cal_equiliteral_triangle(xHP, yHP, xHK, yHK)[:2]
+    xL2, yL2 = cal_equiliteral_triangle(xMK, yMK, xLK, yLK)[:2]
+    big = {'LP': (xLP, yLP), 'MP': (xMP, yMP), 'HP': (xHP, yHP), 'LK': (xLK, yLK), 'MK': (xMK, yMK),
+           'HK': (xHK, yHK), 'DI': (xDI, yDI), 'L1': (xLK - 1, yLK - 3.5), 'L2': (xL2, yL2)}
+    xSelect, ySelect = box_width / 2 - 3.5, box_height - 1.5
+    small = {'Select': (xSelect, ySelect), 'Start': (xSelect - 2.5, ySelect)}
+
+    circles = {}
+    for buttons, radius in ((big, 1.315), (small, 1.05)):
+        for name, (x, y) in buttons.items():
+            circles[name] = (x, y, radius)
+        for name, (x, y) in buttons.items():
+            circles[name + '_reverse'] = (reverse_x(x, box_width), y, radius)
+    return circles
+
+
+@pytest.mark.parametrize("kwargs", [{}, {"spacing": 3.1}, {"box_width": 44, "box_height": 22, "spacing": 2.5}])
+def test_button_layout_matches_per_button_loop(kwargs):
+    layout = button_layout(**kwargs)
+    expected = _per_button(**kwargs)
+    assert list(layout.names) == list(expected)
+    np.testing.assert_allclose(layout.points, list(expected.values()), rtol=0, atol=1e-12)
+    assert layout.big_count == 18 and not layout.points.flags.writeable
@@ -0,0 +1,77 @@
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from gigabox import golden
+from gigabox.dxf import save_geometry
+from gigabox.spec import CIRCLE, CompiledLayer, compile_layout
+from gigabox.stream import write_geometries
+
+
+def _moved_hole(layer, distance):
+    """layer with its first screw hole moved right by distance."""
+    rows = layer.rows.copy()
+    index = np.flatnonzero((rows["kind"] == CIRCLE) & np.isclose(rows["radius"], 0.2))[0]
+    rows["x"][index] += distance
+    return CompiledLayer(rows, layer.vertices), index
+
+
+@pytest.mark.parametrize("blocks", [False, True])
+def test_read_dxf_matches_compiled_layer(tmp_path, blocks):
+    layer = compile_layout(blocks=blocks).layers[2]
+    save_geometry(layer, str(tmp_path / "ezdxf.dxf"))
+    write_geometries(str(tmp_path / "stream.dxf"), [("0", layer)])
+    for name in ("ezdxf.dxf", "stream.dxf"):
+        read = golden.read_dxf(str(tmp_path / name))
+        assert list(read) == ["0"]
+        assert golden.diff_layers(layer, read["0"], 1e-9).same
+
+
+def test_diff_finds_moved_hole(tmp_path):
+    layer = compile_layout().layers[1]
+    moved, index = _moved_hole(layer, 0.05)
+    save_geometry(layer, str(tmp_path / "golden.dxf"))
+    save_geometry(moved, str(tmp_path / "new.dxf"))
+    diffs = golden.diff_files(str(tmp_path / "golden.dxf"), str(tmp_path / "new.dxf"))
+    assert list(diffs) == ["0"]
+    diff = diffs["0"]
+    assert not diff.added and not diff.removed and len(diff.moved) == 1
+    old, new = diff.moved[0]
+    assert old.kind == new.kind == "circle"
+    assert old.x == pytest.approx(layer.rows["x"][index]) and new.x == pytest.approx(old.x + 0.05)
+    assert new.y == pytest.approx(old.y)
+    # Within the tolerance the hole has not moved
+    assert golden.diff_files(str(tmp_path / "golden.dxf"), str(tmp_path / "new.dxf"), tolerance=0.1) == {}
+
+
+def test_diff_golden_set(tmp_path):
+    layers = compile_layout().layers
+    for directory in ("golden", "new"):
+        (tmp_path / directory).mkdir()
+        for key in (1, 2):
+            save_geometry(layers[key], str(tmp_path / directory / f"layer{key}.dxf"), deterministic=True)
+    save_geometry(_moved_hole(layers[2], 1)[0], str(tmp_path / "new" / "layer2.dxf"), deterministic=True)
+    save_geometry(layers[3], str(tmp_path / "golden" / "layer3.dxf"))
+    results = {result.name: result for result in golden.diff_golden(str(tmp_path / "golden"), str(tmp_path / "new"),
+                                                                    jobs=1)}
+    assert results["layer1.dxf"].same
+    assert len(results["layer2.dxf"].diffs["0"].moved) == 1
+    assert "missing" in results["layer3.dxf"].error
+
+
+def test_read_dxf_skips_other_sections(tmp_path):
+    path = tmp_path / "big.dxf"
+    save_geometry(compile_layout().layers[1], str(path))
+    text = path.read_text()
+    # A large OBJECTS section in front of the entities is read past, not kept
+    junk = "0\nSECTION\n2\nOBJECTS\n" + "0\nDICTIONARY\n5\nFF\n330\n0\n" * 200_000 + "0\nENDSEC\n"
+    path.write_text(junk + text)
+    tracemalloc.start()
+    try:
+        layers = golden.read_dxf(str(path))
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert golden.diff_layers(compile_layout().layers[1], layers["0"]).same
+    assert peak < len(junk) / 10
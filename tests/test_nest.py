@@ -0,0 +1,65 @@
+from dataclasses import replace
+
+import pytest
+
+from gigabox.geometry import DEFAULT_PARAMS
+from gigabox.golden import read_dxf
+from gigabox.nest import Part, pack, parse_sheet_sizes, variant_parts, write_sheets
+
+VARIANTS = [(f"v{i}", replace(DEFAULT_PARAMS, box_width=30 + 3 * i, box_height=16 + 2 * (i % 3))) for i in range(8)]
+
+
+def _rectangles(sheet):
+    """The (x0, y0, x1, y1) each placement covers on its sheet."""
+    for placement in sheet.placements:
+        width, height = placement.part.width, placement.part.height
+        if placement.rotated:
+            width, height = height, width
+        yield placement.x, placement.y, placement.x + width, placement.y + height
+
+
+@pytest.mark.parametrize("rotate", [True, False])
+def test_pack_has_no_overlaps(rotate):
+    parts = list(variant_parts(VARIANTS))
+    kerf = 0.1
+    sheets = pack(parts, sheet=(100, 60), kerf=kerf, rotate=rotate)
+    placed = [placement.part.name for sheet in sheets for placement in sheet.placements]
+    assert sorted(placed) == sorted(part.name for part in parts)
+    for sheet in sheets:
+        assert {placement.part.material for placement in sheet.placements} == {sheet.material}
+        rectangles = list(_rectangles(sheet))
+        for x0, y0, x1, y1 in rectangles:
+            assert x0 >= kerf - 1e-9 and y0 >= kerf - 1e-9
+            assert x1 <= sheet.width - kerf + 1e-9 and y1 <= sheet.height - kerf + 1e-9
+        for i, (ax0, ay0, ax1, ay1) in enumerate(rectangles):
+            for bx0, by0, bx1, by1 in rectangles[i + 1:]:
+                # Apart by at least the kerf on one axis
+                assert (ax1 + kerf <= bx0 + 1e-9 or bx1 + kerf <= ax0 + 1e-9 or
+                        ay1 + kerf <= by0 + 1e-9 or by1 + kerf <= ay0 + 1e-9)
+        assert 0 < sheet.utilization <= 1
+
+
+def test_pack_rejects_oversized_part():
+    part = Part("big", "3mm", None, (0, 0, 200, 10))
+    with pytest.raises(ValueError, match="does not fit"):
+        pack([part], sheet=(100, 60))
+
+
+def test_written_sheets_hold_the_parts(tmp_path):
+    parts = list(variant_parts(VARIANTS[:3], layers=[1, 6]))
+    sheets = pack(parts, sheet=(100, 60))
+    paths = write_sheets(sheets, str(tmp_path))
+    assert len(paths) == len(sheets)
+    for sheet, path in zip(sheets, paths):
+        layers = read_dxf(path)
+        assert len(layers) == len(sheet.placements)
+        for placement in sheet.placements:
+            layer = layers[placement.part.name]
+            assert len(layer.rows) == len(placement.part.geometry.explode().rows)
+            x0, y0, x1, y1 = layer.bounds()
+            assert x0 >= placement.x - 1e-6 and y0 >= placement.y - 1e-6
+            assert x1 <= sheet.width and y1 <= sheet.height
+
+
+def test_parse_sheet_sizes():
+    assert parse_sheet_sizes(["100x50", "1.6mm=60x40"]) == ((100, 50), {"1.6mm": (60, 40)})
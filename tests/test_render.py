@@ -0,0 +1,29 @@
+from dataclasses import replace
+
+import numpy as np
+import pytest
+
+from gigabox.art import render_overlay
+from gigabox.geometry import DEFAULT_PARAMS
+from gigabox.render import PreviewPyramid, _reduce, canvas_size
+from gigabox.spec import compile_layout
+
+
+@pytest.mark.parametrize("params", [DEFAULT_PARAMS, replace(DEFAULT_PARAMS, box_width=60, box_height=24)])
+def test_backends_place_the_box_alike(params):
+    pytest.importorskip("matplotlib")
+    native = render_overlay("art", params)
+    matplotlib = render_overlay("art", params, backend="matplotlib")
+    assert matplotlib.mode == "RGBA" and matplotlib.size == native.size
+    assert np.abs(np.subtract(matplotlib.getchannel("A").getbbox(), native.getbbox())).max() <= 2
+
+
+def test_pyramid_levels_match_reduced_render():
+    pyramid = PreviewPyramid(compile_layout().layers["art"], (150, 72))
+    levels = pyramid.all()
+    assert [levels[dpi].size for dpi in (150, 72)] == [canvas_size(150), canvas_size(72)]
+    assert levels["thumbnail"].width == 320
+    # Rendered directly, a level shows the same drawing as the finer level reduced
+    reduced = np.asarray(_reduce(levels[150], canvas_size(72)).getchannel("A"), float)
+    direct = np.asarray(levels[72].getchannel("A"), float)
+    assert np.corrcoef(reduced.ravel(), direct.ravel())[0, 1] > 0.8
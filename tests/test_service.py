@@ -0,0 +1,77 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+from gigabox.service import GenerationService
+
+
+async def _request(port, target, body=b""):
+    """Send one request to the service on localhost and return (status, body)."""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    method = "POST" if body else "GET"
+    writer.write(f"{method} {target} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(body)}\r\n\r\n".encode()
+                 + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, content = response.partition(b"\r\n\r\n")
+    return int(head.split()[1]), content
+
+
+async def _serving(service, test):
+    server = await asyncio.start_server(service.handle, "127.0.0.1", 0)
+    async with server:
+        try:
+            return await asyncio.wait_for(test(server.sockets[0].getsockname()[1]), 60)
+        finally:
+            service.close()
+
+
+@pytest.mark.parametrize("target, body, field", [
+    ("/dxf?box_width=0", b"", "box_width"),
+    ("/preview?box_width=-5", b"", "box_width"),
+    ("/preview?button_spacing=0", b"", "button_spacing"),
+    ("/dxf?box_height=nan", b"", "box_height"),
+    ("/preview?pico_w=inf", b"", "pico_w"),
+    ("/preview?oled_width=wide", b"", "oled_width"),
+    ("/preview", b'{"corner_radius": -1}', "corner_radius"),
+    ("/preview", b'{"button_radius": true}', "button_radius"),
+])
+def test_bad_parameters_are_rejected(target, body, field):
+    # Rejected before any work is queued, so the service needs no workers
+    service = GenerationService(jobs=1)
+    status, content = asyncio.run(_serving(service, lambda port: _request(port, target, body)))
+    assert status == 400
+    assert field in json.loads(content)["error"]
+    assert service.counters["requests"] == 0
+
+
+def test_identical_requests_share_one_job():
+    copies = 5
+    read_end, write_end = os.pipe()
+    service = GenerationService(jobs=1, max_queue=1)
+
+    async def test(port):
+        await service.start()
+        # Hold the only worker until every request is in, so they all find the job in flight
+        blocker = asyncio.get_running_loop().run_in_executor(service.executor, os.read, read_end, 1)
+        requests = [asyncio.ensure_future(_request(port, "/preview?dpi=20&box_width=36")) for _ in range(copies)]
+        while service.counters["requests"] < copies:
+            await asyncio.sleep(0.01)
+        full = await _request(port, "/preview?dpi=20&box_width=38")
+        os.write(write_end, b"x")
+        await blocker
+        return full, await asyncio.gather(*requests), json.loads((await _request(port, "/health"))[1])
+
+    try:
+        (full_status, full_body), responses, health = asyncio.run(_serving(service, test))
+    finally:
+        os.close(read_end)
+        os.close(write_end)
+    assert full_status == 503 and "queue is full" in json.loads(full_body)["error"]
+    assert [status for status, body in responses] == [200] * copies
+    assert responses[0][1].startswith(b"\x89PNG") and len({body for status, body in responses}) == 1
+    assert health["jobs"] == 1 and health["coalesced"] == copies - 1 and health["rejected"] == 1
+    assert health["in_flight"] == 0 and health["failed"] == 0
@@ -0,0 +1,169 @@
+from dataclasses import replace
+
+import numpy as np
+import pytest
+
+from gigabox.geometry import DEFAULT_PARAMS, LAYER_DRAWERS, LayerGeometry, draw_art, draw_art_bottom, record_layers
+from gigabox.spec import LayoutIR, LayoutSpec, compile_layout
+
+PARAMS = [DEFAULT_PARAMS,
+          replace(DEFAULT_PARAMS, box_width=37.5, box_height=21, button_spacing=3.1, switch_width=1.5, pico_w=2.6,
+                  corner_radius=.8, oled_width=3.2)]
+
+
+# The box as it was drawn by hand before the layout spec, kept as the reference the spec must reproduce
+
+def _rect(msp, x, y, width, height, close=False):
+    msp.add_lwpolyline([(x, y), (x + width, y), (x + width, y + height), (x, y + height), (x, y)], close=close)
+
+
+def _rounded(msp, width, height, radius, x=0, y=0):
+    msp.add_lwpolyline([(x + radius, y), (x + width - radius, y)])
+    msp.add_arc((x + width - radius, y + radius), radius, 270, 360)
+    msp.add_lwpolyline([(x + width, y + radius), (x + width, y + height - radius)])
+    msp.add_arc((x + width - radius, y + height - radius), radius, 0, 90)
+    msp.add_lwpolyline([(x + width - radius, y + height), (x + radius, y + height)])
+    msp.add_arc((x + radius, y + height - radius), radius, 90, 180)
+    msp.add_lwpolyline([(x, y + height - radius), (x, y + radius)])
+    msp.add_arc((x + radius, y + radius), radius, 180, 270)
+
+
+def _screws(msp, p):
+    w, h = p.box_width, p.box_height
+    for x, y in ((1, h - 1), (w - 1, h - 1), (1, h - (h - 1)), (w - 1, h - (h - 1)), (w / 2, h - (h - 1)),
+                 (w / 2 - 2, h - 1), (w - (w / 2 - 2), h - 1)):
+        msp.add_circle((x, y), 0.2)
+
+
+def _buttons(msp, points):
+    for x, y, radius in points.tolist():
+        msp.add_circle((x, y), radius)
+
+
+def _top_rect(msp, p, center_x, width, height, from_top):
+    _rect(msp, center_x - width / 2, p.box_height - height - from_top, width, height)
+
+
+def _oled(msp, p, width, height):
+    _rect(msp, (p.box_width - width) / 2, (p.box_height - height) / 2, width, height)
+
+
+def _oled_bottom(msp, p, height):
+    _rect(msp, p.box_width / 2 - p.oled_width / 2, p.box_height / 2 - p.oled_height / 2 - height, p.oled_width,
+          height)
+
+
+def _oled_wire(msp, p):
+    _rect(msp, p.box_width / 2 - 1.4 / 2, p.box_height / 2 + p.oled_height / 2 + .1, 1.4, .3)
+
+
+def _usb_connector(msp, p):
+    x = p.box_width / 2
+    msp.add_lwpolyline([(x - .5, p.box_height), (x - .5, p.box_height - p.pico_y_from_top),
+                        (x + .5, p.box_height - p.pico_y_from_top), (x + .5, p.box_height)])
+
+
+def _switch_square(msp, x, y, side):
+    half = side / 2
+    msp.add_lwpolyline([(x - half, y - half), (x + half, y - half), (x + half, y + half), (x - half, y + half),
+                        (x - half, y - half)], close=True)
+
+
+def _footprint(msp, x, y):
+    for cx, cy, radius in ((x, y, .25), (x - .5, y - .515, .095), (x, y + .59, .15), (x + .5, y + .38, .15),
+                           (x + .55, y, .095), (x - .55, y, .095), (x - .254, y - .508, .15),
+                           (x + .381, y - .254, .15)):
+        msp.add_circle((cx, cy), radius)
+
+
+def _reference(key, p):
+    msp = LayerGeometry()
+    layout = p.layout()
+    if key in (1, 2, "art"):
+        _buttons(msp, layout.big)
+        _buttons(msp, layout.small)
+    if key == 3:
+        for x, y, radius in layout.points.tolist():
+            _switch_square(msp, x, y, p.switch_width)
+    if key == 4:
+        for x, y, radius in layout.points.tolist():
+            _footprint(msp, x, y)
+    _screws(msp, p)
+    if key == 5:
+        for x, y, radius in layout.small.tolist():
+            _switch_square(msp, x, y, p.switch_width + .37)
+    _rounded(msp, p.box_width, p.box_height, p.corner_radius)
+    if key in (2, 3):
+        _usb_connector(msp, p)
+        _top_rect(msp, p, p.box_width / 2, p.pico_w, p.pico_h, p.pico_y_from_top)
+        _top_rect(msp, p, p.box_width - 5, 1.45, 1.45, 0)
+    if key == 2:
+        _oled_wire(msp, p)
+        _oled(msp, p, p.oled_width, p.oled_height)
+        _oled_bottom(msp, p, .8)
+    if key == 3:
+        _oled(msp, p, p.oled_width, p.oled_height)
+        _oled_bottom(msp, p, 1)
+        _rect(msp, p.box_width / 2 - p.oled_width / 2, p.box_height / 2 + p.oled_height / 2, p.oled_width, .5)
+    if key == 4:
+        center_x = p.box_width / 2
+        _top_rect(msp, p, center_x - p.pico_w / 2 + .4 / 2, .4, p.pico_h, p.pico_y_from_top)
+        _top_rect(msp, p, center_x + p.pico_w / 2 - .4 / 2, .4, p.pico_h, p.pico_y_from_top)
+        _top_rect(msp, p, p.box_width - 5, 1.45, 1.45, 0)
+        _oled_wire(msp, p)
+    if key == 5:
+        _rounded(msp, p.box_width - 4, p.box_height - 4, p.corner_radius, 2, 2)
+        _top_rect(msp, p, p.box_width / 2, 3, 1.62, p.pico_y_from_top)
+        _top_rect(msp, p, p.box_width - 5, 1.75, 1.75, .6)
+    if key == "art":
+        _oled(msp, p, 3.4, 1.9)
+    return msp.entities
+
+
+@pytest.mark.parametrize("params", PARAMS)
+@pytest.mark.parametrize("key", [1, 2, 3, 4, 5, 6, "art", "bottom"])
+def test_spec_matches_reference_drawing(params, key):
+    layers = compile_layout(params).layers
+    assert layers[key].entities == _reference(key, params)
+    assert compile_layout(params, blocks=True).layers[key].explode().entities == _reference(key, params)
+
+
+@pytest.mark.parametrize("params", PARAMS)
+def test_drawers_replay_the_spec(params):
+    layers = compile_layout(params).layers
+    for key, draw in [*LAYER_DRAWERS.items(), ("art", draw_art), ("bottom", draw_art_bottom)]:
+        geometry = LayerGeometry()
+        draw(geometry, params)
+        assert geometry.entities == layers[key].entities
+    blocks = compile_layout(params, blocks=True).layers
+    for key, geometry in record_layers(params=params, blocks=True).items():
+        assert geometry.entities == blocks[key].entities
+        assert {name: block.entities for name, block in geometry.blocks.items()} == {
+            name: block.entities for name, block in blocks[key].blocks.items()}
+
+
+def test_ir_save_load_round_trip(tmp_path):
+    ir = compile_layout(PARAMS[1], blocks=True)
+    ir.save(str(tmp_path / "ir.npz"))
+    loaded = LayoutIR.load(str(tmp_path / "ir.npz"))
+    assert list(loaded.layers) == list(ir.layers)
+    for key, layer in ir.layers.items():
+        assert loaded.layers[key].fingerprint() == layer.fingerprint()
+
+
+def _spec(expression):
+    return {"features": {"f": {"shape": "circle", "center": [expression, 0], "radius": 1}}, "layers": {"1": ["f"]}}
+
+
+@pytest.mark.parametrize("expression", ["'a' * 10", "2 ** 3", "box_width ** 2", "True + 1", "__import__('os')",
+                                        "box_width.real", "abs(box_width)", "[1][0]", "lambda: 1", "unknown + 1"])
+def test_spec_rejects_expressions(expression):
+    with pytest.raises(ValueError):
+        LayoutSpec(_spec(expression))
+
+
+def test_spec_evaluates_expressions():
+    spec = LayoutSpec(_spec("-(box_width - 4) / 2 * +3"))
+    row = spec.evaluate(replace(DEFAULT_PARAMS, box_width=10)).layers[1].rows[0]
+    assert row["x"] == -9 and row["radius"] == 1
+    assert np.isfinite(row["y"])
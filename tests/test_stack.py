@@ -0,0 +1,59 @@
+import json
+import struct
+
+import numpy as np
+import pytest
+
+from gigabox.geometry import LAYER_THICKNESS, screw_radius
+from gigabox.spec import CIRCLE, CompiledLayer, compile_layout
+from gigabox.stack import STACK_ORDER, hole_alignment, layer_loops, stack_height, stack_meshes, write_mesh
+
+
+@pytest.mark.parametrize("blocks", [False, True])
+def test_hole_alignment_passes(blocks):
+    layers = compile_layout(blocks=blocks).layers
+    missing = hole_alignment(layers)
+    assert list(missing) == list(STACK_ORDER)
+    assert all(len(centres) == 0 for centres in missing.values())
+
+
+def test_hole_alignment_finds_moved_hole():
+    layers = dict(compile_layout().layers)
+    rows = layers[3].rows.copy()
+    index = np.flatnonzero((rows["kind"] == CIRCLE) & np.isclose(rows["radius"], screw_radius))[0]
+    old = (rows["x"][index], rows["y"][index])
+    rows["x"][index] += 0.05
+    layers[3] = CompiledLayer(rows, layers[3].vertices)
+    missing = hole_alignment(layers)
+    # Layer 3 lacks the hole where it was; every other layer lacks it where it went
+    assert missing[3].tolist() == [list(old)]
+    for layer in STACK_ORDER:
+        if layer != 3:
+            assert np.allclose(missing[layer], [[old[0] + 0.05, old[1]]])
+
+
+def test_stack_meshes(tmp_path):
+    layers = compile_layout().layers
+    meshes, skipped = stack_meshes(layers)
+    assert [layer for layer, triangles in meshes] == list(STACK_ORDER)
+    assert skipped == sum(layer_loops(layers[layer])[2] for layer in STACK_ORDER)
+    bottom = 0
+    for layer, triangles in meshes:
+        assert len(triangles)
+        top = bottom + LAYER_THICKNESS[layer] / 10
+        assert triangles[..., 2].min() == pytest.approx(bottom) and triangles[..., 2].max() == pytest.approx(top)
+        bottom = top
+    assert bottom * 10 == pytest.approx(stack_height())
+
+    write_mesh(str(tmp_path / "stack.stl"), meshes)
+    data = (tmp_path / "stack.stl").read_bytes()
+    assert struct.unpack("<I", data[80:84])[0] == sum(len(triangles) for layer, triangles in meshes)
+    assert len(data) == 84 + 50 * struct.unpack("<I", data[80:84])[0]
+    write_mesh(str(tmp_path / "stack.gltf"), meshes)
+    gltf = json.loads((tmp_path / "stack.gltf").read_text())
+    assert [node["name"] for node in gltf["nodes"]] == [f"layer{layer}" for layer in STACK_ORDER]
+    write_mesh(str(tmp_path / "stack.glb"), meshes)
+    data = (tmp_path / "stack.glb").read_bytes()
+    assert struct.unpack("<4sII", data[:12]) == (b"glTF", 2, len(data))
+    with pytest.raises(ValueError):
+        write_mesh(str(tmp_path / "stack.obj"), meshes)
@@ -0,0 +1,99 @@
+import math
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from gigabox.build import build_all
+from gigabox.geometry import LayerGeometry, bulge_arc
+from gigabox.spec import INSERT, CompiledLayer, compile_layout
+from gigabox.stream import GCodeStream, PDFStream, _arc_curves, drawing_bounds, write_geometries
+
+
+def _sheet(copies):
+    """Layer 4 with its switch footprints repeated copies times over a grid."""
+    layer = compile_layout(blocks=True).layers[4]
+    inserts = layer.rows[layer.rows["kind"] == INSERT]
+    tiles = np.concatenate([inserts] * copies)
+    tiles["x"] += np.repeat(np.arange(copies) % 20 * 50.0, len(inserts))
+    tiles["y"] += np.repeat(np.arange(copies) // 20 * 30.0, len(inserts))
+    return CompiledLayer(np.concatenate([layer.rows[layer.rows["kind"] != INSERT], tiles]), layer.vertices,
+                         layer.blocks)
+
+
+@pytest.mark.parametrize("extension", [".dxf", ".svg", ".pdf", ".gcode"])
+def test_blocks_stream_like_exploded(tmp_path, extension):
+    layer = _sheet(3)
+    write_geometries(str(tmp_path / f"blocks{extension}"), [("layer4", layer)])
+    write_geometries(str(tmp_path / f"flat{extension}"), [("layer4", layer.explode())])
+    assert (tmp_path / f"blocks{extension}").read_bytes() == (tmp_path / f"flat{extension}").read_bytes()
+    # Measured on the arrays, with blocks, like on the primitives of the recorded calls
+    recorded = LayerGeometry()
+    recorded.entities = layer.explode().entities
+    assert drawing_bounds([layer]) == pytest.approx(drawing_bounds([recorded]))
+
+
+def test_write_geometries_memory_bounded(tmp_path):
+    peaks = []
+    for copies in (150, 450):
+        layer = _sheet(copies)
+        tracemalloc.start()
+        try:
+            write_geometries(str(tmp_path / "sheet.dxf"), [("0", layer)])
+            peaks.append(tracemalloc.get_traced_memory()[1])
+        finally:
+            tracemalloc.stop()
+    # Three times the sheet takes no more memory; exploding first took about 10 times the file
+    assert peaks[1] < peaks[0] * 1.2
+    assert peaks[1] < (tmp_path / "sheet.dxf").stat().st_size / 4
+
+
+def test_stream_build_matches_ezdxf_build(tmp_path):
+    from gigabox.golden import diff_files
+    for writer in ("ezdxf", "stream"):
+        assert all(result.ok for result in build_all(jobs=1, out_dir=str(tmp_path / writer), writer=writer,
+                                                     blocks=True))
+    for name in ("total.dxf", "layer4.dxf", "layer-art.dxf"):
+        assert diff_files(str(tmp_path / "ezdxf" / name), str(tmp_path / "stream" / name)) == {}
+
+
+@pytest.mark.parametrize("start, sweep", [(0, math.pi / 2), (1, 2 * math.pi), (math.pi, -3), (-0.5, -math.pi / 3)])
+def test_arc_curves_follow_the_arc(start, sweep):
+    cx, cy, radius = 1, -2, 1.5
+    curves = _arc_curves(cx, cy, radius, start, sweep)
+    assert len(curves) == max(math.ceil(abs(sweep) / (math.pi / 2) - 1e-9), 1)
+    begin = cx + radius * math.cos(start), cy + radius * math.sin(start)
+    for piece, (c1, c2, end) in enumerate(curves):
+        angle = start + sweep * (piece + 1) / len(curves)
+        assert end == pytest.approx((cx + radius * math.cos(angle), cy + radius * math.sin(angle)))
+        # The middle of each piece stays on the circle
+        mx, my = [(p0 + 3 * p1 + 3 * p2 + p3) / 8 for p0, p1, p2, p3 in zip(begin, c1, c2, end)]
+        assert math.hypot(mx - cx, my - cy) == pytest.approx(radius, rel=1e-3)
+        begin = end
+
+
+def _semicircle(stream, bulge):
+    """A polyline from (0, 0) to (2, 0) over a half circle, below for bulge 1 and above for -1."""
+    stream.add_lwpolyline([(0, 0, bulge), (2, 0, 0)], format="xyb")
+    stream.close()
+
+
+@pytest.mark.parametrize("bulge, side", [(1, -1), (-1, 1)])
+def test_pdf_bulges_become_curves_on_their_side(tmp_path, bulge, side):
+    stream = PDFStream(open(tmp_path / "arc.pdf", "wb"), (0, -1, 2, 1))
+    xy = stream._xy
+    _semicircle(stream, bulge)
+    content = (tmp_path / "arc.pdf").read_bytes().decode("latin-1")
+    path = content[content.index(f"{xy(0, 0)} m\n"):content.index("S\n", content.index(f"{xy(0, 0)} m\n"))]
+    curves = [line.split() for line in path.splitlines() if line.endswith(" c")]
+    assert len(curves) == 2
+    assert " ".join(curves[0][4:6]) == xy(1, side) and " ".join(curves[1][4:6]) == xy(2, 0)
+
+
+@pytest.mark.parametrize("bulge, code", [(1, "G3"), (-1, "G2"), (0.25, "G3"), (-0.25, "G2")])
+def test_gcode_arc_direction_follows_bulge(tmp_path, bulge, code):
+    _semicircle(GCodeStream(open(tmp_path / "arc.gcode", "w")), bulge)
+    moves = (tmp_path / "arc.gcode").read_text().splitlines()
+    cut = moves[moves.index("G0 X0.0000 Y0.0000") + 2]
+    cx, cy = bulge_arc(0, 0, 2, 0, bulge)[:2]
+    assert cut == f"{code} X20.0000 Y0.0000 I{cx * 10:.4f} J{cy * 10:.4f}"
@@ -0,0 +1,136 @@
+import math
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from gigabox.geometry import LayerGeometry, iter_primitives
+from gigabox.spec import compile_layout
+from gigabox.toolpath import Contour, merge_contours, nesting_depth, optimize_toolpath, travel, two_opt
+
+
+def _primitives(source):
+    """
+    The lines, arcs and circles of source, rounded, with lines in either
+    direction alike. Arcs come out counter clockwise, so an arc cut with the
+    wrong bulge sign bulges to the other side and does not match.
+    """
+    found = Counter()
+    for kind, *values in iter_primitives(source):
+        if kind == "line":
+            ends = sorted([tuple(round(v, 6) + 0.0 for v in values[:2]), tuple(round(v, 6) + 0.0 for v in values[2:])])
+            found[kind, tuple(ends)] += 1
+        elif kind == "arc":
+            cx, cy, radius, start, end = values
+            found[kind, round(cx, 6) + 0.0, round(cy, 6) + 0.0, round(radius, 6),
+                  round(start % 360, 4) % 360, round(end % 360, 4) % 360] += 1
+        elif kind == "circle":
+            found[kind, *(round(v, 6) + 0.0 for v in values)] += 1
+    return found
+
+
+def _slot(geometry, x, y, length, width):
+    """A slot of two lines and two arcs, the lines drawn against the direction of the arcs."""
+    radius = width / 2
+    geometry.add_lwpolyline([(x, y - radius), (x + length, y - radius)])
+    geometry.add_lwpolyline([(x, y + radius), (x + length, y + radius)])
+    geometry.add_arc((x + length, y), radius, -90, 90)
+    geometry.add_arc((x, y), radius, 90, 270)
+
+
+def _order_travel(order, position):
+    distance = 0
+    for contour in order:
+        distance += math.dist(position, contour.begin())
+        position = contour.end()
+    return distance
+
+
+@pytest.mark.parametrize("layer", [1, 2, 3, 4, 5, 6])
+def test_every_segment_is_cut_once(layer):
+    source = compile_layout().layers[layer]
+    optimized = optimize_toolpath(source)
+    assert _primitives(optimized) == _primitives(source)
+    # One pierce per contour and never more travel than cutting in drawing order
+    assert travel(optimized)[0] <= travel(source.explode())[0]
+    assert travel(optimized)[1] <= travel(source.explode())[1]
+
+
+def test_merge_flips_edges_and_their_bulges():
+    geometry = LayerGeometry()
+    _slot(geometry, 0, 0, 3, 1)
+    geometry.add_lwpolyline([(5, 0, 0.4), (6, 0, -0.7), (7, 1, 0)], format="xyb")
+    geometry.add_circle((10, 0), 0.5)
+    contours, points = merge_contours(geometry)
+    assert len(contours) == 3 and points == []
+    # Circles come first, then the chains in the order of their first edge
+    circle, slot, curve = contours
+    assert slot.closed and len(slot.points) == 4 and not curve.closed and circle.circle == (10, 0, 0.5)
+    merged = LayerGeometry()
+    for contour in contours:
+        contour.draw(merged)
+    assert _primitives(merged) == _primitives(geometry)
+
+
+def test_reversed_contour_keeps_its_arcs():
+    contour = Contour([(5, 0, 0.4), (6, 0, -0.7), (7, 1, 0)], False)
+    forward = LayerGeometry()
+    contour.draw(forward)
+    contour.reverse()
+    assert contour.points == [(7, 1, 0.7), (6, 0, -0.4), (5, 0, 0)]
+    backward = LayerGeometry()
+    contour.draw(backward)
+    assert _primitives(backward) == _primitives(forward)
+    contour.reverse()
+    assert contour.points == [(5, 0, 0.4), (6, 0, -0.7), (7, 1, 0)]
+
+
+def test_inner_contours_are_cut_first():
+    geometry = LayerGeometry()
+    for size in (10, 6, 2):
+        low, high = 5 - size / 2, 5 + size / 2
+        geometry.add_lwpolyline([(low, low), (high, low), (high, high), (low, high)], close=True)
+    geometry.add_circle((5, 5), 0.5)
+    geometry.add_circle((8.5, 5), 0.3)
+    contours, _ = merge_contours(geometry)
+    # The circles first, then the squares from the outside in
+    assert nesting_depth(contours).tolist() == [3, 1, 0, 1, 2]
+
+    optimized = optimize_toolpath(geometry)
+    boxes = []
+    for method, args, kwargs in optimized.entities:
+        if method == "add_circle":
+            (cx, cy), radius = args
+            boxes.append((cx - radius, cy - radius, cx + radius, cy + radius))
+        else:
+            xs, ys = [point[0] for point in args[0]], [point[1] for point in args[0]]
+            boxes.append((min(xs), min(ys), max(xs), max(ys)))
+    for outer, (x0, y0, x1, y1) in enumerate(boxes):
+        for inner, (a0, b0, a1, b1) in enumerate(boxes):
+            if inner != outer and a0 >= x0 and b0 >= y0 and a1 <= x1 and b1 <= y1:
+                assert inner < outer
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_two_opt_never_adds_travel(seed):
+    rng = np.random.default_rng(seed)
+    order = []
+    # Circles, closed triangles and open arcs, which two_opt reverses
+    for x, y, dx, dy in rng.uniform(-1, 1, (60, 4)) * (20, 20, 2, 2):
+        if dx > 1:
+            order.append(Contour([], True, (x, y, 0.2)))
+        elif dy > 0:
+            order.append(Contour([(x, y, 0), (x + dx, y, 0), (x, y + dy, 0)], True))
+        else:
+            order.append(Contour([(x, y, dy / 4), (x + dx, y + 1, 0)], False))
+    before = _order_travel(order, (0, 0))
+    cut = LayerGeometry()
+    for contour in order:
+        contour.draw(cut)
+    improved = two_opt(list(order), (0, 0))
+    assert _order_travel(improved, (0, 0)) <= before + 1e-9
+    assert sorted(map(id, improved)) == sorted(map(id, order))
+    reordered = LayerGeometry()
+    for contour in improved:
+        contour.draw(reordered)
+    assert _primitives(reordered) == _primitives(cut)
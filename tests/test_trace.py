@@ -0,0 +1,49 @@
+import json
+import os
+
+import pytest
+
+from gigabox import trace
+from gigabox.pool import run_bounded
+from gigabox.spec import compile_layout
+from gigabox.stack import extrude
+
+
+@pytest.fixture
+def recording():
+    trace.reset()
+    trace.record_events()
+    yield
+    trace.record_events(False)
+    trace.reset()
+
+
+def test_worker_spans_and_counters_are_merged(tmp_path, recording):
+    layers = compile_layout().layers
+    tasks = [(layers[layer], 0, 0.3) for layer in (1, 4, 6)]
+    triangles = sum(len(result[0]) for result in run_bounded(extrude, tasks, jobs=2))
+
+    rows = {line.split()[0]: line.split()[1:] for line in trace.summary().splitlines()[1:]}
+    assert rows["extrude"][0] == "3" and rows["layer_loops"][0] == "3"
+    assert rows["stack.triangles"] == [str(triangles)]
+
+    trace.write_chrome_trace(str(tmp_path / "trace.json"))
+    with open(tmp_path / "trace.json") as f:
+        events = json.load(f)["traceEvents"]
+    spans = [event for event in events if event["ph"] == "X" and event["name"] == "extrude"]
+    assert len(spans) == 3 and all(event["dur"] > 0 for event in spans)
+    # Recorded in the workers, not here
+    assert os.getpid() not in {event["pid"] for event in spans}
+    counters = {event["name"]: event["args"]["value"] for event in events if event["ph"] == "C"}
+    assert counters["stack.triangles"] == triangles
+
+
+def test_drain_and_merge(recording):
+    with trace.span("outer", size=2):
+        trace.count("things", 2)
+    recorded = trace.drain()
+    assert trace.drain() == {"totals": {}, "counters": {}, "events": []}
+    trace.merge(recorded)
+    trace.merge(recorded)
+    assert trace.drain()["totals"]["outer"][0] == 2 and recorded["counters"] == {"things": 2}
+    assert recorded["events"][0][0] == "outer" and recorded["events"][0][-1] == {"size": 2}